@@ -0,0 +1,348 @@
+"""Команда замера производительности парсинга, сохранения и загрузки данных"""
+import contextlib
+import copy
+import datetime
+import io
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import tempfile
+import time
+
+import django
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test import override_settings
+
+from parser import client, parsers
+from parser.replay import PAGES_DIR, ReplayServer
+from stock import models
+from stock.cache import lookup_cache
+
+
+def measure(func, repeat=1, setup=None):
+    """Замер времени выполнения функции
+
+    Args:
+        func(function): Замеряемая функция
+        repeat(int): Количество повторов
+        setup(function): Подготовка перед каждым повтором (в замер не входит)
+
+    Returns:
+        dict: Время в секундах
+    """
+    times = []
+    for _ in range(repeat):
+        if setup:
+            setup()
+        started = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - started)
+
+    return {
+        'repeat': repeat,
+        'min': min(times),
+        'median': statistics.median(times),
+        'mean': statistics.mean(times),
+        'max': max(times),
+    }
+
+
+class Command(BaseCommand):
+    """Замер производительности загрузки на сохраненных страницах parser/tests/files_example
+
+    Сохранение и полная загрузка замеряются на отдельной тестовой БД,
+    полная загрузка выполняется с локального сервера parser.replay.
+    Результат выводится в json для сравнения между коммитами.
+    """
+    help = 'Замер производительности парсинга, сохранения и загрузки данных (результат в json)'
+
+    def add_arguments(self, parser):
+        """
+        Добавление дополнительных параметров для команды
+
+        Args:
+            parser (argparse.ArgumentParser)
+        """
+        parser.add_argument(
+            '--repeat',
+            type=int,
+            default=10,
+            help='Количество повторов замеров парсинга и сохранения'
+        )
+
+        parser.add_argument(
+            '--symbols',
+            type=int,
+            default=20,
+            help='Количество компаний для замера полной загрузки'
+        )
+
+        parser.add_argument(
+            '--trade-pages',
+            type=int,
+            default=5,
+            help='Количество страниц торгов каждой компании для замера полной загрузки'
+        )
+
+        parser.add_argument(
+            '--count_threads', '--count',
+            type=int,
+            default=10,
+            help='Количество потоков (одновременных запросов) для замера полной загрузки'
+        )
+
+        parser.add_argument(
+            '--engine',
+            type=str,
+            action='append',
+            choices=client.ENGINES,
+            default=None,
+            help='Движок для замера полной загрузки (можно указать несколько, по умолчанию - все)'
+        )
+
+        parser.add_argument(
+            '--skip-end-to-end',
+            action='store_true',
+            default=False,
+            help='Не замерять полную загрузку'
+        )
+
+        parser.add_argument(
+            '--delta-days',
+            type=int,
+            default=2500,
+            help='Количество дней синтетического ряда цен для замера Stock.get_delta и аналитики'
+        )
+
+        parser.add_argument(
+            '--skip-delta',
+            action='store_true',
+            default=False,
+            help='Не замерять Stock.get_delta'
+        )
+
+        parser.add_argument(
+            '--skip-analytics',
+            action='store_true',
+            default=False,
+            help='Не замерять Stock.get_analytics_by_symbol_and_dates'
+        )
+
+        parser.add_argument(
+            '--output', '-o',
+            type=str,
+            default=None,
+            help='Файл для результата (по умолчанию - вывод в консоль)'
+        )
+
+    def handle(self, *args, **options):
+        """Обработчик события
+
+        Args:
+            *args
+            **options: Значения параметров команды (см. add_arguments)
+
+        """
+        repeat = options['repeat']
+        pages = {}
+        for page_type, file_name in (('stock', 'stock.html'), ('trade', 'trade.html')):
+            with open(os.path.join(PAGES_DIR, file_name), 'r') as file:
+                pages[page_type] = file.read()
+
+        results = {}
+        results.update(self._bench_parse(pages, repeat))
+
+        # Сохранение и загрузка пишут в отдельную тестовую БД
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            if connection.vendor == 'sqlite':
+                connection.settings_dict['TEST']['NAME'] = os.path.join(tmp_dir, 'bench.sqlite3')
+            old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+            try:
+                results.update(self._bench_store(pages, repeat))
+                date_from, date_to = self._store_series(options['delta_days'])
+                if not options['skip_delta']:
+                    results.update(self._bench_delta(options['delta_days'], repeat))
+                if not options['skip_analytics']:
+                    results.update(self._bench_analytics(date_from, date_to, repeat))
+                if not options['skip_end_to_end']:
+                    results.update(self._bench_end_to_end(options))
+            finally:
+                lookup_cache.clear()
+                connection.creation.destroy_test_db(old_name, verbosity=0)
+
+        report = json.dumps({'meta': self._meta(), 'results': results}, indent=2, sort_keys=True)
+        if options['output']:
+            with open(options['output'], 'w') as file:
+                file.write(report)
+        else:
+            self.stdout.write(report)
+
+    @staticmethod
+    def _bench_parse(pages, repeat):
+        results = {}
+        parser_classes = {'stock': parsers.ParserStock, 'trade': parsers.ParserTrade}
+        for backend in sorted(parsers.BACKENDS):
+            for scoped in (False, True):
+                for page_type, parser_class in parser_classes.items():
+                    name = 'parse.{}.{}.{}'.format(page_type, backend, 'scoped' if scoped else 'full')
+                    results[name] = measure(
+                        lambda: parser_class(pages[page_type], backend=backend, scoped=scoped).get_data(),
+                        repeat=repeat,
+                    )
+                    results[name + '.columnar'] = measure(
+                        lambda: parser_class(pages[page_type], backend=backend, scoped=scoped).get_data(columnar=True),
+                        repeat=repeat,
+                    )
+
+        return results
+
+    @staticmethod
+    def _bench_store(pages, repeat):
+        stock_data = parsers.parse_page('stock', pages['stock'])
+        stock_data.update({'company_symbol': 'bench'})
+        trade_data = parsers.parse_page('trade', pages['trade'])
+        trade_data.update({'company_symbol': 'bench'})
+
+        def clear():
+            models.Stock.objects.all().delete()
+            models.Trade.objects.all().delete()
+
+        stock_columns = parsers.parse_page('stock', pages['stock'], columnar=True)
+        stock_columns.update({'company_symbol': 'bench'})
+        trade_columns = parsers.parse_page('trade', pages['trade'], columnar=True)
+        trade_columns.update({'company_symbol': 'bench'})
+
+        return {
+            'store.stock.columnar.insert': measure(
+                lambda: models.Stock.store_stocks(copy.deepcopy(stock_columns)), repeat=repeat, setup=clear),
+            'store.stock.columnar.unchanged': measure(
+                lambda: models.Stock.store_stocks(copy.deepcopy(stock_columns)), repeat=repeat),
+            'store.trade.columnar.insert': measure(
+                lambda: models.Trade.store_trades(copy.deepcopy(trade_columns)), repeat=repeat, setup=clear),
+            'store.trade.columnar.unchanged': measure(
+                lambda: models.Trade.store_trades(copy.deepcopy(trade_columns)), repeat=repeat),
+            'store.stock.insert': measure(
+                lambda: models.Stock.store_stocks(copy.deepcopy(stock_data)), repeat=repeat, setup=clear),
+            'store.stock.unchanged': measure(
+                lambda: models.Stock.store_stocks(copy.deepcopy(stock_data)), repeat=repeat),
+            'store.trade.insert': measure(
+                lambda: models.Trade.store_trades(copy.deepcopy(trade_data)), repeat=repeat, setup=clear),
+            'store.trade.unchanged': measure(
+                lambda: models.Trade.store_trades(copy.deepcopy(trade_data)), repeat=repeat),
+        }
+
+    @staticmethod
+    def _store_series(days):
+        # Случайное блуждание цены, seed фиксирован для сравнения между коммитами
+        rnd = random.Random(0)
+        price = 100.0
+        stocks = []
+        start = datetime.date(2000, 1, 1)
+        for i in range(days):
+            price = max(1.0, price + rnd.gauss(0, 1))
+            stocks.append({
+                'date': start + datetime.timedelta(days=i),
+                'open': price, 'high': price, 'low': price, 'close': price, 'volume': 0,
+            })
+        models.Stock.store_stocks({'company_symbol': 'benchdelta', 'company_industry': 'bench', 'stocks': stocks})
+        return stocks[0]['date'], stocks[-1]['date']
+
+    @staticmethod
+    def _bench_analytics(date_from, date_to, repeat):
+        args = {'symbol': 'benchdelta', 'date_from': date_from, 'date_to': date_to}
+
+        def bench(suffix=''):
+            return {
+                # Чтение тех же дней без аналитики - нижняя граница стоимости запроса аналитики
+                'analytics.range_read' + suffix: measure(
+                    lambda: models.Stock.get_by_symbol_and_date(
+                        field_values=['date'] + models.Stock._COLS_VALUES, **args),
+                    repeat=repeat),
+                'analytics.vectorized' + suffix: measure(
+                    lambda: models.Stock.get_analytics_by_symbol_and_dates(**args), repeat=repeat),
+            }
+
+        results = bench()
+        # Те же запросы из хранилища для чтения (файл компании строится при первом запросе)
+        with tempfile.TemporaryDirectory() as store_dir, override_settings(STOCK_COLUMN_STORE_DIR=store_dir):
+            results.update(bench('.column_store'))
+        return results
+
+    @staticmethod
+    def _bench_delta(days, repeat):
+        def pairs(result):
+            # В SQLite разность дат в SQL версии не считается, сравниваются только даты периодов
+            return {key: sorted((str(i[1]), str(i[2])) for i in value) for key, value in result.items()}
+
+        args = {'symbol': 'benchdelta', 'column_type': 'close', 'max_change_price': 10}
+        result_sql = {}
+        result_engine = {}
+        results = {
+            'delta.sql': measure(
+                lambda: result_sql.update(models.Stock.get_delta_sql(**args)), repeat=max(1, repeat // 5)),
+            # Ряд цен записывается при сохранении акций, без него запрос строит ряд по акциям
+            'delta.series_build': measure(
+                lambda: models.PriceSeries.get_by_symbol('benchdelta'),
+                repeat=repeat, setup=lambda: models.PriceSeries.objects.all().delete()),
+            'delta.engine': measure(
+                lambda: result_engine.update(models.Stock.get_delta(**args)), repeat=repeat),
+        }
+        for result in results.values():
+            result['days'] = days
+        results['delta.engine']['same_result'] = pairs(result_sql) == pairs(result_engine)
+        return results
+
+    @staticmethod
+    def _bench_end_to_end(options):
+        def clear():
+            models.Company.objects.all().delete()
+            lookup_cache.clear()
+
+        symbols = ['bench{}'.format(i) for i in range(options['symbols'])]
+        count_pages = len(symbols) * (1 + options['trade_pages'])
+
+        results = {}
+        with ReplayServer(trade_pages=options['trade_pages']) as server:
+            for engine in options['engine'] or client.ENGINES:
+                def run():
+                    # Вывод задач в консоль в замер не входит
+                    with contextlib.redirect_stdout(io.StringIO()):
+                        client.start(
+                            count_tread=options['count_threads'],
+                            symbols=symbols,
+                            engine=engine,
+                            trade_mode='full',
+                            trade_pages=options['trade_pages'],
+                            base_url=server.base_url,
+                            progress_interval=0,
+                        )
+
+                result = measure(run, setup=clear)
+                result['pages'] = count_pages
+                result['pages_per_second'] = count_pages / result['median']
+                results['end_to_end.{}'.format(engine)] = result
+
+        return results
+
+    @staticmethod
+    def _meta():
+        try:
+            commit = subprocess.check_output(
+                ['git', 'rev-parse', 'HEAD'], stderr=subprocess.DEVNULL, cwd=client._ROOT_DIR
+            ).decode().strip()
+        except (OSError, subprocess.CalledProcessError):
+            commit = None
+
+        return {
+            'commit': commit,
+            'created': datetime.datetime.now().isoformat(),
+            'python': platform.python_version(),
+            'django': django.get_version(),
+            'database': connection.vendor,
+            'parser_backends': sorted(parsers.BACKENDS),
+            'cpu_count': os.cpu_count(),
+        }
@@ -0,0 +1,45 @@
+"""Команда построения файлов хранилища акций для чтения"""
+from django.core.management.base import BaseCommand, CommandError
+
+from stock import column_store, models
+
+
+class Command(BaseCommand):
+    """Построение по БД файлов компаний хранилища stock/column_store.py, которых еще нет"""
+    help = 'Построение файлов хранилища акций для чтения (STOCK_COLUMN_STORE_DIR) по БД'
+
+    def add_arguments(self, parser):
+        """
+        Добавление дополнительных параметров для команды
+
+        Args:
+            parser (argparse.ArgumentParser)
+        """
+        parser.add_argument(
+            '--symbol',
+            type=str,
+            default=None,
+            help='Сокращенное название компании (по умолчанию все компании)'
+        )
+
+    def handle(self, *args, **options):
+        """Обработчик события
+
+        Args:
+            *args
+            **options: Значения параметров команды (см. add_arguments)
+
+        """
+        if column_store.get_store() is None:
+            raise CommandError('Хранилище не настроено: укажите STOCK_COLUMN_STORE_DIR')
+
+        symbols = models.Company.objects.order_by('symbol').values_list('symbol', flat=True)
+        if options['symbol']:
+            symbols = symbols.filter(symbol=options['symbol'])
+
+        built = 0
+        for symbol in list(symbols):
+            if models.Stock.update_column_store(symbol, []):
+                built += 1
+
+        self.stdout.write('Файлов компаний в хранилище: {}'.format(built))
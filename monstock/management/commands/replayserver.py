@@ -0,0 +1,113 @@
+"""Команда запуска локального сервера сохраненных страниц источника"""
+import contextlib
+import io
+import time
+
+from django.core.management.base import BaseCommand
+
+from parser import client
+from parser.replay import PAGES_DIR, ReplayServer
+
+
+class Command(BaseCommand):
+    """Локальный сервер страниц https://www.nasdaq.com для нагрузочного тестирования runscan"""
+    help = 'Запуск локального сервера сохраненных страниц источника (runscan --base-url http://127.0.0.1:8001)'
+
+    def add_arguments(self, parser):
+        """
+        Добавление дополнительных параметров для команды
+
+        Args:
+            parser (argparse.ArgumentParser)
+        """
+        parser.add_argument('--host', type=str, default='127.0.0.1', help='Адрес')
+        parser.add_argument('--port', type=int, default=8001, help='Порт')
+        parser.add_argument(
+            '--pages-dir',
+            type=str,
+            default=PAGES_DIR,
+            help='Каталог сохраненных страниц (stock.html, trade.html, <symbol>/trade_<N>.html)'
+        )
+        parser.add_argument(
+            '--trade-pages',
+            type=int,
+            default=35,
+            help='Количество страниц торгов у каждой компании'
+        )
+        parser.add_argument('--latency', type=float, default=0, help='Задержка ответа в секундах')
+        parser.add_argument('--jitter', type=float, default=0, help='Разброс задержки в секундах (+-)')
+        parser.add_argument('--error-rate', type=float, default=0, help='Доля ответов с ошибкой 503 (от 0 до 1)')
+        parser.add_argument(
+            '--throttle',
+            type=int,
+            default=None,
+            help='Максимальное количество запросов в секунду, сверх него - ответ 429 с Retry-After'
+        )
+        parser.add_argument('--seed', type=int, default=None, help='Начальное значение генератора случайных чисел')
+        parser.add_argument(
+            '--load',
+            type=int,
+            default=None,
+            help='Нагрузочный тест: запустить runscan по указанному количеству вымышленных компаний '
+                 'против этого сервера и вывести пропускную способность'
+        )
+        parser.add_argument(
+            '--count_threads', '--count',
+            type=int,
+            default=10,
+            help='Количество потоков runscan для нагрузочного теста'
+        )
+        parser.add_argument(
+            '--engine',
+            type=str,
+            choices=client.ENGINES,
+            default='thread',
+            help='Движок runscan для нагрузочного теста'
+        )
+
+    def handle(self, *args, **options):
+        """Обработчик события
+
+        Args:
+            *args
+            **options: Значения параметров команды (см. add_arguments)
+
+        """
+        server = ReplayServer(
+            host=options['host'],
+            port=options['port'],
+            pages_dir=options['pages_dir'],
+            trade_pages=options['trade_pages'],
+            latency=options['latency'],
+            jitter=options['jitter'],
+            error_rate=options['error_rate'],
+            throttle=options['throttle'],
+            seed=options['seed'],
+        )
+
+        if not options['load']:
+            self.stdout.write('Сервер запущен на {}'.format(server.base_url))
+            try:
+                server.serve_forever()
+            except KeyboardInterrupt:
+                pass
+            return
+
+        symbols = ['load{}'.format(i) for i in range(options['load'])]
+        with server:
+            started = time.perf_counter()
+            with contextlib.redirect_stdout(io.StringIO()):
+                client.start(
+                    count_tread=options['count_threads'],
+                    symbols=symbols,
+                    engine=options['engine'],
+                    trade_mode='full',
+                    trade_pages=options['trade_pages'],
+                    base_url=server.base_url,
+                )
+            elapsed = time.perf_counter() - started
+
+        self.stdout.write('Компаний: {}, запросов: {}, ошибок: {}, ограничено: {}'.format(
+            len(symbols), server.stats['requests'], server.stats['errors'], server.stats['throttled']))
+        self.stdout.write('Время: {:.2f} с, запросов в секунду: {:.1f}'.format(
+            elapsed, server.stats['requests'] / elapsed))
@@ -1,7 +1,10 @@
 """Описание команд"""
 from django.core.management.base import BaseCommand
 
-from parser.client import start
+from parser.client import ENGINES, HTTP_CACHE_DIR, TASK_QUEUE_SIZE, TRADE_MODES, enqueue, start
+from parser.journal import LEASE_TIMEOUT
+from parser.parsers import BACKENDS
+from parser.resilience import Resilience
 
 
 class LoadStocksAndTrades(BaseCommand):
@@ -22,21 +25,323 @@ class LoadStocksAndTrades(BaseCommand):
             help='Загрузка по краткому наименование компании'
         )
 
+        parser.add_argument(
+            '--tickers',
+            type=str,
+            default=None,
+            help='Файл со списком компаний, читается построчно по мере загрузки '
+                 '(по умолчанию tickers.txt, - - стандартный ввод)'
+        )
+
+        parser.add_argument(
+            '--from-db',
+            action='store_true',
+            help='Загрузить компании, уже сохраненные в базе данных'
+        )
+
+        parser.add_argument(
+            '--max-tasks',
+            type=int,
+            default=TASK_QUEUE_SIZE,
+            help='Размер очереди задач: источник компаний ждет, пока исполнители ее не освободят'
+        )
+
+        parser.add_argument(
+            '--resume',
+            action='store_true',
+            help='Продолжить прерванную загрузку: выполнить незавершенные задачи журнала '
+                 '(в том числе найденные страницы торгов) и задачи источника, которых еще нет в журнале'
+        )
+
+        parser.add_argument(
+            '--journal',
+            action='store_true',
+            help='Вести журнал задач, чтобы прерванную загрузку можно было продолжить через --resume. '
+                 'Журнал предыдущей загрузки при этом очищается'
+        )
+
+        parser.add_argument(
+            '--enqueue',
+            action='store_true',
+            help='Добавить задачи источника компаний в общую очередь в БД для процессов --worker '
+                 '(завершенные задачи возвращаются в очередь)'
+        )
+
+        parser.add_argument(
+            '--worker',
+            action='store_true',
+            help='Выполнять задачи общей очереди в БД вместе с другими процессами, '
+                 'на этой или других машинах; завершается, когда очередь пуста'
+        )
+
+        parser.add_argument(
+            '--lease-timeout',
+            type=float,
+            default=LEASE_TIMEOUT,
+            help='Длительность аренды задачи процессом --worker в секундах, '
+                 'после нее задачу упавшего процесса захватывает другой процесс'
+        )
+
+        parser.add_argument(
+            '--daemon',
+            action='store_true',
+            help='Непрерывное обновление: компании источника добавляются в расписание, '
+                 'данные обновляются по мере устаревания (в первую очередь самые устаревшие), '
+                 'пока процесс не остановлен'
+        )
+
+        parser.add_argument(
+            '--interval',
+            type=float,
+            default=3600,
+            help='Интервал обновления компании в секундах для --daemon'
+        )
+
+        parser.add_argument(
+            '--watch',
+            type=str,
+            default=None,
+            help='Отслеживаемые компании через запятую для --daemon (обновляются раз в --watch-interval)'
+        )
+
+        parser.add_argument(
+            '--watch-interval',
+            type=float,
+            default=300,
+            help='Интервал обновления отслеживаемой компании в секундах для --daemon'
+        )
+
+        parser.add_argument(
+            '--duration',
+            type=float,
+            default=None,
+            help='Длительность работы --daemon в секундах (по умолчанию - пока процесс не остановлен)'
+        )
+
+        parser.add_argument(
+            '--budget',
+            type=float,
+            default=None,
+            help='Общий бюджет запросов в минуту ко всем хостам, запросы распределяются равномерно '
+                 '(по умолчанию без ограничения)'
+        )
+
+        parser.add_argument(
+            '--base-url',
+            type=str,
+            default=None,
+            help='Адрес источника (по умолчанию https://www.nasdaq.com), '
+                 'например локального сервера команды replayserver'
+        )
+
         parser.add_argument(
             '--count_threads', '--count',
             type=int,
             default=10,
-            help='Количество потоков'
+            help='Количество потоков (для движка async - количество одновременных запросов)'
         )
 
-    def handle(self, *args, count_threads=10, symbol=None, **options):
+        parser.add_argument(
+            '--engine',
+            type=str,
+            choices=ENGINES,
+            default='thread',
+            help='Движок загрузки: thread - пул потоков, async - asyncio, '
+                 'pipeline - конвейер загрузка/парсинг в процессах/сохранение'
+        )
+
+        parser.add_argument(
+            '--parse-processes',
+            type=int,
+            default=None,
+            help='Количество процессов парсинга для движка pipeline (по умолчанию - количество ядер)'
+        )
+
+        parser.add_argument(
+            '--store-threads',
+            type=int,
+            default=None,
+            help='Количество потоков сохранения для движка pipeline'
+        )
+
+        parser.add_argument(
+            '--queue-size',
+            type=int,
+            default=None,
+            help='Размер очередей между стадиями движка pipeline'
+        )
+
+        parser.add_argument(
+            '--parser-backend',
+            type=str,
+            choices=sorted(BACKENDS),
+            default=None,
+            help='Реализация разбора страниц (по умолчанию - самая быстрая доступная, lxml)'
+        )
+
+        parser.add_argument(
+            '--http-cache',
+            type=str,
+            nargs='?',
+            const=HTTP_CACHE_DIR,
+            default=None,
+            help='Каталог кэша ответов источника (без значения - {}), '
+                 'неизменившиеся страницы не парсятся и не сохраняются'.format(HTTP_CACHE_DIR)
+        )
+
+        parser.add_argument(
+            '--trade-mode',
+            type=str,
+            choices=TRADE_MODES,
+            default='incremental',
+            help='Режим загрузки страниц торгов: incremental - до первой страницы без новых торгов, '
+                 'full - все страницы до --trade-pages'
+        )
+
+        parser.add_argument(
+            '--trade-pages',
+            type=int,
+            default=10,
+            help='Максимальное количество страниц торгов компании'
+        )
+
+        parser.add_argument(
+            '--rate',
+            type=float,
+            default=None,
+            help='Максимальное количество запросов в секунду к одному хосту (по умолчанию без ограничения)'
+        )
+
+        parser.add_argument(
+            '--burst',
+            type=int,
+            default=None,
+            help='Максимальное количество запросов подряд без паузы при ограничении --rate'
+        )
+
+        parser.add_argument(
+            '--timeout',
+            type=float,
+            default=30,
+            help='Таймаут запроса в секундах'
+        )
+
+        parser.add_argument(
+            '--max-attempts',
+            type=int,
+            default=5,
+            help='Максимальное количество попыток запроса (повтор при ошибках соединения, 429 и 5xx)'
+        )
+
+        parser.add_argument(
+            '--breaker-threshold',
+            type=int,
+            default=5,
+            help='Количество ошибок подряд, после которого хост ставится на паузу'
+        )
+
+        parser.add_argument(
+            '--breaker-timeout',
+            type=float,
+            default=30,
+            help='Длительность паузы хоста в секундах'
+        )
+
+        parser.add_argument(
+            '--max-retry-after',
+            type=float,
+            default=60,
+            help='Максимальная пауза по заголовку Retry-After в секундах'
+        )
+
+        parser.add_argument(
+            '--progress-interval',
+            type=float,
+            default=10,
+            help='Период вывода текущей пропускной способности в секундах (0 - не выводить)'
+        )
+
+        parser.add_argument(
+            '--metrics-output',
+            type=str,
+            default=None,
+            help='Путь до JSON файла итогового отчета: счетчики, пропускная способность, '
+                 'задержки загрузки/парсинга/сохранения (p50/p95/p99) по типам задач'
+        )
+
+        parser.add_argument(
+            '--pool-size',
+            type=int,
+            default=10,
+            help='Максимальное количество одновременных HTTP соединений ко всем хостам (для всех движков)'
+        )
+
+        parser.add_argument(
+            '--per-host',
+            type=int,
+            default=10,
+            help='Максимальное количество одновременных соединений к одному хосту'
+        )
+
+    def handle(self, *args, **options):
         """Обработчик события
 
         Args:
             *args
-            count_threads(int): Количество потоков
-            symbol(str): Краткое название компании
-            **options
+            **options: Значения параметров команды (см. add_arguments)
 
         """
-        start(count_tread=count_threads, symbol=symbol)
+        if options['enqueue']:
+            count = enqueue(
+                symbol=options['symbol'],
+                tickers=options['tickers'],
+                from_db=options['from_db'],
+                base_url=options['base_url'],
+            )
+            self.stdout.write('В очередь добавлено задач: {}'.format(count))
+            if not options['worker']:
+                return
+
+        start(
+            count_tread=options['count_threads'],
+            symbol=options['symbol'],
+            engine=options['engine'],
+            pool_size=options['pool_size'],
+            per_host=options['per_host'],
+            num_parse=options['parse_processes'],
+            num_store=options['store_threads'],
+            queue_size=options['queue_size'],
+            parser_backend=options['parser_backend'],
+            http_cache=options['http_cache'],
+            trade_mode=options['trade_mode'],
+            trade_pages=options['trade_pages'],
+            base_url=options['base_url'],
+            tickers=options['tickers'],
+            from_db=options['from_db'],
+            max_tasks=options['max_tasks'],
+            progress_interval=options['progress_interval'],
+            metrics_output=options['metrics_output'],
+            journal=options['journal'],
+            resume=options['resume'],
+            worker=options['worker'],
+            lease_timeout=options['lease_timeout'],
+            daemon=options['daemon'],
+            interval=options['interval'],
+            watch_interval=options['watch_interval'],
+            duration=options['duration'],
+            watch=[i for i in options['watch'].split(',') if i] if options['watch'] is not None else None,
+            resilience=Resilience(
+                rate=options['rate'],
+                burst=options['burst'],
+                timeout=options['timeout'],
+                max_attempts=options['max_attempts'],
+                breaker_threshold=options['breaker_threshold'],
+                breaker_timeout=options['breaker_timeout'],
+                budget=options['budget'],
+                max_retry_after=options['max_retry_after'],
+            ),
+        )
+
+
+# Django ищет команду по имени Command
+Command = LoadStocksAndTrades
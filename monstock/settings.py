@@ -76,9 +76,19 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': 'monstock',
+        # Тестовая БД в файле, а не в памяти: в памяти SQLite сразу отказывает конкурирующей
+        # записи ("database table is locked"), а не ждет блокировку, как с файлом
+        'TEST': {
+            'NAME': 'monstock_test',
+        },
     }
 }
 
+# Каталог хранилища акций для чтения (stock/column_store.py): файл на компанию,
+# отображаемый в память. None - акции читаются только из БД.
+# Должен быть одинаковым у всех процессов, сохраняющих и читающих акции
+STOCK_COLUMN_STORE_DIR = None
+
 # Internationalization
 # https://docs.djangoproject.com/en/2.1/topics/i18n/
 
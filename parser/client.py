@@ -1,21 +1,50 @@
 """Модуль загрузки данных и сохранения данных"""
+import asyncio
+import json
 import os
 import re
+import sys
 import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from functools import wraps
 from queue import Queue
 
 import requests
+from django.db import close_old_connections
 
 from parser import parsers
+from parser.http_cache import NullResponseCache, ResponseCache
+from parser.journal import LEASE_TIMEOUT, NullTaskJournal, SharedTaskQueue, TaskJournal
+from parser.metrics import Metrics, ProgressReporter
+from parser.resilience import FetchError, Resilience
+from parser.scheduler import RefreshScheduler
+from parser.session import SessionPool
 from stock import models
-
+from stock.cache import lookup_cache
+
+# Адрес источника
+_URL_BASE = 'https://www.nasdaq.com'
+# Шаблон пути до акций компании
+_PATH_STOCK = '/symbol/{}/historical'
+# Шаблон пути до торгов компании
+_PATH_TRADE = '/symbol/{}/insider-trades'
 # Шаблон ссылки до акции компаниц
-_URL_STOCK = 'https://www.nasdaq.com/symbol/{}/historical'
+_URL_STOCK = _URL_BASE + _PATH_STOCK
 # Шаблон ссылки до торгов компании
-_URL_TRADE = 'https://www.nasdaq.com/symbol/{}/insider-trades'
+_URL_TRADE = _URL_BASE + _PATH_TRADE
 # Путь до корня проекта
 _ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Каталог кэша ответов источника по умолчанию
+HTTP_CACHE_DIR = os.path.join(_ROOT_DIR, '.cache', 'http')
+# Количество попыток обработки страницы при исключении NotFoundData
+_COUNT_RETRY = 5
+# Доступные движки загрузки
+ENGINES = ('thread', 'async', 'pipeline')
+# Режимы загрузки страниц торгов
+TRADE_MODES = ('incremental', 'full')
+# Максимальное количество задач в очереди, ожидающих загрузки
+TASK_QUEUE_SIZE = 1000
 
 
 def retry(count=5):
@@ -33,27 +62,271 @@ def retry(count=5):
         def wrapper(*args, **kwargs):
             for _ in range(count):
                 try:
-                    func(*args, **kwargs)
+                    return func(*args, **kwargs)
                 except parsers.NotFoundData:
                     continue
 
-                break
-
         return wrapper
 
     return decorator
 
 
+class TaskHandler:
+    """Загрузка, парсинг и сохранение страницы задачи, общие для всех движков"""
+
+    def __init__(self, session=None, cache=None, resilience=None, trade_mode='incremental', trade_pages=10,
+                 metrics=None, journal=None):
+        """
+        Args:
+            session(SessionPool): Пул HTTP соединений
+            cache(ResponseCache): Кэш ответов
+            resilience(Resilience): Политика ограничения частоты запросов, таймаутов и повторов
+            trade_mode(str): Режим загрузки страниц торгов:
+                incremental - страницы загружаются по очереди до первой страницы без новых торгов,
+                full - загрузить все страницы до trade_pages (если известно количество страниц,
+                    все оставшиеся страницы ставятся в очередь сразу после первой)
+            trade_pages(int): Максимальное количество страниц торгов компании
+            metrics(Metrics): Метрики загрузки
+            journal(TaskJournal): Журнал задач для продолжения прерванной загрузки
+        """
+        if trade_mode not in TRADE_MODES:
+            raise Exception('Неизвестный режим {}, доступны {}'.format(trade_mode, TRADE_MODES))
+
+        self.session = session or SessionPool()
+        self.cache = cache or NullResponseCache()
+        self.resilience = resilience or Resilience()
+        self.trade_mode = trade_mode
+        self.trade_pages = trade_pages
+        self.metrics = metrics or Metrics()
+        self.journal = journal or NullTaskJournal()
+
+    @retry(count=_COUNT_RETRY)
+    def run(self, task):
+        """Загрузка, парсинг и сохранение страницы задачи
+
+        Args:
+            task(dict): Задача
+
+        Returns:
+            list of dict: Новые задачи (следующие страницы торгов)
+        """
+        page, entry = self.fetch(task)
+        if page is None:
+            return []
+
+        data = self.parse(task, page)
+        return self.store(task, data, entry)
+
+    def parse(self, task, page):
+        """Разбор страницы задачи
+
+        Args:
+            task(dict): Задача
+            page(str): Текст страницы
+
+        Returns:
+            dict: Результат parsers.parse_page
+        """
+        with self.metrics.timer('parse', task['task_type']):
+            try:
+                return parsers.parse_page(task['task_type'], page, columnar=True)
+            except parsers.NotFoundData:
+                self.metrics.incr('parse_retries')
+                raise
+
+    def fetch(self, task):
+        """Загрузка страницы условным запросом
+
+        Args:
+            task(dict): Задача
+
+        Returns:
+            tuple: (текст страницы, валидаторы ответа для store),
+                текст None если страница не изменилась с прошлой обработки
+        """
+        url = task['url']
+        self.journal.started(task)
+        with self.metrics.timer('fetch', task['task_type']):
+            response = self._get(url)
+            page = response.text
+        entry = self.cache.entry(task['task_type'], response.status_code, response.headers, page)
+        if self.cache.is_unchanged(url, response.status_code, entry):
+            print('not modified', url)
+            self.not_modified(task)
+            return None, None
+
+        return page, entry
+
+    def _get(self, url):
+        """Условный запрос с ограничением частоты, таймаутом и повторами
+
+        Args:
+            url(str): Ссылка
+
+        Returns:
+            requests.Response
+        """
+        resilience = self.resilience
+        error = None
+        delay = 0
+        for attempt in range(resilience.max_attempts):
+            # Пауза перед повтором: после последней попытки не ждем
+            if attempt:
+                self.metrics.incr('fetch_retries')
+                time.sleep(delay)
+            time.sleep(resilience.delay_before(url))
+            try:
+                response = self.session.get(
+                    url, headers=self.cache.request_headers(url), timeout=resilience.timeout)
+            except (requests.ConnectionError, requests.Timeout) as ex:
+                error = ex
+                delay = resilience.on_error(url, attempt)
+                continue
+
+            self.metrics.incr('bytes', len(response.content))
+            delay = resilience.on_response(url, response.status_code, response.headers, attempt)
+            if delay is None:
+                return response
+
+            error = 'HTTP {}'.format(response.status_code)
+
+        raise FetchError('Страница {} не загружена за {} попыток: {}'.format(url, resilience.max_attempts, error))
+
+    def store(self, task, data, entry=None):
+        """Сохранение разобранных данных страницы
+
+        Args:
+            task(dict): Задача
+            data(dict): Результат parsers.parse_page
+            entry(dict): Валидаторы ответа для кэша ответов
+
+        Returns:
+            list of dict: Новые задачи (следующие страницы торгов)
+        """
+        task_type = task['task_type']
+        data.update({'company_symbol': task['symbol']})
+
+        tasks = []
+        with self.metrics.timer('store', task_type):
+            if task_type == 'stock':
+                result = models.Stock.store_stocks(data)
+            elif task_type == 'trade':
+                next_url = data.pop('next_page_url')
+                last_url = data.pop('last_page_url', None)
+                result = models.Trade.store_trades(data)
+                tasks = self._next_trade_pages(task, next_url, result, last_url)
+            else:
+                raise Exception('Тип не определен')
+
+        self.cache.save(task['url'], entry)
+        # Следующие страницы попадают в журнал раньше, чем текущая отмечается выполненной;
+        # страницы, уже записанные в журнал прерванной загрузки, повторно не ставятся в очередь
+        tasks = self.journal.done(task, tasks)
+        self.metrics.record_rows(result)
+        self.metrics.incr('tasks_done')
+        return tasks
+
+    def not_modified(self, task):
+        """Учесть задачу, страница которой не изменилась с прошлой обработки
+
+        Args:
+            task(dict): Задача
+        """
+        self.journal.done(task)
+        self.metrics.incr('tasks_done')
+        self.metrics.incr('tasks_not_modified')
+
+    def failed(self, task, ex=None):
+        """Учесть задачу, завершившуюся ошибкой
+
+        Args:
+            task(dict): Задача
+            ex(Exception): Исключение (выводится, если передано)
+        """
+        if ex is not None:
+            print(ex)
+        self.metrics.incr('tasks_failed')
+        try:
+            self.journal.failed(task)
+        except Exception as journal_ex:
+            print(journal_ex)
+
+    def _next_trade_pages(self, task, next_url, result, last_url=None):
+        """Следующие страницы торгов для загрузки
+
+        Args:
+            task(dict): Задача текущей страницы
+            next_url(str): Ссылка на следующую страницу
+            result(dict): Результат сохранения текущей страницы
+            last_url(str): Ссылка на последнюю страницу
+
+        Returns:
+            list of dict
+        """
+        if not next_url or task.get('fan_out'):
+            # Страницы, поставленные в очередь разом с первой, дальше не ведут
+            return []
+
+        if self.trade_mode == 'incremental' and not result['inserted']:
+            # На странице только уже известные торги, более старые страницы тоже известны
+            print('no new trades', task['url'])
+            return []
+
+        next_page = re.search('^(.*?)(\d+)$', next_url)
+        page_number = int(next_page.group(2))
+        last_page = re.search('(\d+)$', last_url or '')
+        if self.trade_mode == 'full' and page_number == 2 and last_page:
+            # Количество страниц известно: ставим в очередь все оставшиеся страницы сразу,
+            # они загружаются параллельно
+            return [
+                {
+                    'task_type': 'trade',
+                    'symbol': task['symbol'],
+                    'url': next_page.group(1) + str(i),
+                    'fan_out': True,
+                }
+                for i in range(page_number, min(int(last_page.group(1)), self.trade_pages) + 1)
+            ]
+
+        if page_number > self.trade_pages:
+            return []
+
+        return [{
+            'task_type': 'trade',
+            'symbol': task['symbol'],
+            'url': next_url,
+        }]
+
+
+class TaskQueue(Queue):
+    """Ограниченная очередь задач
+
+    Источник тикеров ждет свободного места в очереди (put), поэтому список компаний
+    не загружается в память целиком. Задачи, порожденные обработчиками (следующие
+    страницы торгов, повторы), добавляются сверх ограничения (put_unbounded):
+    иначе исполнитель, заблокированный на полной очереди, мог бы ждать сам себя.
+    """
+
+    def put_unbounded(self, item):
+        """Добавить задачу, не дожидаясь свободного места"""
+        with self.not_full:
+            self._put(item)
+            self.unfinished_tasks += 1
+            self.not_empty.notify()
+
+
 class Worker(threading.Thread):
     """Многопоточный класс работы с очередью"""
 
-    def __init__(self, tasks):
+    def __init__(self, tasks, handler):
         """
         Args:
-            tasks(Queue): Очередь задач
+            tasks(TaskQueue): Очередь задач
+            handler(TaskHandler): Обработчик задач
         """
         threading.Thread.__init__(self)
         self.tasks = tasks
+        self.handler = handler
         self.daemon = True
         self.start()
 
@@ -64,78 +337,410 @@ class Worker(threading.Thread):
                 self._run_task(**kwargs)
             except Exception as ex:
                 # An exception happened in this thread
-                print(ex)
+                self.handler.failed(kwargs, ex)
             finally:
                 # Mark this task as done, whether an exception happened or not
                 self.tasks.task_done()
 
-    @retry(count=5)
-    def _run_task(self, task_type, **kwargs):
-        print(self.name, kwargs)
-        if task_type == 'stock':
-            self._stock(**kwargs)
-        elif task_type == 'trade':
-            self._trade(**kwargs)
-        else:
-            raise Exception('Тип не определен')
+    def _run_task(self, **task):
+        print(self.name, {'symbol': task['symbol'], 'url': task['url']})
+        new_tasks = self.handler.run(task)
+        if new_tasks is None:
+            # Данные на странице не найдены за все попытки
+            self.handler.failed(task)
+            return
+
+        for new_task in new_tasks:
+            self.tasks.put_unbounded(new_task)
+
 
-    def _trade(self, symbol, url):
-        """Загрузка, парсинг и сохранение торгов
+class ThreadPool:
+    """ Пул потоков для выполнения задач из очереди"""
 
+    def __init__(self, num_threads, handler=None, max_tasks=TASK_QUEUE_SIZE):
+        """
         Args:
-            symbol(str): Сокращенное название компании
-            url(str): Ссылка на источник
+            num_threads(int): Количество потоков
+            handler(TaskHandler): Обработчик задач
+            max_tasks(int): Размер очереди задач, при заполнении add_tasks ждет исполнителей
         """
-        response = requests.get(url)
-        parser = parsers.ParserTrade(response.text)
-        data = parser.get_data()
-        # Если есть следующая страница ставим ее в очередь
-        next_url = data.pop('next_page_url')
-        if next_url:
-            page_number = int(re.search('(\d+)$', next_url).group(1))
-            if page_number < 11:
-                self.tasks.put({
-                    'task_type': 'trade',
-                    'symbol': symbol,
-                    'url': next_url,
-                })
-        data.update({'company_symbol': symbol})
-        models.Trade.store_trades(data)
+        self.tasks = TaskQueue(maxsize=max_tasks)
+        self.handler = handler or TaskHandler()
+        for _ in range(num_threads):
+            Worker(self.tasks, self.handler)
 
-    def _stock(self, symbol, url):
-        """Загрузка, парсинг и сохранение акций
+    def add_task(self, **kwargs):
+        """Добавить задачу в очередь"""
+        self.tasks.put(kwargs)
+
+    def add_tasks(self, tasks):
+        """Добавить задачи в очередь
 
         Args:
-            symbol(str): Сокращенное название компании
-            url(str): Ссылка на источник
+            tasks(iterable of dict): Задачи, в том числе ленивый генератор
         """
-        response = requests.get(url)
-        parser = parsers.ParserStock(response.text)
-        data = parser.get_data()
-        data.update({'company_symbol': symbol})
-        models.Stock.store_stocks(data)
+        for task in tasks:
+            self.add_task(**task)
 
+    def wait_completion(self):
+        """Дождаться завершения всех задач в очереди"""
+        self.tasks.join()
 
-class ThreadPool:
-    """ Пул потоков для выполнения задач из очереди"""
 
-    def __init__(self, num_threads):
-        self.tasks = Queue()
-        for _ in range(num_threads):
-            Worker(self.tasks)
+def _close_connections_after(func, *args):
+    """Вызвать функцию и закрыть устаревшие соединения django с БД текущего потока"""
+    try:
+        return func(*args)
+    finally:
+        close_old_connections()
+
+
+class AsyncPool:
+    """Асинхронный пул загрузки страниц
+
+    Страницы загружаются в одном потоке через asyncio (одновременно до
+    num_requests запросов), а парсинг и сохранение выполняются в пуле потоков,
+    чтобы не блокировать цикл событий.
+    """
+
+    def __init__(self, num_requests, handler=None, num_threads=None, max_tasks=TASK_QUEUE_SIZE):
+        """
+        Args:
+            num_requests(int): Максимальное количество одновременных запросов
+            handler(TaskHandler): Обработчик задач (настройки пула соединений, кэш, сохранение)
+            num_threads(int): Количество потоков для парсинга и сохранения
+            max_tasks(int): Размер очереди задач, при заполнении источник задач ждет исполнителей
+        """
+        self.num_requests = num_requests
+        self.handler = handler or TaskHandler()
+        self.num_threads = num_threads or os.cpu_count() or 1
+        self.max_tasks = max_tasks
+        self._sources = []
+
+    def add_task(self, **kwargs):
+        """Добавить задачу в очередь"""
+        self._sources.append([kwargs])
+
+    def add_tasks(self, tasks):
+        """Добавить задачи в очередь
+
+        Задачи читаются лениво внутри цикла событий по мере освобождения очереди.
+
+        Args:
+            tasks(iterable of dict): Задачи, в том числе ленивый генератор
+        """
+        self._sources.append(tasks)
+
+    def wait_completion(self):
+        """Выполнить все задачи и дождаться их завершения"""
+        loop = asyncio.new_event_loop()
+        try:
+            loop.run_until_complete(self._main(loop))
+        finally:
+            loop.close()
+
+    async def _main(self, loop):
+        # Очередь без ограничения: задачи исполнителей (следующие страницы) добавляются
+        # сразу, а источник задач сам ждет, пока в очереди не освободится место
+        queue = asyncio.Queue()
+        self._space = asyncio.Event()
+        sources, self._sources = self._sources, []
+
+        with ThreadPoolExecutor(max_workers=self.num_threads) as executor:
+            async with self.handler.session.async_session() as session:
+                workers = [
+                    loop.create_task(self._worker(loop, session, queue, executor))
+                    for _ in range(self.num_requests)
+                ]
+                for tasks in sources:
+                    await self._produce(loop, queue, tasks, executor)
+                await queue.join()
+                for worker in workers:
+                    worker.cancel()
+                await asyncio.gather(*workers, return_exceptions=True)
+
+    @staticmethod
+    async def _call(loop, executor, func, *args):
+        """Выполнить функцию (запросы к БД, чтение источника, разбор) в потоке пула
+
+        Потоки пула живут дольше задачи, поэтому открытое функцией соединение с БД
+        закрывается после вызова, а не остается открытым после остановки пула.
+        """
+        return await loop.run_in_executor(executor, _close_connections_after, func, *args)
+
+    async def _produce(self, loop, queue, tasks, executor):
+        tasks = iter(tasks)
+        while True:
+            while self.max_tasks and queue.qsize() >= self.max_tasks:
+                self._space.clear()
+                await self._space.wait()
+            # Чтение источника может блокироваться (файл, стандартный ввод, запросы к БД),
+            # поэтому выполняется вне цикла событий
+            task = await self._call(loop, executor, next, tasks, None)
+            if task is None:
+                return
+            queue.put_nowait(task)
+
+    async def _worker(self, loop, session, queue, executor):
+        while True:
+            kwargs = await queue.get()
+            self._space.set()
+            try:
+                for task in await self._run_task(loop, session, executor, **kwargs):
+                    queue.put_nowait(task)
+            except Exception as ex:
+                await self._call(loop, executor, self.handler.failed, kwargs, ex)
+            finally:
+                queue.task_done()
+
+    async def _run_task(self, loop, session, executor, **task):
+        handler = self.handler
+        cache = handler.cache
+        url = task['url']
+        for _ in range(_COUNT_RETRY):
+            print('async', {'symbol': task['symbol'], 'url': url})
+            await self._call(loop, executor, handler.journal.started, task)
+            with handler.metrics.timer('fetch', task['task_type']):
+                status, headers, page = await self._get(session, url)
+            entry = cache.entry(task['task_type'], status, headers, page)
+            if cache.is_unchanged(url, status, entry):
+                print('not modified', url)
+                await self._call(loop, executor, handler.not_modified, task)
+                return []
+
+            try:
+                data = await self._call(loop, executor, handler.parse, task, page)
+            except parsers.NotFoundData:
+                continue
+
+            return await self._call(loop, executor, handler.store, task, data, entry)
+
+        await self._call(loop, executor, handler.failed, task)
+        return []
+
+    async def _get(self, session, url):
+        """Условный запрос с ограничением частоты, таймаутом и повторами (см. TaskHandler._get)
+
+        Args:
+            session(aiohttp.ClientSession): Сессия
+            url(str): Ссылка
+
+        Returns:
+            tuple: (HTTP статус, заголовки, текст страницы)
+        """
+        import aiohttp
+
+        resilience = self.handler.resilience
+        timeout = aiohttp.ClientTimeout(total=resilience.timeout)
+        error = None
+        delay = 0
+        for attempt in range(resilience.max_attempts):
+            # Пауза перед повтором: после последней попытки не ждем
+            if attempt:
+                self.handler.metrics.incr('fetch_retries')
+                await asyncio.sleep(delay)
+            await asyncio.sleep(resilience.delay_before(url))
+            try:
+                async with session.get(
+                        url, headers=self.handler.cache.request_headers(url), timeout=timeout) as response:
+                    body = await response.read()
+                    status, headers, page = response.status, response.headers, body.decode(response.get_encoding())
+            except (aiohttp.ClientError, asyncio.TimeoutError) as ex:
+                error = ex
+                delay = resilience.on_error(url, attempt)
+                continue
+
+            self.handler.metrics.incr('bytes', len(body))
+            delay = resilience.on_response(url, status, headers, attempt)
+            if delay is None:
+                return status, headers, page
+
+            error = 'HTTP {}'.format(status)
+
+        raise FetchError('Страница {} не загружена за {} попыток: {}'.format(url, resilience.max_attempts, error))
+
+
+class Pipeline:
+    """Конвейер загрузки: загрузка -> парсинг -> сохранение
+
+    Каждая стадия имеет собственное количество исполнителей, стадии связаны
+    ограниченными очередями. Парсинг выполняется в пуле процессов, поэтому
+    построение дерева страницы не держит GIL потоков загрузки и сохранения.
+    """
+
+    def __init__(self, num_fetch, num_parse=None, num_store=None, queue_size=None, handler=None,
+                 max_tasks=TASK_QUEUE_SIZE):
+        """
+        Args:
+            num_fetch(int): Количество потоков загрузки
+            num_parse(int): Количество процессов парсинга (по умолчанию - количество ядер)
+            num_store(int): Количество потоков сохранения (по умолчанию - num_parse)
+            queue_size(int): Размер очередей между стадиями (по умолчанию - 2 * num_parse)
+            handler(TaskHandler): Обработчик задач (загрузка и сохранение)
+            max_tasks(int): Размер входной очереди задач, при заполнении add_tasks ждет исполнителей
+        """
+        self.num_parse = num_parse or os.cpu_count() or 1
+        self.num_store = num_store or self.num_parse
+        queue_size = queue_size or 2 * self.num_parse
+
+        self.handler = handler or TaskHandler()
+        # Входная очередь задач, по ней же отслеживается завершение задачи целиком
+        self.tasks = TaskQueue(maxsize=max_tasks)
+        self.parse_queue = Queue(maxsize=queue_size)
+        self.store_queue = Queue(maxsize=queue_size)
+        # Процессы парсинга используют ту же реализацию разбора, что и основной процесс
+        self.executor = ProcessPoolExecutor(
+            max_workers=self.num_parse,
+            initializer=parsers.set_default_backend,
+            initargs=(parsers.get_default_backend(),),
+        )
+
+        for _ in range(num_fetch):
+            self._start_thread(self._fetch_worker)
+        for _ in range(self.num_parse):
+            self._start_thread(self._parse_worker)
+        for _ in range(self.num_store):
+            self._start_thread(self._store_worker)
+
+    @staticmethod
+    def _start_thread(target):
+        thread = threading.Thread(target=target)
+        thread.daemon = True
+        thread.start()
 
     def add_task(self, **kwargs):
         """Добавить задачу в очередь"""
         self.tasks.put(kwargs)
 
     def add_tasks(self, tasks):
-        """Добавить список задач в очередь"""
+        """Добавить задачи в очередь
+
+        Args:
+            tasks(iterable of dict): Задачи, в том числе ленивый генератор
+        """
         for task in tasks:
             self.add_task(**task)
 
     def wait_completion(self):
-        """Дождаться завершения всех задач в очереди"""
+        """Дождаться завершения всех задач и остановить пул процессов"""
         self.tasks.join()
+        self.executor.shutdown()
+
+    def _fetch_worker(self):
+        while True:
+            task = self.tasks.get()
+            try:
+                print(threading.current_thread().name, {'symbol': task['symbol'], 'url': task['url']})
+                page, entry = self.handler.fetch(task)
+            except Exception as ex:
+                self.handler.failed(task, ex)
+                self.tasks.task_done()
+                continue
+
+            if page is None:
+                self.tasks.task_done()
+                continue
+
+            self.parse_queue.put((task, page, entry))
+
+    def _parse_worker(self):
+        while True:
+            task, page, entry = self.parse_queue.get()
+            metrics = self.handler.metrics
+            try:
+                # Задержка включает передачу страницы в процесс парсинга и результата обратно
+                with metrics.timer('parse', task['task_type']):
+                    data = self.executor.submit(parsers.parse_page, task['task_type'], page, columnar=True).result()
+            except parsers.NotFoundData:
+                metrics.incr('parse_retries')
+                attempt = task.get('attempt', 1)
+                if attempt < _COUNT_RETRY:
+                    self.tasks.put_unbounded(dict(task, attempt=attempt + 1))
+                else:
+                    self.handler.failed(task)
+                self.tasks.task_done()
+                continue
+            except Exception as ex:
+                self.handler.failed(task, ex)
+                self.tasks.task_done()
+                continue
+
+            self.store_queue.put((task, data, entry))
+
+    def _store_worker(self):
+        while True:
+            task, data, entry = self.store_queue.get()
+            try:
+                for new_task in self.handler.store(task, data, entry):
+                    self.tasks.put_unbounded(new_task)
+            except Exception as ex:
+                self.handler.failed(task, ex)
+            finally:
+                self.tasks.task_done()
+
+
+def iter_symbols_file(path=None):
+    """Построчное чтение сокращенных названий компаний из файла
+
+    Args:
+        path(str): Путь до файла, '-' - стандартный ввод (по умолчанию - tickers.txt)
+
+    Returns:
+        generator of str
+    """
+    if path == '-':
+        for line in sys.stdin:
+            yield from line.split()
+        return
+
+    with open(path or os.path.join(_ROOT_DIR, 'tickers.txt'), 'r') as file:
+        for line in file:
+            yield from line.split()
+
+
+def iter_symbols_db(chunk_size=1000):
+    """Сокращенные названия компаний, сохраненных в базе данных
+
+    Компании читаются порциями по id, без открытого на всё время загрузки курсора:
+    в SQLite он удерживал бы блокировку чтения и мешал потокам сохранения.
+
+    Args:
+        chunk_size(int): Количество компаний в одном запросе
+
+    Returns:
+        generator of str
+    """
+    last_id = 0
+    while True:
+        rows = list(
+            models.Company.objects.filter(id__gt=last_id).order_by('id').values_list('id', 'symbol')[:chunk_size]
+        )
+        if not rows:
+            return
+        for _, symbol in rows:
+            yield symbol
+        last_id = rows[-1][0]
+
+
+def iter_symbols(symbol=None, symbols=None, tickers=None, from_db=False):
+    """Источник сокращенных названий компаний
+
+    Args:
+        symbol(str): Сокращенное название компании
+        symbols(iterable of str): Сокращенные названия компаний
+        tickers(str): Файл со списком компаний, '-' - стандартный ввод (по умолчанию - tickers.txt)
+        from_db(bool): Взять компании, уже сохраненные в базе данных
+
+    Returns:
+        iterable of str
+    """
+    if symbol:
+        return [symbol]
+    if symbols is not None:
+        return symbols
+    if from_db:
+        return iter_symbols_db()
+    return iter_symbols_file(tickers)
 
 
 def read_symbol_company():
@@ -144,49 +749,202 @@ def read_symbol_company():
     Returns:
         list of str
     """
-    with open(os.path.join(_ROOT_DIR, 'tickers.txt'), 'r') as file:
-        text = file.read()
-        symbols = text.split()
-        return [i for i in symbols if i]
+    return list(iter_symbols_file())
+
+
+def task_urls(base_url=None):
+    """Шаблоны ссылок страниц по типу задачи
+
+    Args:
+        base_url(str): Адрес источника (по умолчанию https://www.nasdaq.com)
+
+    Returns:
+        dict
+    """
+    return {
+        'stock': base_url.rstrip('/') + _PATH_STOCK if base_url else _URL_STOCK,
+        'trade': base_url.rstrip('/') + _PATH_TRADE if base_url else _URL_TRADE,
+    }
+
 
+def iter_tasks(symbols, base_url=None):
+    """Ленивая генерация задач по мере чтения источника компаний
+
+    Args:
+        symbols(iterable of str): Сокращенные названия компаний
+        base_url(str): Адрес источника (например локального сервера parser.replay)
 
-def get_tasks(symbol=None):
+    Returns:
+        generator of dict
+    """
+    urls = task_urls(base_url)
+    for symbol in symbols:
+        yield {
+            'task_type': 'stock',
+            'symbol': symbol,
+            'url': urls['stock'].format(symbol),
+        }
+
+        yield {
+            'task_type': 'trade',
+            'symbol': symbol,
+            'url': urls['trade'].format(symbol),
+        }
+
+
+def get_tasks(symbol=None, symbols=None, base_url=None):
     """Генерируем скисок задач, на выполнение
 
     Args:
         symbol(str): Сокращенное название компании
+        symbols(list of str): Список сокращенных названий компаний (по умолчанию - из файла tickers.txt)
+        base_url(str): Адрес источника (например локального сервера parser.replay)
 
     Returns:
         list of dict
     """
-    if symbol:
-        symbols = [symbol]
-    else:
-        symbols = read_symbol_company()
-    result = []
-    for symbol_ in symbols:
-        result.append({
-            'task_type': 'stock',
-            'symbol': symbol_,
-            'url': _URL_STOCK.format(symbol_),
-        })
+    return list(iter_tasks(iter_symbols(symbol, symbols), base_url=base_url))
 
-        result.append({
-            'task_type': 'trade',
-            'symbol': symbol_,
-            'url': _URL_TRADE.format(symbol_),
-        })
 
-    return result
+def enqueue(symbol=None, symbols=None, tickers=None, from_db=False, base_url=None):
+    """Добавление задач в общую очередь для процессов загрузки (start(worker=True))
 
+    Args:
+        symbol(str): Сокращенное название компании
+        symbols(iterable of str): Сокращенные названия компаний
+        tickers(str): Файл со списком компаний, '-' - стандартный ввод (по умолчанию - tickers.txt)
+        from_db(bool): Взять компании, уже сохраненные в базе данных
+        base_url(str): Адрес источника (по умолчанию https://www.nasdaq.com)
+
+    Returns:
+        int: Количество добавленных задач
+    """
+    symbols = iter_symbols(symbol, symbols=symbols, tickers=tickers, from_db=from_db)
+    return SharedTaskQueue().enqueue(iter_tasks(symbols, base_url=base_url))
 
-def start(count_tread=10, symbol=None):
+
+def start(count_tread=10, symbol=None, engine='thread', pool_size=10, per_host=10,
+          num_parse=None, num_store=None, queue_size=None, parser_backend=None, http_cache=None,
+          trade_mode='incremental', trade_pages=10, symbols=None, base_url=None, resilience=None,
+          tickers=None, from_db=False, max_tasks=TASK_QUEUE_SIZE, progress_interval=10, metrics_output=None,
+          journal=False, resume=False, worker=False, lease_timeout=LEASE_TIMEOUT,
+          daemon=False, interval=3600, watch_interval=300, watch=None, duration=None):
     """Основной метод запуска загрузки данных в многопоточном режиме
 
     Args:
-        count_tread(int): Количество потоков
+        count_tread(int): Количество потоков (для engine='async' - количество одновременных запросов)
         symbol(str): Количество потоков
+        engine(str): Движок загрузки: thread - пул потоков, async - asyncio,
+            pipeline - конвейер загрузка/парсинг в процессах/сохранение
+        num_parse(int): Количество процессов парсинга (только для engine='pipeline')
+        num_store(int): Количество потоков сохранения (только для engine='pipeline')
+        queue_size(int): Размер очередей между стадиями (только для engine='pipeline')
+        pool_size(int): Максимальное количество одновременных HTTP соединений ко всем хостам
+        per_host(int): Максимальное количество одновременных соединений к одному хосту
+        parser_backend(str): Реализация разбора страниц (по умолчанию - самая быстрая доступная)
+        http_cache(str): Каталог кэша ответов источника, неизменившиеся страницы не парсятся
+            и не сохраняются (по умолчанию кэш выключен)
+        trade_mode(str): Режим загрузки страниц торгов: incremental - до первой страницы без новых торгов,
+            full - все страницы до trade_pages
+        trade_pages(int): Максимальное количество страниц торгов компании
+        symbols(list of str): Список сокращенных названий компаний (по умолчанию - из файла tickers.txt)
+        base_url(str): Адрес источника (по умолчанию https://www.nasdaq.com)
+        resilience(Resilience): Политика ограничения частоты запросов, таймаутов и повторов
+        tickers(str): Файл со списком компаний, '-' - стандартный ввод (по умолчанию - tickers.txt)
+        from_db(bool): Загрузить компании, уже сохраненные в базе данных
+        max_tasks(int): Размер очереди задач: источник компаний читается по мере ее освобождения
+        progress_interval(float): Период вывода прогресса в секундах (0 - не выводить)
+        metrics_output(str): Путь до JSON файла итогового отчета метрик
+        journal(bool): Вести журнал задач в БД, чтобы прерванную загрузку можно было продолжить
+        resume(bool): Продолжить прерванную загрузку: выполнить незавершенные задачи журнала
+            и задачи источника, которых еще нет в журнале (включает journal)
+        worker(bool): Выполнять задачи общей очереди в БД вместе с другими процессами
+            (задачи добавляются через enqueue), источник компаний не используется
+        lease_timeout(float): Длительность аренды задачи общей очереди в секундах (только для worker)
+        daemon(bool): Непрерывное обновление: компании источника добавляются в расписание,
+            данные обновляются по мере устаревания, пока процесс не остановлен
+        interval(float): Интервал обновления компании в секундах (только для daemon)
+        watch_interval(float): Интервал обновления отслеживаемой компании в секундах (только для daemon)
+        watch(list of str): Отслеживаемые компании (только для daemon, None - оставить как есть)
+        duration(float): Длительность непрерывного обновления в секундах (только для daemon,
+            None - пока процесс не остановлен)
+
+    Returns:
+        dict: Итоговый отчет метрик (см. Metrics.summary)
     """
-    thread_pool = ThreadPool(count_tread)
-    thread_pool.add_tasks(get_tasks(symbol))
-    thread_pool.wait_completion()
+    if parser_backend:
+        parsers.set_default_backend(parser_backend)
+
+    session = SessionPool(pool_size=pool_size, per_host=per_host)
+    metrics = Metrics()
+    if worker:
+        task_journal = SharedTaskQueue(lease_timeout=lease_timeout)
+        # Захваченные задачи ждут в локальной очереди недолго, иначе истекла бы их аренда
+        max_tasks = count_tread
+    elif daemon:
+        task_journal = RefreshScheduler(interval=interval, watch_interval=watch_interval)
+        # Задачи выбираются из расписания непосредственно перед загрузкой
+        max_tasks = count_tread
+    elif journal or resume:
+        task_journal = TaskJournal()
+    else:
+        task_journal = NullTaskJournal()
+    if not (resume or worker or daemon):
+        task_journal.reset()
+    handler = TaskHandler(
+        session=session,
+        cache=ResponseCache(http_cache) if http_cache else NullResponseCache(),
+        resilience=resilience,
+        trade_mode=trade_mode,
+        trade_pages=trade_pages,
+        metrics=metrics,
+        journal=task_journal,
+    )
+    if engine == 'thread':
+        pool = ThreadPool(count_tread, handler=handler, max_tasks=max_tasks)
+    elif engine == 'async':
+        pool = AsyncPool(count_tread, handler=handler, max_tasks=max_tasks)
+    elif engine == 'pipeline':
+        pool = Pipeline(
+            count_tread,
+            num_parse=num_parse,
+            num_store=num_store,
+            queue_size=queue_size,
+            handler=handler,
+            max_tasks=max_tasks,
+        )
+    else:
+        raise Exception('Неизвестный движок {}, доступны {}'.format(engine, ENGINES))
+
+    reporter = ProgressReporter(metrics, progress_interval) if progress_interval else None
+    if reporter:
+        reporter.start()
+    try:
+        if worker:
+            pool.add_tasks(task_journal.claim(count_tread))
+        elif daemon:
+            task_journal.seed(iter_symbols(symbol, symbols=symbols, tickers=tickers, from_db=from_db), watched=watch)
+            # Без duration источник бесконечный: работаем до остановки процесса
+            pool.add_tasks(task_journal.tasks(task_urls(base_url), duration=duration))
+        else:
+            if resume:
+                pool.add_tasks(task_journal.unfinished())
+            symbols = iter_symbols(symbol, symbols=symbols, tickers=tickers, from_db=from_db)
+            pool.add_tasks(task_journal.track(iter_tasks(symbols, base_url=base_url)))
+        # Пул потоков читает источник в add_tasks, asyncio - только здесь
+        pool.wait_completion()
+    except KeyboardInterrupt:
+        if not daemon:
+            raise
+        print('stopped')
+    finally:
+        if reporter:
+            reporter.stop()
+        session.close()
+
+    print('lookup cache', lookup_cache.stats())
+    summary = metrics.summary()
+    print('metrics', json.dumps(summary))
+    if metrics_output:
+        metrics.write(metrics_output)
+    return summary
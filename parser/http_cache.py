@@ -0,0 +1,137 @@
+"""Модуль дискового кэша ответов источника для условных запросов"""
+import hashlib
+import json
+import os
+import tempfile
+
+from parser import parsers
+
+
+class ResponseCache:
+    """Кэш валидаторов ответов (ETag, Last-Modified, хэш содержимого) по ссылке
+
+    Если источник ответил 304 или содержимое страницы не изменилось с прошлой
+    успешной обработки, страницу можно не парсить и не сохранять.
+    Каждая ссылка хранится в отдельном json файле, запись атомарная.
+    """
+
+    def __init__(self, path):
+        """
+        Args:
+            path(str): Каталог кэша
+        """
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+
+    def _file(self, url):
+        return os.path.join(self.path, hashlib.sha1(url.encode()).hexdigest() + '.json')
+
+    def get(self, url):
+        """Сохраненные валидаторы ссылки
+
+        Args:
+            url(str): Ссылка
+
+        Returns:
+            dict: {'etag': str, 'last_modified': str, 'hash': str}, None если ссылки нет в кэше
+        """
+        try:
+            with open(self._file(url), 'r') as file:
+                return json.load(file)
+        except (OSError, ValueError):
+            return None
+
+    def request_headers(self, url):
+        """Заголовки условного запроса
+
+        Args:
+            url(str): Ссылка
+
+        Returns:
+            dict
+        """
+        cached = self.get(url) or {}
+        headers = {}
+        if cached.get('etag'):
+            headers['If-None-Match'] = cached['etag']
+        if cached.get('last_modified'):
+            headers['If-Modified-Since'] = cached['last_modified']
+
+        return headers
+
+    @staticmethod
+    def entry(page_type, status, headers, page):
+        """Валидаторы полученного ответа
+
+        Хэш считается по областям страницы, которые разбирает парсер (см. parsers.scope_page),
+        поэтому изменения рекламы и прочего окружения таблицы не считаются изменением страницы.
+
+        Args:
+            page_type(str): Тип страницы (stock, trade)
+            status(int): HTTP статус ответа
+            headers(dict): Заголовки ответа
+            page(str): Текст страницы
+
+        Returns:
+            dict: None если ответ не кэшируется
+        """
+        if status != 200:
+            return None
+
+        content = parsers.scope_page(page, page_type) or page
+        return {
+            'etag': headers.get('ETag'),
+            'last_modified': headers.get('Last-Modified'),
+            'hash': hashlib.sha1(content.encode()).hexdigest(),
+        }
+
+    def is_unchanged(self, url, status, entry):
+        """Страница не изменилась с прошлой успешной обработки
+
+        Args:
+            url(str): Ссылка
+            status(int): HTTP статус ответа
+            entry(dict): Валидаторы ответа (см. entry)
+
+        Returns:
+            bool
+        """
+        if status == 304:
+            return True
+        if entry is None:
+            return False
+
+        cached = self.get(url)
+        return bool(cached) and cached.get('hash') == entry['hash']
+
+    def save(self, url, entry):
+        """Сохранить валидаторы ответа, вызывается после успешного сохранения данных страницы
+
+        Args:
+            url(str): Ссылка
+            entry(dict): Валидаторы ответа (см. entry)
+        """
+        if entry is None:
+            return
+
+        fd, tmp_path = tempfile.mkstemp(dir=self.path, suffix='.tmp')
+        with os.fdopen(fd, 'w') as file:
+            json.dump(entry, file)
+        os.replace(tmp_path, self._file(url))
+
+
+class NullResponseCache:
+    """Кэш ответов, который ничего не хранит (кэш выключен)"""
+
+    def request_headers(self, url):
+        return {}
+
+    @staticmethod
+    def entry(page_type, status, headers, page):
+        return None
+
+    def is_unchanged(self, url, status, entry):
+        return False
+
+    def save(self, url, entry):
+        pass
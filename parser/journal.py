@@ -0,0 +1,221 @@
+"""Модуль журнала задач загрузки для продолжения прерванной загрузки
+и общей очереди задач нескольких процессов загрузки"""
+import os
+import socket
+import threading
+import time
+
+from stock import models
+
+# Длительность аренды задачи процессом по умолчанию, секунд
+LEASE_TIMEOUT = 300
+
+
+class TaskJournal:
+    """Журнал задач загрузки в БД (таблица ScanTask, очередь JOURNAL)
+
+    Каждая задача записывается до постановки в очередь и проходит статусы
+    pending -> in_progress -> done/failed. Следующие страницы торгов записываются
+    в той же транзакции, в которой страница, на которой они найдены, отмечается
+    выполненной, поэтому после аварийного завершения ни одна найденная страница не теряется.
+    Начатая задача берется процессом в аренду: завершить ее может только процесс,
+    который ее выполняет.
+    """
+    queue = models.ScanTask.JOURNAL
+
+    def __init__(self, chunk_size=100, lease_timeout=LEASE_TIMEOUT, worker=None):
+        """
+        Args:
+            chunk_size(int): Количество задач источника, записываемых в журнал одним запросом
+            lease_timeout(float): Длительность аренды задачи в секундах
+            worker(str): Название процесса (по умолчанию - хост:pid)
+        """
+        self.chunk_size = chunk_size
+        self.lease_timeout = lease_timeout
+        self.worker = worker or '{}:{}'.format(socket.gethostname(), os.getpid())
+
+    def reset(self):
+        """Очистить журнал перед новой загрузкой"""
+        models.ScanTask.objects.filter(queue=self.queue).delete()
+
+    def track(self, tasks):
+        """Записать задачи источника в журнал
+
+        Задачи записываются порциями по мере чтения источника. Задачи, уже
+        записанные в журнал (при продолжении загрузки), пропускаются.
+
+        Args:
+            tasks(iterable of dict): Задачи
+
+        Returns:
+            generator of dict: Задачи, которых не было в журнале
+        """
+        chunk = []
+        for task in tasks:
+            chunk.append(task)
+            if len(chunk) >= self.chunk_size:
+                yield from models.ScanTask.add_tasks(self.queue, chunk)
+                chunk = []
+
+        yield from models.ScanTask.add_tasks(self.queue, chunk)
+
+    def unfinished(self):
+        """Незавершенные задачи прерванной загрузки
+
+        Returns:
+            generator of dict
+        """
+        return models.ScanTask.iter_unfinished(self.queue)
+
+    def started(self, task):
+        """Отметить начало выполнения задачи"""
+        models.ScanTask.start(self.queue, task['url'], self.worker, self.lease_timeout)
+
+    def done(self, task, new_tasks=None):
+        """Отметить задачу выполненной, записав найденные на ее странице задачи
+
+        Args:
+            task(dict): Задача
+            new_tasks(list of dict): Следующие страницы торгов
+
+        Returns:
+            list of dict: Найденные задачи, которых еще не было в журнале
+        """
+        new_tasks = models.ScanTask.finish(self.queue, task['url'], models.ScanTask.DONE, self.worker, new_tasks)
+        if new_tasks is None:
+            print('lease lost', task['url'])
+            return []
+        return new_tasks
+
+    def failed(self, task):
+        """Отметить задачу, завершившуюся ошибкой"""
+        models.ScanTask.finish(self.queue, task['url'], models.ScanTask.FAILED, self.worker)
+
+
+class SharedTaskQueue(TaskJournal):
+    """Общая очередь задач в БД для нескольких процессов загрузки (на одной или разных машинах)
+
+    Процесс захватывает задачи в аренду небольшими порциями и, пока выполняет их,
+    продлевает аренду из отдельного потока, поэтому долгую задачу не захватит другой
+    процесс. Найденные страницы торгов записываются в общую очередь и достаются
+    любому процессу, а не ставятся в локальную очередь захватившего страницу процесса.
+    """
+    queue = models.ScanTask.SHARED
+
+    def __init__(self, lease_timeout=LEASE_TIMEOUT, poll_interval=1, worker=None, chunk_size=100):
+        """
+        Args:
+            lease_timeout(float): Длительность аренды задачи в секундах, после нее задачу
+                упавшего процесса захватывает другой процесс
+            poll_interval(float): Пауза между попытками захвата, когда свободных задач нет,
+                а другие процессы еще выполняют задачи
+            worker(str): Название процесса (по умолчанию - хост:pid)
+            chunk_size(int): Количество задач источника, записываемых в очередь одним запросом
+        """
+        super().__init__(chunk_size=chunk_size, lease_timeout=lease_timeout, worker=worker)
+        self.poll_interval = poll_interval
+        self._stopped = threading.Event()
+
+    def enqueue(self, tasks):
+        """Добавить задачи в общую очередь
+
+        Уже завершенные задачи возвращаются в очередь, ожидающие и выполняемые пропускаются.
+
+        Args:
+            tasks(iterable of dict): Задачи
+
+        Returns:
+            int: Количество поставленных в очередь задач
+        """
+        count = 0
+        chunk = []
+        for task in tasks:
+            chunk.append(task)
+            if len(chunk) >= self.chunk_size:
+                count += len(models.ScanTask.add_tasks(self.queue, chunk, requeue=True))
+                chunk = []
+
+        return count + len(models.ScanTask.add_tasks(self.queue, chunk, requeue=True))
+
+    def claim(self, batch_size):
+        """Задачи, захваченные процессом
+
+        Генератор завершается, когда в очереди не осталось ни ожидающих задач,
+        ни задач, выполняемых процессами (в том числе этим). Пока генератор
+        не завершен, аренда захваченных задач продлевается.
+
+        Args:
+            batch_size(int): Количество задач, захватываемых за раз
+
+        Returns:
+            generator of dict
+        """
+        self._stopped.clear()
+        heartbeat = threading.Thread(target=self._heartbeat, name='lease-heartbeat', daemon=True)
+        heartbeat.start()
+        try:
+            while True:
+                tasks = models.ScanTask.claim_tasks(self.queue, self.worker, batch_size, self.lease_timeout)
+                if tasks:
+                    yield from tasks
+                    continue
+
+                if not models.ScanTask.has_unfinished(self.queue):
+                    return
+                time.sleep(self.poll_interval)
+        finally:
+            self._stopped.set()
+            heartbeat.join()
+
+    def _heartbeat(self):
+        # Аренда продлевается несколько раз за время аренды: одна неудачная попытка ее не теряет
+        while not self._stopped.wait(self.lease_timeout / 3):
+            try:
+                models.ScanTask.renew(self.queue, self.worker, self.lease_timeout)
+            except Exception as ex:
+                print(ex)
+
+    def started(self, task):
+        """Задача уже отмечена выполняемой при захвате"""
+        pass
+
+    def done(self, task, new_tasks=None):
+        """Отметить задачу выполненной, записав найденные на ее странице задачи в общую очередь
+
+        Returns:
+            list: Пустой список - найденные задачи захватываются из общей очереди
+        """
+        # Страницы, выполненные при прошлой загрузке тех же компаний, загружаются заново
+        result = models.ScanTask.finish(
+            self.queue, task['url'], models.ScanTask.DONE, self.worker, new_tasks, requeue=True)
+        if result is None:
+            print('lease lost', task['url'])
+        return []
+
+
+class NullTaskJournal:
+    """Журнал задач, который ничего не хранит (журнал выключен)"""
+
+    @staticmethod
+    def reset():
+        pass
+
+    @staticmethod
+    def track(tasks):
+        return tasks
+
+    @staticmethod
+    def unfinished():
+        return []
+
+    @staticmethod
+    def started(task):
+        pass
+
+    @staticmethod
+    def done(task, new_tasks=None):
+        return new_tasks or []
+
+    @staticmethod
+    def failed(task):
+        pass
@@ -0,0 +1,249 @@
+"""Модуль метрик загрузки: счетчики, гистограммы задержек стадий и пропускная способность"""
+import collections
+import json
+import math
+import random
+import threading
+import time
+from contextlib import contextmanager
+
+# Стадии обработки задачи
+STAGES = ('fetch', 'parse', 'store')
+# Перцентили задержек в итоговом отчете
+PERCENTILES = (50, 95, 99)
+# Количество замеров, по которым считаются перцентили гистограммы
+SAMPLE_SIZE = 2048
+
+
+class Histogram:
+    """Задержки одной стадии
+
+    Количество, сумма и максимум замеров точные, перцентили считаются по выборке
+    не более size замеров (reservoir sampling: каждый замер попадает в выборку
+    с равной вероятностью), поэтому память не растет со временем работы загрузки.
+    Пока замеров не больше size, перцентили точные.
+    """
+
+    def __init__(self, size=SAMPLE_SIZE, seed=None):
+        """
+        Args:
+            size(int): Максимальное количество хранимых замеров
+            seed(int): Начальное значение генератора выборки
+        """
+        self.size = size
+        self.samples = []
+        self.count = 0
+        self.total = 0.0
+        self.max = None
+        self._random = random.Random(seed)
+
+    def observe(self, value):
+        """Добавить замер
+
+        Args:
+            value(float): Задержка в секундах
+        """
+        self.count += 1
+        self.total += value
+        self.max = value if self.max is None else max(self.max, value)
+        if len(self.samples) < self.size:
+            self.samples.append(value)
+            return
+
+        n = self._random.randrange(self.count)
+        if n < self.size:
+            self.samples[n] = value
+
+    def percentile(self, q):
+        """Перцентиль замеров выборки (nearest rank)
+
+        Args:
+            q(float): Перцентиль от 0 до 100
+
+        Returns:
+            float: None если замеров нет
+        """
+        if not self.samples:
+            return None
+
+        samples = sorted(self.samples)
+        rank = max(1, math.ceil(q / 100 * len(samples)))
+        return samples[rank - 1]
+
+    def summary(self):
+        """Количество, сумма, среднее, перцентили и максимум замеров
+
+        Returns:
+            dict
+        """
+        count = self.count
+        result = {
+            'count': count,
+            'total': round(self.total, 6),
+            'mean': round(self.total / count, 6) if count else None,
+            'max': round(self.max, 6) if count else None,
+        }
+        for q in PERCENTILES:
+            value = self.percentile(q)
+            result['p{}'.format(q)] = round(value, 6) if value is not None else None
+
+        return result
+
+
+class Metrics:
+    """Потокобезопасные метрики загрузки
+
+    Счетчики (задачи, байты, строки, повторы, ошибки) и гистограммы задержек
+    fetch/parse/store по типам задач. По ним видно, во что упирается загрузка:
+    в сеть, в разбор страниц или в базу данных. Кроме гистограмм за всю загрузку
+    ведутся гистограммы стадий с прошлого вывода прогресса (окно), они сбрасываются
+    при каждом выводе.
+    """
+
+    def __init__(self):
+        self.started = time.monotonic()
+        self.counters = collections.Counter()
+        self.histograms = collections.defaultdict(Histogram)
+        self.window = collections.defaultdict(Histogram)
+        self._lock = threading.Lock()
+
+    def incr(self, name, value=1):
+        """Увеличить счетчик
+
+        Args:
+            name(str): Название счетчика
+            value(int): Приращение
+        """
+        with self._lock:
+            self.counters[name] += value
+
+    def observe(self, stage, task_type, seconds):
+        """Добавить замер задержки стадии
+
+        Args:
+            stage(str): Стадия (fetch, parse, store)
+            task_type(str): Тип задачи (stock, trade)
+            seconds(float): Задержка в секундах
+        """
+        with self._lock:
+            self.histograms[(stage, task_type)].observe(seconds)
+            self.window[stage].observe(seconds)
+
+    @contextmanager
+    def timer(self, stage, task_type):
+        """Замер задержки стадии блока кода (в том числе неуспешного)
+
+        Args:
+            stage(str): Стадия (fetch, parse, store)
+            task_type(str): Тип задачи (stock, trade)
+        """
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self.observe(stage, task_type, time.monotonic() - started)
+
+    def record_rows(self, result):
+        """Учесть результат сохранения страницы
+
+        Args:
+            result(dict): Количество добавленных, обновленных и пропущенных строк
+        """
+        with self._lock:
+            for key in ('inserted', 'updated', 'skipped'):
+                self.counters['rows_' + key] += result.get(key, 0)
+
+    def throughput(self):
+        """Пропускная способность с начала загрузки
+
+        Returns:
+            dict
+        """
+        with self._lock:
+            elapsed = time.monotonic() - self.started
+            rows = sum(self.counters['rows_' + key] for key in ('inserted', 'updated', 'skipped'))
+            per_second = 1 / elapsed if elapsed > 0 else 0
+            return {
+                'elapsed': round(elapsed, 3),
+                'tasks_per_sec': round(self.counters['tasks_done'] * per_second, 3),
+                'bytes_per_sec': round(self.counters['bytes'] * per_second, 3),
+                'rows_per_sec': round(rows * per_second, 3),
+            }
+
+    def progress(self):
+        """Строка текущего прогресса для вывода во время загрузки, окно задержек стадий сбрасывается
+
+        Returns:
+            str
+        """
+        throughput = self.throughput()
+        with self._lock:
+            counters = dict(self.counters)
+            window, self.window = self.window, collections.defaultdict(Histogram)
+
+        p95 = []
+        for stage in STAGES:
+            value = window[stage].percentile(95) if stage in window else None
+            p95.append('{} {}'.format(stage, '{:.3f}s'.format(value) if value is not None else '-'))
+
+        return 'progress {:.0f}s: tasks {} ({}/s), failed {}, retries {}, {:.1f} KiB/s, rows {}/s, p95 {}'.format(
+            throughput['elapsed'],
+            counters.get('tasks_done', 0),
+            throughput['tasks_per_sec'],
+            counters.get('tasks_failed', 0),
+            counters.get('fetch_retries', 0) + counters.get('parse_retries', 0),
+            throughput['bytes_per_sec'] / 1024,
+            throughput['rows_per_sec'],
+            ', '.join(p95),
+        )
+
+    def summary(self):
+        """Итоговый отчет: счетчики, пропускная способность и задержки стадий по типам задач
+
+        Returns:
+            dict
+        """
+        throughput = self.throughput()
+        with self._lock:
+            latency = {}
+            for (stage, task_type), histogram in sorted(self.histograms.items()):
+                latency.setdefault(stage, {})[task_type] = histogram.summary()
+
+            return {
+                'counters': dict(sorted(self.counters.items())),
+                'throughput': throughput,
+                'latency': latency,
+            }
+
+    def write(self, path):
+        """Записать итоговый отчет в JSON файл
+
+        Args:
+            path(str): Путь до файла
+        """
+        with open(path, 'w') as file:
+            json.dump(self.summary(), file, indent=2)
+
+
+class ProgressReporter(threading.Thread):
+    """Периодический вывод прогресса загрузки"""
+
+    def __init__(self, metrics, interval=10):
+        """
+        Args:
+            metrics(Metrics): Метрики загрузки
+            interval(float): Период вывода в секундах
+        """
+        threading.Thread.__init__(self)
+        self.metrics = metrics
+        self.interval = interval
+        self.daemon = True
+        self._stopped = threading.Event()
+
+    def run(self):
+        while not self._stopped.wait(self.interval):
+            print(self.metrics.progress())
+
+    def stop(self):
+        """Остановить вывод прогресса"""
+        self._stopped.set()
@@ -1,13 +1,43 @@
 """Модуль парсинга источника https://www.nasdaq.com"""
+import array
+import functools
 import re
 import datetime
 
 import bs4
 
+try:
+    from lxml import html as lxml_html
+except ImportError:  # pragma: no cover
+    lxml_html = None
+
 # Регулярка поиска даты по формату 06/17/2017
 _RE_DATE = re.compile('\d{2}/\d{2}/\d{4}')
 # Регулярка поиска даты по формату 00:00
 _RE_TIME = re.compile('\d{2}:\d{2}')
+# Пространства имен XPath (регулярные выражения EXSLT)
+_XPATH_NS = {'re': 'http://exslt.org/regular-expressions'}
+
+# Регулярки поиска областей страницы для разбора без построения дерева всей страницы
+# Контейнер таблицы акций
+_RE_SCOPE_STOCK = re.compile(r'<div\b[^>]*\bid\s*=\s*["\']historicalContainer["\'][^>]*>', re.I)
+# Контейнер таблицы торгов, таблица должна быть его первым потомком
+_RE_SCOPE_TRADE = re.compile(r'<div\b[^>]*\bclass\s*=\s*["\'][^"\']*\bgenTable\b[^"\']*["\'][^>]*>\s*(?=<table\b)', re.I)
+# Открывающий или закрывающий тег блока или таблицы
+_RE_SCOPE_TAG = re.compile(r'<(/?)(div|table)\b', re.I)
+# Промышленность компании
+_RE_SCOPE_INDUSTRY = re.compile(r'<b\b[^>]*>[^<]*industry:[^<]*</b>\s*<a\b.*?</a>', re.I | re.S)
+# Ссылки на следующую и последнюю страницы
+_RE_SCOPE_PAGER = re.compile(
+    r'<a\b[^>]*\bid\s*=\s*["\']quotes_content_left_lb_(?:Next|Last)Page["\'][^>]*>.*?</a>', re.I | re.S)
+
+# Колонки таблицы акций в колоночном формате
+STOCK_COLUMNS = ('date', 'open', 'high', 'low', 'close', 'volume')
+# Колонки таблицы торгов в колоночном формате
+TRADE_COLUMNS = (
+    'insider_name', 'insider_url', 'relation', 'date', 'type_transaction', 'owner_type',
+    'shares_traded', 'last_price', 'shares_held',
+)
 
 
 class UnknownFormat(Exception):
@@ -34,13 +64,145 @@ def str2date(string):
         return None
 
     if _RE_DATE.search(string):
-        return datetime.datetime.strptime(string, '%m/%d/%Y').date()
+        return _parse_date(string)
     elif _RE_TIME.search(string):
         return datetime.datetime.now().date()
 
     raise UnknownFormat('Неизвестный формат даты {}'.format(string))
 
 
+@functools.lru_cache(maxsize=4096)
+def _parse_date(string):
+    # Даты страниц повторяются (торги одного дня, одни и те же дни на соседних страницах)
+    return datetime.datetime.strptime(string, '%m/%d/%Y').date()
+
+
+def date_column(strings):
+    """
+    Преобразование колонки строк в даты, одинаковые строки преобразуются один раз
+
+    Args:
+        strings(iterable of str): Строки с датами
+
+    Returns:
+        list of datetime.date
+    """
+    cache = {}
+    result = []
+    for string in strings:
+        if string not in cache:
+            cache[string] = str2date(string)
+        result.append(cache[string])
+
+    return result
+
+
+def float_column(strings):
+    """
+    Преобразование колонки строк в массив чисел, пустые значения - NaN
+
+    Args:
+        strings(iterable of str): Строки с числовыми значениями
+
+    Returns:
+        array.array: Массив типа 'd'
+    """
+    nan = float('nan')
+    return array.array('d', [float(i.replace(',', '')) if i else nan for i in strings])
+
+
+def _row_cells(tds, count):
+    """
+    Первые count ячеек строки таблицы для колоночного формата
+
+    Короткая строка - ошибка, как и при построчном разборе: иначе zip по строкам
+    молча отбросил бы колонки всех строк страницы.
+
+    Args:
+        tds(list of str): Ячейки строки
+        count(int): Количество колонок таблицы
+
+    Returns:
+        list of str
+    """
+    if len(tds) < count:
+        raise IndexError('В строке таблицы {} ячеек вместо {}: {}'.format(len(tds), count, tds))
+    return tds[:count]
+
+
+def _cut_table(page, container_re):
+    """
+    Вырезать из страницы первую таблицу внутри контейнера вместе с тегом контейнера
+
+    Args:
+        page(str): Текст страницы
+        container_re(re.Pattern): Регулярка открывающего тега контейнера
+
+    Returns:
+        str: Фрагмент страницы, None если таблица не найдена
+    """
+    container = container_re.search(page)
+    if not container:
+        return None
+
+    # Глубина вложенности div от контейнера и table от первой таблицы в нем
+    div_depth = 1
+    table_depth = 0
+    start = None
+    for tag in _RE_SCOPE_TAG.finditer(page, container.end()):
+        closing = bool(tag.group(1))
+        if tag.group(2).lower() == 'div':
+            div_depth += -1 if closing else 1
+            if div_depth == 0:
+                # Контейнер закрылся раньше, чем закончилась таблица
+                return None
+            continue
+
+        if not closing:
+            if start is None:
+                start = tag.start()
+            table_depth += 1
+            continue
+
+        if start is None:
+            continue
+
+        table_depth -= 1
+        if table_depth == 0:
+            end = page.find('>', tag.end()) + 1
+            if not end:
+                return None
+            return container.group(0) + page[start:end] + '</div>'
+
+    return None
+
+
+def scope_page(page, page_type):
+    """
+    Вырезать из страницы только области, которые нужны парсеру: таблицу данных,
+    промышленность компании и ссылки на следующую и последнюю страницы
+
+    Args:
+        page(str): Текст страницы
+        page_type(str): Тип страницы (stock, trade)
+
+    Returns:
+        str: Небольшой html документ из найденных областей, None если таблица не найдена
+    """
+    table = _cut_table(page, _RE_SCOPE_STOCK if page_type == 'stock' else _RE_SCOPE_TRADE)
+    if table is None:
+        return None
+
+    parts = [table]
+    found = _RE_SCOPE_INDUSTRY.search(page)
+    if found:
+        parts.append('<div>{}</div>'.format(found.group(0)))
+    for found in _RE_SCOPE_PAGER.finditer(page):
+        parts.append('<div>{}</div>'.format(found.group(0)))
+
+    return '<html><body>{}</body></html>'.format(''.join(parts))
+
+
 def str2float(string):
     """
     Преобразование строки в float
@@ -58,17 +220,242 @@ def str2float(string):
     return float(string)
 
 
-class BaseParser:
-    """Бызовый класс парсера"""
+class BaseBackend:
+    """Базовый класс реализации разбора страницы"""
+
+    def __init__(self, page):
+        """
+        Args:
+            page(str): Текст страницы
+        """
+        raise NotImplementedError
+
+    def stock_rows(self):
+        """
+        Строки таблицы акций
+
+        Returns:
+            iterator of list of str: Текст ячеек строк, None если таблица не найдена
+        """
+        raise NotImplementedError
+
+    def trade_rows(self):
+        """
+        Строки таблицы торгов
+
+        Returns:
+            iterator of tuple: (имя совладельца, ссылка на совладельца, текст остальных ячеек),
+                None если таблица не найдена
+        """
+        raise NotImplementedError
+
+    def industry(self):
+        """
+        Промышленность компании
+
+        Returns:
+            str
+        """
+        raise NotImplementedError
+
+    def next_page_url(self):
+        """
+        Ссылка на следующую страницу
+
+        Returns:
+            str
+        """
+        raise NotImplementedError
+
+    def last_page_url(self):
+        """
+        Ссылка на последнюю страницу
+
+        Returns:
+            str
+        """
+        raise NotImplementedError
+
+
+class Bs4Backend(BaseBackend):
+    """Разбор страницы через BeautifulSoup (html.parser), чистый python"""
 
     def __init__(self, page):
-        self._page = page
         self._page_bs = bs4.BeautifulSoup(page, 'html.parser')
 
-    def get_data(self):
+    def stock_rows(self):
+        table_stock = self._page_bs.select_one('div#historicalContainer table')
+        if not table_stock:
+            return None
+
+        return (
+            [i.text.strip() for i in row.select('td')]
+            for row in table_stock.select('tbody tr')
+        )
+
+    def trade_rows(self):
+        table_trade = self._page_bs.select_one('div.genTable > table')
+        if not table_trade:
+            return None
+
+        return self._iter_trade_rows(table_trade)
+
+    @staticmethod
+    def _iter_trade_rows(table_trade):
+        for row in table_trade.select('tr'):
+            tds = row.select('td')
+            if not tds:
+                continue
+
+            insider_element, *tds = tds
+            yield (
+                insider_element.text.strip(),
+                insider_element.find('a')['href'],
+                [i.text.strip() for i in tds],
+            )
+
+    def industry(self):
+        industry_bs = self._page_bs.find('b', text=re.compile('(?i)industry:'))
+        if industry_bs:
+            return industry_bs.find_next_sibling('a').text.strip()
+
+        return None
+
+    def next_page_url(self):
+        next_page_bs = self._page_bs.select_one('a#quotes_content_left_lb_NextPage')
+        if next_page_bs:
+            return next_page_bs.get('href')
+
+        return None
+
+    def last_page_url(self):
+        last_page_bs = self._page_bs.select_one('a#quotes_content_left_lb_LastPage')
+        if last_page_bs:
+            return last_page_bs.get('href')
+
+        return None
+
+
+class LxmlBackend(BaseBackend):
+    """Разбор страницы через lxml (libxml2), дерево строится на C"""
+
+    def __init__(self, page):
+        self._tree = lxml_html.fromstring(page)
+
+    def _first(self, xpath, element=None):
+        found = (self._tree if element is None else element).xpath(xpath, namespaces=_XPATH_NS)
+        return found[0] if found else None
+
+    def stock_rows(self):
+        table_stock = self._first('//div[@id="historicalContainer"]//table')
+        if table_stock is None:
+            return None
+
+        return (
+            [i.text_content().strip() for i in row.iterdescendants('td')]
+            for row in table_stock.xpath('.//tbody//tr')
+        )
+
+    def trade_rows(self):
+        table_trade = self._first('//div[contains(concat(" ", normalize-space(@class), " "), " genTable ")]/table')
+        if table_trade is None:
+            return None
+
+        return self._iter_trade_rows(table_trade)
+
+    def _iter_trade_rows(self, table_trade):
+        for row in table_trade.iterdescendants('tr'):
+            tds = list(row.iterdescendants('td'))
+            if not tds:
+                continue
+
+            insider_element, *tds = tds
+            yield (
+                insider_element.text_content().strip(),
+                self._first('.//a', insider_element).get('href'),
+                [i.text_content().strip() for i in tds],
+            )
+
+    def industry(self):
+        industry_a = self._first('//b[count(*) = 0 and re:test(string(.), "industry:", "i")]/following-sibling::a[1]')
+        if industry_a is not None:
+            return industry_a.text_content().strip()
+
+        return None
+
+    def next_page_url(self):
+        next_page_a = self._first('//a[@id="quotes_content_left_lb_NextPage"]')
+        if next_page_a is not None:
+            return next_page_a.get('href')
+
+        return None
+
+    def last_page_url(self):
+        last_page_a = self._first('//a[@id="quotes_content_left_lb_LastPage"]')
+        if last_page_a is not None:
+            return last_page_a.get('href')
+
+        return None
+
+
+# Доступные реализации разбора страниц
+BACKENDS = {'bs4': Bs4Backend}
+if lxml_html is not None:
+    BACKENDS['lxml'] = LxmlBackend
+
+# Реализация разбора по умолчанию: самая быстрая из доступных
+_default_backend = 'lxml' if 'lxml' in BACKENDS else 'bs4'
+
+
+def set_default_backend(name):
+    """
+    Установить реализацию разбора страниц по умолчанию
+
+    Args:
+        name(str): Название реализации (ключ BACKENDS)
+    """
+    global _default_backend
+    if name not in BACKENDS:
+        raise UnknownFormat('Реализация разбора {} недоступна, доступны {}'.format(name, list(BACKENDS)))
+
+    _default_backend = name
+
+
+def get_default_backend():
+    """
+    Реализация разбора страниц по умолчанию
+
+    Returns:
+        str
+    """
+    return _default_backend
+
+
+class BaseParser:
+    """Бызовый класс парсера"""
+
+    # Тип страницы для выбора областей разбора (см. scope_page)
+    _PAGE_TYPE = None
+
+    def __init__(self, page, backend=None, scoped=True):
+        """
+        Args:
+            page(str): Текст страницы
+            backend(str): Реализация разбора страницы (ключ BACKENDS), по умолчанию - самая быстрая доступная
+            scoped(bool): Разбирать только нужные области страницы, а не дерево всей страницы.
+                Если области не найдены, разбирается вся страница.
+        """
+        if scoped and self._PAGE_TYPE:
+            page = scope_page(page, self._PAGE_TYPE) or page
+        self._backend = BACKENDS[backend or _default_backend](page)
+
+    def get_data(self, columnar=False):
         """
         Главный метод парсинга
 
+        Args:
+            columnar(bool): Вернуть строки таблицы колонками (см. get_columns)
+
         Returns:
             dict
         """
@@ -77,63 +464,86 @@ class BaseParser:
 
 class ParserStock(BaseParser):
     """Парсер для страницы акций компании https://www.nasdaq.com/symbol/goog/historical"""
+    _PAGE_TYPE = 'stock'
 
-    def get_data(self):
-        table_stock = self._page_bs.select_one('div#historicalContainer table')
-        if not table_stock:
+    def iter_stocks(self):
+        """
+        Генератор акций со страницы
+
+        Returns:
+            iterator of dict
+        """
+        rows = self._backend.stock_rows()
+        if rows is None:
             raise NotFoundData('Не найдена таблица с акциями.')
 
-        stocks = []
-        for row in table_stock.select('tbody tr'):
-            tds = [i.text.strip() for i in row.select('td')]
+        for tds in rows:
             if not any(tds):
                 # Пустые строки пропускаем
                 continue
 
-            stocks.append({
+            yield {
                 'date': str2date(tds[0]),
                 'open': str2float(tds[1]),
                 'high': str2float(tds[2]),
                 'low': str2float(tds[3]),
                 'close': str2float(tds[4]),
                 'volume': str2float(tds[5]),
-            })
+            }
 
-        company_industry = None
-        industry_bs = self._page_bs.find('b', text=re.compile('(?i)industry:'))
-        if industry_bs:
-            company_industry = industry_bs.find_next_sibling('a').text.strip()
+    def get_columns(self):
+        """
+        Акции со страницы колонками: даты списком, числа массивами, пустые значения - NaN
 
-        return {
-            'stocks': stocks,
-            'company_industry': company_industry,
-        }
+        Returns:
+            dict: Колонка (STOCK_COLUMNS) -> значения
+        """
+        rows = self._backend.stock_rows()
+        if rows is None:
+            raise NotFoundData('Не найдена таблица с акциями.')
+
+        # Пустые строки пропускаем
+        count = len(STOCK_COLUMNS)
+        columns = list(zip(*[_row_cells(tds, count) for tds in rows if any(tds)])) or [()] * count
+        result = {'date': date_column(columns[0])}
+        for name, column in zip(STOCK_COLUMNS[1:], columns[1:]):
+            result[name] = float_column(column)
+
+        return result
+
+    def get_data(self, columnar=False):
+        data = {'company_industry': self._backend.industry()}
+        if columnar:
+            data['columns'] = self.get_columns()
+        else:
+            data['stocks'] = list(self.iter_stocks())
+        return data
 
 
 class ParserTrade(BaseParser):
     """Парсер для страницы торговли совледелцами комапнии https://www.nasdaq.com/symbol/cvx/insider-trades"""
+    _PAGE_TYPE = 'trade'
 
-    def get_data(self):
-        table_trade = self._page_bs.select_one('div.genTable > table')
-        if not table_trade:
-            raise NotFoundData('Не найдена таблица с закупками.')
+    def iter_trades(self):
+        """
+        Генератор торгов со страницы
 
-        trades = []
-        for row in table_trade.select('tr'):
-            tds = row.select('td')
-            if not tds:
-                continue
+        Returns:
+            iterator of dict
+        """
+        rows = self._backend.trade_rows()
+        if rows is None:
+            raise NotFoundData('Не найдена таблица с закупками.')
 
-            insider_element, *tds = tds
-            tds = [i.text.strip() for i in tds]
+        for insider_name, insider_url, tds in rows:
             if not any(tds):
                 # Пустые строки пропускаем
                 continue
 
-            trades.append({
+            yield {
                 'insider': {
-                    'url': insider_element.find('a')['href'],
-                    'name': insider_element.text.strip(),
+                    'url': insider_url,
+                    'name': insider_name,
                 },
                 'relation': tds[0],
                 'date': str2date(tds[1]),
@@ -142,20 +552,77 @@ class ParserTrade(BaseParser):
                 'shares_traded': str2float(tds[4]),
                 'last_price': str2float(tds[5]),
                 'shares_held': str2float(tds[6]),
-            })
+            }
 
-        company_industry = None
-        industry_bs = self._page_bs.find('b', text=re.compile('(?i)industry:'))
-        if industry_bs:
-            company_industry = industry_bs.find_next_sibling('a').text.strip()
+    def get_columns(self):
+        """
+        Торги со страницы колонками: строки и даты списками, числа массивами, пустые значения - NaN
 
-        next_page_url = None
-        next_page_bs = self._page_bs.select_one('a#quotes_content_left_lb_NextPage')
-        if next_page_bs:
-            next_page_url = next_page_bs.get('href')
+        Returns:
+            dict: Колонка (TRADE_COLUMNS) -> значения
+        """
+        rows = self._backend.trade_rows()
+        if rows is None:
+            raise NotFoundData('Не найдена таблица с закупками.')
+
+        names, urls, cells = [], [], []
+        for insider_name, insider_url, tds in rows:
+            if not any(tds):
+                # Пустые строки пропускаем
+                continue
+            names.append(insider_name)
+            urls.append(insider_url)
+            cells.append(_row_cells(tds, 7))
 
+        columns = list(zip(*cells)) or [()] * 7
         return {
-            'next_page_url': next_page_url,
-            'trades': trades,
-            'company_industry': company_industry,
+            'insider_name': names,
+            'insider_url': urls,
+            'relation': list(columns[0]),
+            'date': date_column(columns[1]),
+            'type_transaction': list(columns[2]),
+            'owner_type': list(columns[3]),
+            'shares_traded': float_column(columns[4]),
+            'last_price': float_column(columns[5]),
+            'shares_held': float_column(columns[6]),
         }
+
+    def get_data(self, columnar=False):
+        data = {
+            'next_page_url': self._backend.next_page_url(),
+            'last_page_url': self._backend.last_page_url(),
+            'company_industry': self._backend.industry(),
+        }
+        if columnar:
+            data['columns'] = self.get_columns()
+        else:
+            data['trades'] = list(self.iter_trades())
+        return data
+
+
+# Парсеры по типу страницы
+PARSERS = {
+    'stock': ParserStock,
+    'trade': ParserTrade,
+}
+
+
+def parse_page(page_type, page, backend=None, scoped=True, columnar=False):
+    """Парсинг загруженной страницы
+
+    Функция не зависит от django, поэтому ее можно выполнять в отдельном процессе.
+
+    Args:
+        page_type(str): Тип страницы (stock, trade)
+        page(str): Текст страницы
+        backend(str): Реализация разбора страницы (ключ BACKENDS)
+        scoped(bool): Разбирать только нужные области страницы
+        columnar(bool): Вернуть строки таблицы колонками, а не словарем на строку
+
+    Returns:
+        dict
+    """
+    if page_type not in PARSERS:
+        raise Exception('Тип не определен')
+
+    return PARSERS[page_type](page, backend=backend, scoped=scoped).get_data(columnar=columnar)
@@ -0,0 +1,244 @@
+"""Локальный сервер, имитирующий страницы источника https://www.nasdaq.com
+
+Отдает сохраненные страницы (по умолчанию parser/tests/files_example) для любой
+компании и любой страницы торгов, что позволяет запускать загрузку без обращения
+к реальному источнику. Задержка, разброс задержки, доля ошибок и ограничение
+количества запросов в секунду настраиваются для нагрузочного тестирования.
+
+Записанные страницы конкретной компании ищутся в подкаталоге <symbol> каталога
+страниц: stock.html, trade_<номер страницы>.html или trade.html. Если их нет,
+отдаются общие stock.html и trade.html.
+"""
+import os
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from urllib.parse import parse_qs, urlsplit
+
+# Каталог сохраненных страниц по умолчанию
+PAGES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'tests', 'files_example')
+# Ссылки на следующую и последнюю страницы торгов
+_RE_PAGER = re.compile(r'<a\b[^>]*\bid="quotes_content_left_lb_(?P<pager>Next|Last)Page"[^>]*>')
+# Адрес ссылки
+_RE_HREF = re.compile(r'href="[^"]*"')
+# Адрес страницы источника
+_RE_PATH = re.compile(r'^/symbol/(?P<symbol>[\w-][\w.-]*)/(?P<page_type>historical|insider-trades)/?$')
+
+
+class _ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class ReplayServer:
+    """Сервер сохраненных страниц источника"""
+
+    def __init__(self, host='127.0.0.1', port=0, pages_dir=PAGES_DIR, trade_pages=35,
+                 latency=0, jitter=0, error_rate=0, throttle=None, seed=None):
+        """
+        Args:
+            host(str): Адрес
+            port(int): Порт (0 - любой свободный)
+            pages_dir(str): Каталог со страницами stock.html и trade.html
+            trade_pages(int): Количество страниц торгов у каждой компании
+            latency(float): Задержка ответа в секундах
+            jitter(float): Разброс задержки в секундах (+-)
+            error_rate(float): Доля ответов с ошибкой 503 (от 0 до 1)
+            throttle(int): Максимальное количество запросов в секунду, сверх него - ответ 429 с Retry-After
+            seed(int): Начальное значение генератора случайных чисел
+        """
+        self.pages_dir = pages_dir
+        self.trade_pages = trade_pages
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.throttle = throttle
+        self.stats = {'requests': 0, 'errors': 0, 'throttled': 0}
+        # Наибольшее количество одновременно обрабатываемых запросов (проверка ограничений пула клиента)
+        self.max_in_flight = 0
+        self._in_flight = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._window = (0, 0)
+        self._pages = {}
+        self._server = _ThreadingHTTPServer((host, port), self._handler_class())
+        self._thread = None
+
+    @property
+    def base_url(self):
+        """Адрес сервера для client.start(base_url=...)
+
+        Returns:
+            str
+        """
+        host, port = self._server.server_address[:2]
+        return 'http://{}:{}'.format(host, port)
+
+    def start(self):
+        """Запустить сервер в фоновом потоке
+
+        Returns:
+            ReplayServer
+        """
+        self._thread = threading.Thread(target=self._server.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def serve_forever(self):
+        """Запустить сервер в текущем потоке"""
+        self._server.serve_forever()
+
+    def stop(self):
+        """Остановить сервер"""
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def page(self, *file_names):
+        """Текст первой найденной сохраненной страницы
+
+        Args:
+            *file_names(str): Пути файлов относительно pages_dir
+
+        Returns:
+            str
+        """
+        for file_name in file_names:
+            if file_name not in self._pages:
+                path = os.path.join(self.pages_dir, file_name)
+                if not os.path.isfile(path):
+                    continue
+                with open(path, 'r') as file:
+                    self._pages[file_name] = file.read()
+
+            return self._pages[file_name]
+
+        raise FileNotFoundError('Не найдена страница {}'.format(file_names))
+
+    def respond(self, path, query):
+        """Ответ на запрос с учетом задержки, ошибок и ограничения количества запросов
+
+        Args:
+            path(str): Путь запроса
+            query(dict): Параметры запроса
+
+        Returns:
+            tuple: (HTTP статус, заголовки, текст страницы)
+        """
+        with self._lock:
+            self.stats['requests'] += 1
+            self._in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self._in_flight)
+            throttled = self._is_throttled()
+            failed = not throttled and self._random.random() < self.error_rate
+            delay = max(0, self.latency + self._random.uniform(-self.jitter, self.jitter))
+
+        try:
+            if delay:
+                time.sleep(delay)
+        finally:
+            with self._lock:
+                self._in_flight -= 1
+
+        if throttled:
+            with self._lock:
+                self.stats['throttled'] += 1
+            return 429, {'Retry-After': '1'}, 'Too Many Requests'
+        if failed:
+            with self._lock:
+                self.stats['errors'] += 1
+            return 503, {}, 'Service Unavailable'
+
+        status, page = self.render(path, query)
+        return status, {}, page
+
+    def _is_throttled(self):
+        """Превышено ли количество запросов в текущую секунду (вызывается под блокировкой)
+
+        Returns:
+            bool
+        """
+        if not self.throttle:
+            return False
+
+        second = int(time.time())
+        window_second, count = self._window
+        if window_second != second:
+            window_second, count = second, 0
+        count += 1
+        self._window = (window_second, count)
+        return count > self.throttle
+
+    def render(self, path, query):
+        """Страница по адресу запроса
+
+        Args:
+            path(str): Путь запроса
+            query(dict): Параметры запроса
+
+        Returns:
+            tuple: (HTTP статус, текст страницы)
+        """
+        found = _RE_PATH.match(path)
+        if not found:
+            return 404, 'Not Found'
+
+        symbol = found.group('symbol')
+        if found.group('page_type') == 'historical':
+            return 200, self.page(os.path.join(symbol, 'stock.html'), 'stock.html')
+
+        page_number = query.get('page', ['1'])[0]
+        if not page_number.isdigit():
+            return 400, 'Bad Request'
+        page_number = int(page_number)
+        if not 1 <= page_number <= self.trade_pages:
+            return 404, 'Not Found'
+
+        trade_url = '{}/symbol/{}/insider-trades?page='.format(self.base_url, symbol)
+        pager = {
+            'Next': page_number + 1,
+            'Last': self.trade_pages,
+        }
+
+        def replace(match):
+            if page_number >= self.trade_pages:
+                # Последняя страница, ссылок дальше нет
+                return '<a>'
+            href = 'href="{}{}"'.format(trade_url, pager[match.group('pager')])
+            return _RE_HREF.sub(href, match.group(0), count=1)
+
+        page = self.page(
+            os.path.join(symbol, 'trade_{}.html'.format(page_number)),
+            os.path.join(symbol, 'trade.html'),
+            'trade.html',
+        )
+        return 200, _RE_PAGER.sub(replace, page)
+
+    def _handler_class(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                url = urlsplit(self.path)
+                status, headers, page = server.respond(url.path, parse_qs(url.query))
+                body = page.encode()
+                self.send_response(status)
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.send_header('Content-Type', 'text/html; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
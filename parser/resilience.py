@@ -0,0 +1,264 @@
+"""Модуль устойчивости загрузки: ограничение частоты запросов, повторы с паузой
+и прерыватель цепи (circuit breaker) по хостам источника"""
+import datetime
+import email.utils
+import random
+import threading
+import time
+from urllib.parse import urlsplit
+
+# HTTP статусы, при которых запрос повторяется
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+
+class FetchError(Exception):
+    """Страница не загружена за все попытки"""
+    pass
+
+
+def retry_after(headers):
+    """Пауза из заголовка Retry-After
+
+    Args:
+        headers(dict): Заголовки ответа
+
+    Returns:
+        float: Пауза в секундах, None если заголовка нет или он некорректен
+    """
+    value = headers.get('Retry-After')
+    if not value:
+        return None
+
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+
+    try:
+        date = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if date is None:
+        return None
+
+    now = datetime.datetime.now(date.tzinfo)
+    return max(0.0, (date - now).total_seconds())
+
+
+class TokenBucket:
+    """Ограничение частоты запросов (token bucket)"""
+
+    def __init__(self, rate, burst=None):
+        """
+        Args:
+            rate(float): Запросов в секунду
+            burst(int): Максимальное количество запросов подряд без паузы (по умолчанию - rate)
+        """
+        self.rate = rate
+        self.burst = burst or max(1, int(rate))
+        self._tokens = self.burst
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self):
+        """Занять место под запрос
+
+        Returns:
+            float: Сколько секунд нужно подождать перед запросом
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= 1
+            if self._tokens >= 0:
+                return 0.0
+
+            return -self._tokens / self.rate
+
+
+class CircuitBreaker:
+    """Прерыватель цепи: после серии ошибок подряд хост ставится на паузу"""
+
+    def __init__(self, threshold=5, reset_timeout=30):
+        """
+        Args:
+            threshold(int): Количество ошибок подряд, после которого хост ставится на паузу
+            reset_timeout(float): Длительность паузы в секундах
+        """
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self._failures = 0
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def wait_time(self):
+        """
+        Returns:
+            float: Сколько секунд хост еще на паузе
+        """
+        with self._lock:
+            return max(0.0, self._paused_until - time.monotonic())
+
+    def pause(self, seconds):
+        """Поставить хост на паузу (например по Retry-After)
+
+        Args:
+            seconds(float): Длительность паузы
+        """
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+    def record_success(self):
+        """Успешный запрос, счетчик ошибок сбрасывается"""
+        with self._lock:
+            self._failures = 0
+
+    def record_failure(self):
+        """Неуспешный запрос"""
+        with self._lock:
+            self._failures += 1
+            if self._failures >= self.threshold:
+                # После паузы пробуем снова, при новой ошибке хост сразу снова на паузе
+                self._failures = self.threshold - 1
+                self._paused_until = time.monotonic() + self.reset_timeout
+
+
+class Resilience:
+    """Политика загрузки: ограничение частоты запросов к хосту, таймаут, повторы с экспоненциальной
+    паузой и случайным разбросом, учет Retry-After и прерыватель цепи по хосту
+
+    Методы возвращают паузы, а ждет вызывающий код (time.sleep или asyncio.sleep),
+    поэтому политика общая для потоковых и асинхронного движков.
+    """
+
+    def __init__(self, rate=None, burst=None, timeout=30, max_attempts=5, backoff_base=0.5, backoff_cap=30,
+                 breaker_threshold=5, breaker_timeout=30, budget=None, max_retry_after=60):
+        """
+        Args:
+            rate(float): Максимальное количество запросов в секунду к одному хосту (None - без ограничения)
+            burst(int): Максимальное количество запросов подряд без паузы
+            timeout(float): Таймаут запроса в секундах
+            max_attempts(int): Максимальное количество попыток запроса
+            backoff_base(float): Базовая пауза перед повтором в секундах
+            backoff_cap(float): Максимальная пауза перед повтором в секундах
+            breaker_threshold(int): Количество ошибок подряд, после которого хост ставится на паузу
+            breaker_timeout(float): Длительность паузы хоста в секундах
+            budget(float): Общий бюджет запросов в минуту ко всем хостам (None - без ограничения),
+                запросы распределяются по минуте равномерно
+            max_retry_after(float): Максимальная пауза по Retry-After в секундах (больший запрос
+                источника сокращается до нее)
+        """
+        self.rate = rate
+        self.burst = burst
+        self.timeout = timeout
+        self.max_attempts = max_attempts
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+        self.breaker_threshold = breaker_threshold
+        self.breaker_timeout = breaker_timeout
+        self.budget = budget
+        self.max_retry_after = max_retry_after
+        self._budget_bucket = TokenBucket(budget / 60) if budget else None
+        self._buckets = {}
+        self._breakers = {}
+        self._lock = threading.Lock()
+        self._random = random.Random()
+
+    def _host(self, url):
+        return urlsplit(url).netloc
+
+    def _bucket(self, host):
+        with self._lock:
+            if host not in self._buckets:
+                self._buckets[host] = TokenBucket(self.rate, self.burst)
+            return self._buckets[host]
+
+    def breaker(self, url):
+        """Прерыватель цепи хоста ссылки
+
+        Args:
+            url(str): Ссылка
+
+        Returns:
+            CircuitBreaker
+        """
+        host = self._host(url)
+        with self._lock:
+            if host not in self._breakers:
+                self._breakers[host] = CircuitBreaker(self.breaker_threshold, self.breaker_timeout)
+            return self._breakers[host]
+
+    def delay_before(self, url):
+        """Пауза перед запросом: пауза хоста, ограничение частоты запросов к хосту и общий бюджет запросов
+
+        Args:
+            url(str): Ссылка
+
+        Returns:
+            float: Пауза в секундах
+        """
+        delay = self.breaker(url).wait_time()
+        if self.rate:
+            delay = max(delay, self._bucket(self._host(url)).reserve())
+        if self._budget_bucket:
+            delay = max(delay, self._budget_bucket.reserve())
+
+        return delay
+
+    def backoff(self, attempt):
+        """Экспоненциальная пауза со случайным разбросом (full jitter)
+
+        Args:
+            attempt(int): Номер попытки, начиная с 0
+
+        Returns:
+            float: Пауза в секундах
+        """
+        return self._random.uniform(0, min(self.backoff_cap, self.backoff_base * 2 ** attempt))
+
+    def on_response(self, url, status, headers, attempt):
+        """Обработка ответа
+
+        Args:
+            url(str): Ссылка
+            status(int): HTTP статус ответа
+            headers(dict): Заголовки ответа
+            attempt(int): Номер попытки, начиная с 0
+
+        Returns:
+            float: Пауза перед повтором, None если повтор не нужен
+
+        Raises:
+            FetchError: Ошибка, которую повтор не исправит (например 403, 404)
+        """
+        breaker = self.breaker(url)
+        if 200 <= status < 300 or status == 304:
+            breaker.record_success()
+            return None
+
+        breaker.record_failure()
+        if status not in RETRY_STATUSES:
+            raise FetchError('Страница {} не загружена: HTTP {}'.format(url, status))
+
+        delay = self.backoff(attempt)
+        pause = retry_after(headers)
+        if pause is not None:
+            # Источник просит подождать - ставим на паузу весь хост
+            pause = min(pause, self.max_retry_after)
+            breaker.pause(pause)
+            delay = max(delay, pause)
+
+        return delay
+
+    def on_error(self, url, attempt):
+        """Обработка ошибки соединения или таймаута
+
+        Args:
+            url(str): Ссылка
+            attempt(int): Номер попытки, начиная с 0
+
+        Returns:
+            float: Пауза перед повтором
+        """
+        self.breaker(url).record_failure()
+        return self.backoff(attempt)
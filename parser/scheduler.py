@@ -0,0 +1,165 @@
+"""Модуль расписания непрерывного обновления данных компаний"""
+import datetime
+import threading
+import time
+
+from django.db.models import Q
+from django.utils import timezone
+
+from stock import models
+
+# Типы задач обновления
+TASK_TYPES = ('stock', 'trade')
+
+
+class RefreshScheduler:
+    """Расписание непрерывного обновления (runscan --daemon)
+
+    Время последнего успешного обновления хранится в БД по компании и типу задачи.
+    В очередь в первую очередь ставятся самые устаревшие данные: устаревание
+    считается в долях интервала обновления, у отслеживаемых компаний интервал
+    короче. Никогда не обновлявшиеся данные ставятся в очередь раньше всех.
+    Задачи выбираются только когда в очереди загрузки есть место, поэтому
+    порядок учитывает устаревание на момент постановки, а не на момент запуска.
+    """
+
+    def __init__(self, interval=3600, watch_interval=300, retry_delay=60, batch_size=10, poll_interval=5):
+        """
+        Args:
+            interval(float): Интервал обновления компании в секундах
+            watch_interval(float): Интервал обновления отслеживаемой компании в секундах
+            retry_delay(float): Пауза перед повторным обновлением после ошибки в секундах
+            batch_size(int): Количество задач, выбираемых из расписания за раз
+            poll_interval(float): Пауза между проверками расписания, когда обновлять нечего
+        """
+        self.interval = interval
+        self.watch_interval = watch_interval
+        self.retry_delay = retry_delay
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        # Задачи, поставленные в очередь и еще не выполненные: (символ, тип задачи) -> id записи
+        self._in_flight = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def seed(symbols, watched=None, chunk_size=1000):
+        """Добавить компании в расписание
+
+        Args:
+            symbols(iterable of str): Сокращенные названия компаний
+            watched(list of str): Отслеживаемые компании (None - не менять)
+            chunk_size(int): Количество компаний, добавляемых одним запросом
+
+        Returns:
+            int: Количество добавленных записей
+        """
+        count = 0
+        chunk = []
+        for symbol in symbols:
+            chunk.append(symbol)
+            if len(chunk) >= chunk_size:
+                count += models.Refresh.add_symbols(chunk, TASK_TYPES)
+                chunk = []
+        count += models.Refresh.add_symbols(chunk, TASK_TYPES)
+
+        if watched is not None:
+            count += models.Refresh.add_symbols(list(watched), TASK_TYPES)
+            models.Refresh.set_watched(list(watched))
+
+        return count
+
+    def _due_query(self, watched, now):
+        interval = self.watch_interval if watched else self.interval
+        with self._lock:
+            in_flight = list(self._in_flight.values())
+
+        return (
+            models.Refresh.objects
+            .filter(watched=watched)
+            .filter(Q(refreshed__isnull=True) | Q(refreshed__lt=now - datetime.timedelta(seconds=interval)))
+            .filter(Q(attempted__isnull=True) | Q(attempted__lt=now - datetime.timedelta(seconds=self.retry_delay)))
+            .exclude(id__in=in_flight)
+            .order_by('refreshed', 'id')
+        )
+
+    def due(self, limit):
+        """Устаревшие данные, которые пора обновить, от самых устаревших
+
+        Args:
+            limit(int): Максимальное количество записей
+
+        Returns:
+            list of Refresh
+        """
+        now = timezone.now()
+        rows = []
+        for watched, interval in ((True, self.watch_interval), (False, self.interval)):
+            rows.extend(
+                (self._staleness(row, now, interval), row)
+                for row in self._due_query(watched, now)[:limit]
+            )
+
+        rows.sort(key=lambda i: (-i[0], i[1].id))
+        return [row for _, row in rows[:limit]]
+
+    @staticmethod
+    def _staleness(row, now, interval):
+        if row.refreshed is None:
+            return float('inf')
+        return (now - row.refreshed).total_seconds() / interval
+
+    def tasks(self, task_urls, duration=None):
+        """Источник задач обновления, бесконечный если не задана длительность
+
+        Args:
+            task_urls(dict): Шаблон ссылки по типу задачи
+            duration(float): Длительность работы источника в секундах (None - без ограничения)
+
+        Returns:
+            generator of dict
+        """
+        deadline = time.monotonic() + duration if duration is not None else None
+        while deadline is None or time.monotonic() < deadline:
+            rows = self.due(self.batch_size)
+            if not rows:
+                pause = self.poll_interval
+                if deadline is not None:
+                    pause = max(0, min(pause, deadline - time.monotonic()))
+                time.sleep(pause)
+                continue
+
+            for row in rows:
+                with self._lock:
+                    self._in_flight[(row.symbol, row.task_type)] = row.id
+                yield {
+                    'task_type': row.task_type,
+                    'symbol': row.symbol,
+                    'url': task_urls[row.task_type].format(row.symbol),
+                    'refresh': True,
+                }
+
+    def _finish(self, task, success):
+        if not task.get('refresh'):
+            # Следующие страницы торгов: обновлением считается загрузка первой страницы
+            return
+
+        models.Refresh.mark(task['symbol'], task['task_type'], success)
+        with self._lock:
+            self._in_flight.pop((task['symbol'], task['task_type']), None)
+
+    @staticmethod
+    def started(task):
+        pass
+
+    def done(self, task, new_tasks=None):
+        """Отметить успешное обновление
+
+        Returns:
+            list of dict: Найденные задачи (следующие страницы торгов)
+        """
+        self._finish(task, True)
+        return new_tasks or []
+
+    def failed(self, task):
+        """Отметить неуспешное обновление, повтор не раньше чем через retry_delay"""
+        self._finish(task, False)
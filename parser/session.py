@@ -0,0 +1,72 @@
+"""Модуль HTTP-сессий с общим пулом keep-alive соединений"""
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+
+# Заголовки по умолчанию для всех запросов к источнику
+_DEFAULT_HEADERS = {
+    'Accept-Encoding': 'gzip, deflate',
+}
+
+
+class SessionPool:
+    """Общая сессия с пулом соединений для всех потоков загрузки
+
+    Соединения переиспользуются между запросами (keep-alive), поэтому TCP и TLS
+    рукопожатие выполняется один раз на соединение, а не на каждую страницу.
+    Ограничения одинаковы для потоковых и асинхронного движков: одновременно
+    выполняется не больше pool_size запросов ко всем хостам и не больше per_host
+    к одному хосту, при исчерпании пула запрос ждет освобождения соединения.
+    """
+
+    def __init__(self, pool_size=10, per_host=10):
+        """
+        Args:
+            pool_size(int): Максимальное количество одновременных соединений ко всем хостам
+            per_host(int): Максимальное количество одновременных соединений к одному хосту
+        """
+        self.pool_size = pool_size
+        self.per_host = per_host
+        # В requests общего ограничения нет (pool_connections - количество хранимых пулов хостов),
+        # поэтому общее количество запросов ограничиваем сами, как limit в aiohttp
+        self._slots = threading.BoundedSemaphore(pool_size)
+
+        adapter = HTTPAdapter(
+            pool_connections=pool_size,
+            pool_maxsize=per_host,
+            pool_block=True,
+        )
+        self.session = requests.Session()
+        self.session.headers.update(_DEFAULT_HEADERS)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def get(self, url, **kwargs):
+        """GET запрос через общий пул соединений
+
+        Args:
+            url(str): Ссылка
+            **kwargs: Параметры requests.Session.get
+
+        Returns:
+            requests.Response
+        """
+        with self._slots:
+            return self.session.get(url, **kwargs)
+
+    def async_session(self):
+        """Асинхронная сессия aiohttp с теми же ограничениями пула
+
+        Returns:
+            aiohttp.ClientSession
+        """
+        # aiohttp нужен только асинхронному движку
+        import aiohttp
+
+        connector = aiohttp.TCPConnector(limit=self.pool_size, limit_per_host=self.per_host)
+        return aiohttp.ClientSession(connector=connector, headers=_DEFAULT_HEADERS)
+
+    def close(self):
+        """Закрыть все соединения пула"""
+        self.session.close()
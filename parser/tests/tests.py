@@ -1,10 +1,25 @@
 """Модуль тестирования парсинга и сохранения данных"""
+import datetime
 import os
+import shutil
+import tempfile
+import threading
+from unittest import mock
 
-from django.test import TestCase
+from django.db.backends.signals import connection_created
+from django.test import TestCase, TransactionTestCase
+from django.utils import timezone
 
-from parser import parsers
+from parser import client, parsers
+from parser.http_cache import ResponseCache
+from parser.journal import SharedTaskQueue, TaskJournal
+from parser.metrics import Histogram, Metrics
+from parser.replay import ReplayServer
+from parser.resilience import CircuitBreaker, FetchError, Resilience, TokenBucket, retry_after
+from parser.scheduler import RefreshScheduler
+from parser.session import SessionPool
 from stock import models
+from stock.cache import lookup_cache
 
 _THIS_PATH = os.path.dirname(os.path.abspath(__file__))
 
@@ -18,6 +33,33 @@ class TestParser(TestCase):
             with self.assertRaises(parsers.NotFoundData):
                 ps.get_data()
 
+    def test_backends_same_result(self):
+        """Проверка одинакового результата всех реализаций разбора страниц, в том числе по областям страницы"""
+        for file_name, page_type in (('stock.html', 'stock'), ('trade.html', 'trade')):
+            with open(os.path.join(_THIS_PATH, 'files_example', file_name), 'r') as file:
+                page = file.read()
+
+            expected = parsers.parse_page(page_type, page, backend='bs4', scoped=False)
+            for backend in parsers.BACKENDS:
+                for scoped in (False, True):
+                    with self.subTest(file_name=file_name, backend=backend, scoped=scoped):
+                        self.assertEqual(
+                            expected,
+                            parsers.parse_page(page_type, page, backend=backend, scoped=scoped)
+                        )
+
+    def test_scoped_empty_container(self):
+        """Проверка разбора по областям: таблица после пустого контейнера не принадлежит ему"""
+        page = (
+            '<div id="historicalContainer"><div><p>No data</p></div></div>'
+            '<div><table><tr><td>01/02/2020</td><td>1</td><td>1</td><td>1</td><td>1</td><td>1</td></tr></table></div>'
+        )
+        for backend in parsers.BACKENDS:
+            for scoped in (False, True):
+                with self.subTest(backend=backend, scoped=scoped):
+                    with self.assertRaises(parsers.NotFoundData):
+                        parsers.parse_page('stock', page, backend=backend, scoped=scoped)
+
     def test_stock(self):
         """Проверка загрузки и сохранения акций"""
 
@@ -29,6 +71,64 @@ class TestParser(TestCase):
 
             self.assertEqual(len(d['stocks']), models.Stock.objects.count())
 
+    def test_stock_store_only_changed(self):
+        """Проверка повторного сохранения акций: обновляются только изменившиеся записи"""
+
+        with open(os.path.join(_THIS_PATH, 'files_example/stock.html'), 'r') as file:
+            page = file.read()
+
+        d = parsers.ParserStock(page).get_data()
+        d.update({'company_symbol': 'goog'})
+        result = models.Stock.store_stocks(d)
+        self.assertEqual(result, {'inserted': len(d['stocks']), 'updated': 0, 'skipped': 0})
+
+        d = parsers.ParserStock(page).get_data()
+        d.update({'company_symbol': 'goog'})
+        d['stocks'][0]['close'] += 1
+        result = models.Stock.store_stocks(d)
+        self.assertEqual(result, {'inserted': 0, 'updated': 1, 'skipped': len(d['stocks']) - 1})
+        self.assertEqual(len(d['stocks']), models.Stock.objects.count())
+        self.assertEqual(
+            d['stocks'][0]['close'],
+            models.Stock.objects.get(date=d['stocks'][0]['date']).close
+        )
+
+    def test_columnar(self):
+        """Проверка колоночного формата: те же значения, что построчно, и сохранение без изменений"""
+        for file_name, page_type, key in (('stock.html', 'stock', 'stocks'), ('trade.html', 'trade', 'trades')):
+            with open(os.path.join(_THIS_PATH, 'files_example', file_name), 'r') as file:
+                page = file.read()
+
+            rows = parsers.parse_page(page_type, page)
+            columns = parsers.parse_page(page_type, page, columnar=True)['columns']
+            with self.subTest(page_type=page_type):
+                self.assertEqual(len(columns['date']), len(rows[key]))
+                self.assertEqual(columns['date'], [i['date'] for i in rows[key]])
+                self.assertEqual(list(columns['close' if page_type == 'stock' else 'shares_held']),
+                                 [i['close' if page_type == 'stock' else 'shares_held'] for i in rows[key]])
+
+                rows.update({'company_symbol': 'goog'})
+                store = models.Stock.store_stocks if page_type == 'stock' else models.Trade.store_trades
+                store(rows)
+                data = parsers.parse_page(page_type, page, columnar=True)
+                data.update({'company_symbol': 'goog'})
+                self.assertEqual(store(data), {'inserted': 0, 'updated': 0, 'skipped': len(rows[key])})
+
+        # Короткая строка - ошибка в обоих форматах, лишние ячейки не учитываются
+        with open(os.path.join(_THIS_PATH, 'files_example/stock.html'), 'r') as file:
+            ps = parsers.ParserStock(file.read())
+        row = ['01/02/2019', '1', '2', '3', '4', '5']
+        with mock.patch.object(ps._backend, 'stock_rows', return_value=[row + ['extra'], row[:3]]):
+            with self.assertRaises(IndexError):
+                ps.get_columns()
+            with self.assertRaises(IndexError):
+                list(ps.iter_stocks())
+        with mock.patch.object(ps._backend, 'stock_rows', return_value=[row + ['extra'], row]):
+            self.assertEqual(list(ps.get_columns()['volume']), [5, 5])
+
+        self.assertEqual(list(parsers.float_column(['1,000.5', ''])[:1]), [1000.5])
+        self.assertNotEqual(parsers.float_column([''])[0], parsers.float_column([''])[0])
+
     def test_trade(self):
         """Проверка загрузки и сохранения торгов"""
 
@@ -39,3 +139,501 @@ class TestParser(TestCase):
             models.Trade.store_trades(d)
 
             self.assertEqual(len(d['trades']), models.Trade.objects.count())
+
+    def test_trade_store_only_changed(self):
+        """Проверка повторного сохранения торгов: справочники не дублируются, обновляются только изменившиеся"""
+
+        with open(os.path.join(_THIS_PATH, 'files_example/trade.html'), 'r') as file:
+            page = file.read()
+
+        d = parsers.ParserTrade(page).get_data()
+        d.update({'company_symbol': 'goog'})
+        result = models.Trade.store_trades(d)
+        self.assertEqual(result, {'inserted': len(d['trades']), 'updated': 0, 'skipped': 0})
+        count_insiders = models.Insider.objects.count()
+        self.assertEqual(count_insiders, len({i['insider']['url'] for i in d['trades']}))
+        self.assertEqual(count_insiders, models.Insider2Company.objects.count())
+
+        d = parsers.ParserTrade(page).get_data()
+        d.update({'company_symbol': 'goog'})
+        d['trades'][0]['shares_held'] += 1
+        result = models.Trade.store_trades(d)
+        self.assertEqual(result, {'inserted': 0, 'updated': 1, 'skipped': len(d['trades']) - 1})
+        self.assertEqual(len(d['trades']), models.Trade.objects.count())
+        self.assertEqual(count_insiders, models.Insider.objects.count())
+
+
+class TestLookupCache(TransactionTestCase):
+
+    def test_concurrent_get_with_save(self):
+        """Проверка справочников: одновременные запросы добавляют одну запись, повторный запрос - из кэша"""
+        workers = 8
+        barrier = threading.Barrier(workers)
+        errors = []
+
+        def lookup():
+            try:
+                barrier.wait()
+                industry = models.Industry.get_with_save(name='technology')
+                models.Company.get_with_save(symbol='goog', industry=industry)
+            except Exception as ex:
+                errors.append(ex)
+
+        threads = [threading.Thread(target=lookup) for _ in range(workers)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        self.assertEqual(models.Industry.objects.filter(name='technology').count(), 1)
+        self.assertEqual(models.Company.objects.filter(symbol='goog').count(), 1)
+        with self.assertNumQueries(0):
+            industry = models.Industry.get_with_save(name='technology')
+            company = models.Company.get_with_save(symbol='goog', industry=industry)
+        self.assertEqual(company.industry_id, industry.id)
+
+    def test_delete_invalidates(self):
+        """Проверка справочников: в кэше только id, удаление записи очищает кэш"""
+        industry = models.Industry.get_with_save(name='technology')
+        company = models.Company.get_with_save(symbol='goog', industry=industry)
+        self.assertEqual(lookup_cache.get(models.Company._cache_key(('goog',))), company.id)
+
+        company.delete()
+        industry.delete()
+        industry = models.Industry.get_with_save(name='technology')
+        company = models.Company.get_with_save(symbol='goog', industry=industry)
+        self.assertTrue(models.Company.objects.filter(id=company.id, industry=industry).exists())
+
+
+class TestResponseCache(TestCase):
+
+    def test_unchanged_after_save(self):
+        """Проверка определения неизменившейся страницы по хэшу и заголовков условного запроса"""
+        url = 'https://www.nasdaq.com/symbol/goog/historical'
+        with open(os.path.join(_THIS_PATH, 'files_example/stock.html'), 'r') as file:
+            page = file.read()
+
+        with tempfile.TemporaryDirectory() as path:
+            cache = ResponseCache(path)
+            entry = cache.entry('stock', 200, {'ETag': '"v1"'}, page)
+            self.assertFalse(cache.is_unchanged(url, 200, entry))
+
+            cache.save(url, entry)
+            self.assertTrue(cache.is_unchanged(url, 200, cache.entry('stock', 200, {}, page)))
+            self.assertTrue(cache.is_unchanged(url, 304, None))
+            self.assertEqual(cache.request_headers(url), {'If-None-Match': '"v1"'})
+
+            changed_page = page.replace('1,381,724', '1,381,725')
+            self.assertFalse(cache.is_unchanged(url, 200, cache.entry('stock', 200, {}, changed_page)))
+
+
+class TestTaskHandler(TestCase):
+
+    def test_next_trade_pages(self):
+        """Проверка выбора следующей страницы торгов в инкрементальном и полном режимах"""
+        task = {'task_type': 'trade', 'symbol': 'goog', 'url': 'https://www.nasdaq.com/symbol/goog/insider-trades'}
+        next_url = 'https://www.nasdaq.com/symbol/goog/insider-trades?page=2'
+
+        incremental = client.TaskHandler(trade_mode='incremental')
+        self.assertEqual(incremental._next_trade_pages(task, next_url, {'inserted': 0}), [])
+        self.assertEqual(
+            incremental._next_trade_pages(task, next_url, {'inserted': 1}),
+            [{'task_type': 'trade', 'symbol': 'goog', 'url': next_url}]
+        )
+
+        full = client.TaskHandler(trade_mode='full', trade_pages=2)
+        self.assertEqual(len(full._next_trade_pages(task, next_url, {'inserted': 0})), 1)
+        self.assertEqual(full._next_trade_pages(task, next_url.replace('2', '3'), {'inserted': 0}), [])
+
+        # Известно количество страниц - все оставшиеся страницы разом
+        full = client.TaskHandler(trade_mode='full', trade_pages=10)
+        last_url = next_url.replace('2', '35')
+        pages = full._next_trade_pages(task, next_url, {'inserted': 0}, last_url)
+        self.assertEqual([i['url'] for i in pages], [next_url[:-1] + str(i) for i in range(2, 11)])
+        self.assertEqual(full._next_trade_pages(pages[0], next_url.replace('2', '3'), {'inserted': 1}, last_url), [])
+
+    def test_task_queue(self):
+        """Проверка ленивого источника задач и добавления задач исполнителей сверх размера очереди"""
+        symbols = iter(['goog', 'aapl'])
+        tasks = client.iter_tasks(symbols, base_url='http://127.0.0.1:8001/')
+        self.assertEqual(next(tasks)['url'], 'http://127.0.0.1:8001/symbol/goog/historical')
+        self.assertEqual(next(tasks)['url'], 'http://127.0.0.1:8001/symbol/goog/insider-trades')
+        # Источник компаний читается только по мере запроса задач
+        self.assertEqual(next(symbols), 'aapl')
+
+        queue = client.TaskQueue(maxsize=1)
+        queue.put({'symbol': 'goog'})
+        self.assertTrue(queue.full())
+        queue.put_unbounded({'symbol': 'aapl'})
+        self.assertEqual(queue.qsize(), 2)
+        self.assertEqual(queue.unfinished_tasks, 2)
+
+
+class TestTaskJournal(TestCase):
+
+    def test_resume(self):
+        """Проверка незавершенных задач журнала, включая найденные во время загрузки страницы торгов"""
+        journal = TaskJournal(chunk_size=3)
+        tasks = client.get_tasks(symbols=['goog', 'aapl'])
+        self.assertEqual(list(journal.track(tasks)), tasks)
+
+        stock, trade = tasks[:2]
+        next_page = dict(trade, url=trade['url'] + '?page=2')
+        journal.started(stock)
+        journal.started(trade)
+        self.assertEqual(journal.done(trade, [next_page]), [next_page])
+        # Страница уже в журнале - повторно в очередь не ставится
+        self.assertEqual(journal.done(trade, [next_page]), [])
+
+        self.assertEqual(list(journal.unfinished()), [stock] + tasks[2:] + [next_page])
+        self.assertEqual(models.ScanTask.objects.get(url=trade['url']).status, models.ScanTask.DONE)
+        self.assertEqual(models.ScanTask.objects.get(url=stock['url']).attempts, 1)
+
+        # При продолжении загрузки записанные задачи источника пропускаются
+        new_task = client.get_tasks(symbol='msft')
+        self.assertEqual(list(journal.track(tasks + new_task)), new_task)
+
+    def test_shared_queue(self):
+        """Проверка захвата задач общей очереди в аренду и повторного захвата по истечении аренды"""
+        tasks = client.get_tasks(symbols=['goog', 'aapl'])
+        queue = SharedTaskQueue(worker='first')
+        self.assertEqual(queue.enqueue(tasks), 4)
+
+        self.assertEqual(models.ScanTask.claim_tasks(models.ScanTask.SHARED, 'first', 3, lease_timeout=60), tasks[:3])
+        self.assertEqual(models.ScanTask.claim_tasks(models.ScanTask.SHARED, 'second', 3, lease_timeout=60), tasks[3:])
+        self.assertEqual(models.ScanTask.claim_tasks(models.ScanTask.SHARED, 'second', 3, lease_timeout=60), [])
+
+        # Найденные страницы торгов уходят в общую очередь, а не в локальную
+        next_page = dict(tasks[1], url=tasks[1]['url'] + '?page=2')
+        self.assertEqual(queue.done(tasks[1], [next_page]), [])
+        self.assertEqual(models.ScanTask.claim_tasks(models.ScanTask.SHARED, 'second', 3, lease_timeout=-1), [next_page])
+        # Аренда истекла - задачу захватывает другой процесс
+        self.assertEqual(models.ScanTask.claim_tasks(models.ScanTask.SHARED, 'first', 3, lease_timeout=60), [next_page])
+        self.assertEqual(models.ScanTask.objects.get(url=next_page['url']).attempts, 2)
+
+        # Повторная постановка в очередь возвращает только завершенные задачи
+        self.assertEqual(queue.enqueue(tasks), 1)
+
+    def test_leases(self):
+        """Проверка разделения журнала и общей очереди, продления аренды и завершения задачи только владельцем"""
+        tasks = client.get_tasks(symbols=['goog'])
+        first = SharedTaskQueue(worker='first', lease_timeout=60)
+        second = SharedTaskQueue(worker='second', lease_timeout=60)
+        journal = TaskJournal(worker='journal')
+        first.enqueue(tasks)
+        shared = models.ScanTask.objects.filter(queue=models.ScanTask.SHARED)
+        self.assertEqual(list(journal.track(tasks)), tasks)
+
+        # Очистка журнала не трогает общую очередь
+        journal.reset()
+        self.assertFalse(models.ScanTask.objects.filter(queue=models.ScanTask.JOURNAL).exists())
+        self.assertEqual(shared.count(), 2)
+
+        # Начатая задача журнала берется в аренду
+        list(journal.track(tasks[:1]))
+        journal.started(tasks[0])
+        row = models.ScanTask.objects.get(queue=models.ScanTask.JOURNAL, url=tasks[0]['url'])
+        self.assertEqual((row.worker, row.status), ('journal', models.ScanTask.IN_PROGRESS))
+        self.assertIsNotNone(row.lease_until)
+
+        self.assertEqual(models.ScanTask.claim_tasks(models.ScanTask.SHARED, 'first', 1, lease_timeout=-1), tasks[:1])
+        # Аренда продлевается, пока процесс выполняет задачу
+        self.assertEqual(models.ScanTask.renew(models.ScanTask.SHARED, 'first', 60), 1)
+        self.assertEqual(models.ScanTask.claim_tasks(models.ScanTask.SHARED, 'second', 2, lease_timeout=60), tasks[1:])
+
+        # Задачу с истекшей арендой захватил другой процесс - прежний владелец ее не завершает
+        shared.filter(url=tasks[0]['url']).update(lease_until=timezone.now())
+        self.assertEqual(models.ScanTask.claim_tasks(models.ScanTask.SHARED, 'second', 1, lease_timeout=60), tasks[:1])
+        next_page = dict(tasks[1], url=tasks[1]['url'] + '?page=2')
+        self.assertEqual(first.done(tasks[0], [next_page]), [])
+        self.assertFalse(shared.filter(url=next_page['url']).exists())
+        second.done(tasks[0])
+        self.assertEqual(shared.get(url=tasks[0]['url']).status, models.ScanTask.DONE)
+
+        # Выполнение, прерванное до записи аренды, захватывается повторно
+        shared.filter(url=tasks[1]['url']).update(lease_until=None)
+        claimed = first.claim(2)
+        self.assertEqual(next(claimed), tasks[1])
+        claimed.close()
+
+
+class TestReplayServer(TestCase):
+
+    def test_respond(self):
+        """Проверка страниц, ошибок и ограничения количества запросов локального сервера источника"""
+        with ReplayServer(trade_pages=2, throttle=2) as server:
+            status, _, page = server.respond('/symbol/aapl/insider-trades', {'page': ['2']})
+            self.assertEqual(status, 200)
+            data = parsers.parse_page('trade', page)
+            self.assertIsNone(data['next_page_url'])
+            self.assertTrue(data['trades'])
+            # Некорректный номер страницы и номер вне диапазона
+            self.assertEqual(server.render('/symbol/aapl/insider-trades', {'page': ['abc']})[0], 400)
+            self.assertEqual(server.render('/symbol/aapl/insider-trades', {'page': ['0']})[0], 404)
+            self.assertEqual(server.render('/symbol/aapl/insider-trades', {'page': ['3']})[0], 404)
+
+            with mock.patch('parser.replay.time.time', return_value=100.0):
+                self.assertEqual(server.respond('/symbol/aapl/historical', {})[0], 200)
+                self.assertEqual(server.respond('/symbol/aapl/historical', {})[0], 200)
+                # Третий запрос в ту же секунду
+                self.assertEqual(server.respond('/symbol/aapl/historical', {})[:2], (429, {'Retry-After': '1'}))
+
+        with ReplayServer(error_rate=1) as server:
+            self.assertEqual(server.respond('/symbol/aapl/historical', {})[0], 503)
+            self.assertEqual(server.stats, {'requests': 1, 'errors': 1, 'throttled': 0})
+
+
+class TestEngines(TransactionTestCase):
+
+    def test_daemon(self):
+        """Проверка непрерывного обновления всеми движками: страницы загружаются и сохраняются"""
+        for engine in client.ENGINES:
+            # Своя компания для каждого движка: данные предыдущего движка не засчитываются
+            with self.subTest(engine=engine), ReplayServer(trade_pages=2) as server:
+                client.start(
+                    count_tread=2, engine=engine, symbols=[engine], base_url=server.base_url,
+                    progress_interval=0, daemon=True, duration=1,
+                )
+                self.assertGreater(server.stats['requests'], 0)
+                self.assertTrue(models.Stock.objects.filter(company__symbol=engine).exists())
+                self.assertTrue(models.Trade.objects.filter(company__symbol=engine).exists())
+                self.assertFalse(models.Refresh.objects.filter(symbol=engine, refreshed__isnull=True).exists())
+
+    def test_async_pool(self):
+        """Проверка асинхронного движка: загрузка, парсинг и сохранение, следующие страницы торгов, ошибки"""
+        with ReplayServer(trade_pages=3) as server:
+            handler = client.TaskHandler(trade_mode='full', trade_pages=3)
+            pool = client.AsyncPool(2, handler=handler)
+            pool.add_tasks(client.iter_tasks(['aapl'], base_url=server.base_url))
+            pool.wait_completion()
+
+            # Страница акций и три страницы торгов: следующие страницы поставлены в очередь исполнителями
+            self.assertEqual(server.stats['requests'], 4)
+            self.assertEqual(handler.metrics.counters['tasks_done'], 4)
+            self.assertTrue(models.Stock.objects.filter(company__symbol='aapl').exists())
+            self.assertTrue(models.Trade.objects.filter(company__symbol='aapl').exists())
+
+        with ReplayServer(error_rate=1) as server:
+            handler = client.TaskHandler(resilience=Resilience(max_attempts=2, backoff_base=0.01))
+            pool = client.AsyncPool(2, handler=handler)
+            pool.add_tasks(client.iter_tasks(['msft'], base_url=server.base_url))
+            pool.wait_completion()
+
+            # Каждая задача - две попытки, затем задача отмечается неуспешной
+            self.assertEqual(server.stats['requests'], 4)
+            self.assertEqual(handler.metrics.counters['fetch_retries'], 2)
+            self.assertEqual(handler.metrics.counters['tasks_failed'], 2)
+            self.assertFalse(models.Company.objects.filter(symbol='msft').exists())
+
+    def test_async_pool_connections(self):
+        """Проверка асинхронного движка: соединения с БД потоков пула закрываются"""
+        created = []
+
+        def on_created(sender, connection, **kwargs):
+            if threading.current_thread() is not threading.main_thread():
+                created.append(connection)
+
+        models.Company.objects.create(symbol='aapl', industry=models.Industry.objects.create(name='test'))
+        connection_created.connect(on_created)
+        try:
+            with ReplayServer(trade_pages=1) as server:
+                pool = client.AsyncPool(2, handler=client.TaskHandler())
+                pool.add_tasks(client.iter_tasks(client.iter_symbols_db(), base_url=server.base_url))
+                pool.wait_completion()
+        finally:
+            connection_created.disconnect(on_created)
+
+        self.assertTrue(created)
+        self.assertTrue(all(i.connection is None for i in created))
+
+    def test_connection_limits(self):
+        """Проверка одинакового смысла ограничений пула соединений в потоковом и асинхронном движках"""
+        for pool_class in (client.ThreadPool, client.AsyncPool):
+            for pool_size, per_host in ((2, 10), (10, 2)):
+                with self.subTest(pool=pool_class.__name__, pool_size=pool_size, per_host=per_host), \
+                        ReplayServer(trade_pages=1, latency=0.1) as server:
+                    session = SessionPool(pool_size=pool_size, per_host=per_host)
+                    pool = pool_class(6, handler=client.TaskHandler(session=session))
+                    pool.add_tasks(client.iter_tasks(['aapl', 'goog', 'msft'], base_url=server.base_url))
+                    pool.wait_completion()
+                    session.close()
+
+                    self.assertEqual(server.stats['requests'], 6)
+                    self.assertEqual(server.max_in_flight, 2)
+
+    def test_pipeline(self):
+        """Проверка конвейера: те же строки, что у пула потоков; ошибка парсинга в процессе не останавливает конвейер"""
+        def rows(symbol):
+            return (
+                list(models.Stock.objects.filter(company__symbol=symbol).order_by('date')
+                     .values_list('date', *models.Stock._COLS_VALUES)),
+                sorted(models.Trade.objects.filter(company__symbol=symbol)
+                       .values_list('date', 'insider__name', 'type_transaction__name', *models.Trade._COLS_VALUES)),
+            )
+
+        with ReplayServer(trade_pages=3) as server:
+            for symbol, pool_class in (('thread', client.ThreadPool), ('pipeline', client.Pipeline)):
+                handler = client.TaskHandler(trade_mode='full', trade_pages=3)
+                kwargs = {'num_parse': 2, 'queue_size': 1} if pool_class is client.Pipeline else {}
+                pool = pool_class(2, handler=handler, **kwargs)
+                pool.add_tasks(client.iter_tasks([symbol], base_url=server.base_url))
+                pool.wait_completion()
+                self.assertEqual(handler.metrics.counters['tasks_done'], 4)
+
+        self.assertTrue(all(rows('thread')))
+        self.assertEqual(rows('pipeline'), rows('thread'))
+
+        # Страница акций без таблицы: после всех попыток парсинга задача отмечается неуспешной
+        with tempfile.TemporaryDirectory() as pages_dir:
+            shutil.copy(os.path.join(_THIS_PATH, 'files_example/stock_no_table.html'),
+                        os.path.join(pages_dir, 'stock.html'))
+            shutil.copy(os.path.join(_THIS_PATH, 'files_example/trade.html'), pages_dir)
+            with ReplayServer(pages_dir=pages_dir, trade_pages=1) as server:
+                handler = client.TaskHandler()
+                pool = client.Pipeline(2, num_parse=1, queue_size=1, handler=handler)
+                pool.add_tasks(client.iter_tasks(['aapl', 'goog', 'msft'], base_url=server.base_url))
+                completion = threading.Thread(target=pool.wait_completion, daemon=True)
+                completion.start()
+                completion.join(60)
+
+                self.assertFalse(completion.is_alive())
+                self.assertEqual(handler.metrics.counters['tasks_failed'], 3)
+                self.assertEqual(handler.metrics.counters['tasks_done'], 3)
+
+
+class TestResilience(TestCase):
+
+    def test_token_bucket(self):
+        """Проверка паузы при превышении частоты запросов"""
+        bucket = TokenBucket(rate=10, burst=2)
+        self.assertEqual(bucket.reserve(), 0)
+        self.assertEqual(bucket.reserve(), 0)
+        self.assertAlmostEqual(bucket.reserve(), 0.1, places=2)
+
+    def test_circuit_breaker(self):
+        """Проверка паузы хоста после серии ошибок"""
+        breaker = CircuitBreaker(threshold=2, reset_timeout=60)
+        breaker.record_failure()
+        self.assertEqual(breaker.wait_time(), 0)
+        breaker.record_failure()
+        self.assertGreater(breaker.wait_time(), 59)
+
+    def test_on_response(self):
+        """Проверка повтора ответов 429/5xx с учетом Retry-After, остальные ошибки не повторяются"""
+        resilience = Resilience(backoff_base=0.01, breaker_threshold=10)
+        url = 'https://www.nasdaq.com/symbol/goog/historical'
+        self.assertIsNone(resilience.on_response(url, 200, {}, 0))
+        self.assertIsNone(resilience.on_response(url, 304, {}, 0))
+        with self.assertRaises(FetchError):
+            resilience.on_response(url, 404, {}, 0)
+        self.assertLessEqual(resilience.on_response(url, 503, {}, 0), 0.01)
+        self.assertEqual(resilience.on_response(url, 429, {'Retry-After': '5'}, 0), 5)
+        self.assertGreater(resilience.delay_before(url), 4)
+        # Пауза по Retry-After ограничена
+        self.assertEqual(Resilience(max_retry_after=30).on_response(url, 429, {'Retry-After': '3600'}, 0), 30)
+        self.assertIsNone(retry_after({}))
+        self.assertEqual(retry_after({'Retry-After': 'Wed, 21 Oct 2015 07:28:00 GMT'}), 0)
+
+    def test_no_pause_after_last_attempt(self):
+        """Проверка повторов запроса: после последней неудачной попытки пауза не выдерживается"""
+        events = []
+        session = mock.Mock()
+        session.get.side_effect = lambda *args, **kwargs: events.append('get') or mock.Mock(
+            status_code=503, content=b'', headers={'Retry-After': '7'})
+        handler = client.TaskHandler(session=session, resilience=Resilience(max_attempts=3, breaker_threshold=10))
+        with mock.patch('parser.client.time.sleep', side_effect=lambda delay: delay and events.append('sleep')):
+            with self.assertRaises(FetchError):
+                handler._get('https://www.nasdaq.com/symbol/goog/historical')
+        self.assertEqual(events.count('get'), 3)
+        self.assertEqual(events[-1], 'get')
+        self.assertEqual(handler.metrics.counters['fetch_retries'], 2)
+
+    def test_permanent_error(self):
+        """Проверка ответа, который повтор не исправит: одна попытка, задача отмечается неуспешной"""
+        session = mock.Mock()
+        session.get.return_value = mock.Mock(status_code=403, content=b'Forbidden', text='Forbidden', headers={})
+        handler = client.TaskHandler(session=session, resilience=Resilience(max_attempts=3, breaker_threshold=10))
+        pool = client.ThreadPool(1, handler=handler)
+        pool.add_tasks(client.iter_tasks(['goog']))
+        pool.wait_completion()
+
+        # Страница акций и страница торгов - по одному запросу
+        self.assertEqual(session.get.call_count, 2)
+        self.assertEqual(handler.metrics.counters['tasks_failed'], 2)
+        self.assertEqual(handler.metrics.counters['parse_retries'], 0)
+
+    def test_budget(self):
+        """Проверка общего бюджета запросов ко всем хостам"""
+        resilience = Resilience(budget=60)
+        self.assertEqual(resilience.delay_before('https://www.nasdaq.com/symbol/goog/historical'), 0)
+        self.assertAlmostEqual(resilience.delay_before('http://127.0.0.1:8001/symbol/goog/historical'), 1, places=2)
+
+
+class TestRefreshScheduler(TestCase):
+
+    def test_due(self):
+        """Проверка порядка обновления по устареванию с учетом отслеживаемых компаний"""
+        scheduler = RefreshScheduler(interval=3600, watch_interval=60, retry_delay=60)
+        self.assertEqual(scheduler.seed(['goog', 'aapl', 'msft'], watched=['aapl']), 6)
+        urls = client.task_urls()
+
+        # Никогда не обновлявшиеся данные - все и сразу
+        tasks = scheduler.tasks(urls)
+        first = [next(tasks) for _ in range(6)]
+        self.assertEqual({(i['symbol'], i['task_type']) for i in first}, {
+            (symbol, task_type) for symbol in ['goog', 'aapl', 'msft'] for task_type in ['stock', 'trade']})
+        # Поставленные в очередь задачи повторно не выбираются
+        self.assertEqual(scheduler.due(10), [])
+
+        for task in first:
+            scheduler.done(task)
+        self.assertEqual(scheduler.due(10), [])
+
+        # Данные отслеживаемой компании устаревают за минуту, остальных - за час
+        now = timezone.now()
+        models.Refresh.objects.update(refreshed=now - datetime.timedelta(minutes=5))
+        models.Refresh.objects.filter(symbol='goog', task_type='stock').update(refreshed=now - datetime.timedelta(hours=2))
+        due = [(i.symbol, i.task_type) for i in scheduler.due(10)]
+        self.assertEqual(due, [('aapl', 'stock'), ('aapl', 'trade'), ('goog', 'stock')])
+
+        # После ошибки повтор не раньше чем через retry_delay
+        scheduler.failed(dict(first[0], symbol='goog', task_type='stock'))
+        self.assertNotIn('goog', [i.symbol for i in scheduler.due(10)])
+
+
+class TestMetrics(TestCase):
+
+    def test_summary(self):
+        """Проверка перцентилей задержек и счетчиков итогового отчета"""
+        histogram = Histogram()
+        for value in range(1, 101):
+            histogram.observe(value / 100)
+        summary = histogram.summary()
+        self.assertEqual(summary['count'], 100)
+        self.assertEqual((summary['p50'], summary['p95'], summary['p99']), (0.5, 0.95, 0.99))
+        self.assertIsNone(Histogram().percentile(50))
+
+        # Хранится не больше size замеров, количество, среднее и максимум точные
+        histogram = Histogram(size=10, seed=1)
+        for value in range(1, 1001):
+            histogram.observe(value)
+        summary = histogram.summary()
+        self.assertEqual(len(histogram.samples), 10)
+        self.assertEqual((summary['count'], summary['mean'], summary['max']), (1000, 500.5, 1000))
+
+        metrics = Metrics()
+        with self.assertRaises(ValueError):
+            with metrics.timer('store', 'trade'):
+                raise ValueError()
+        metrics.record_rows({'inserted': 2, 'updated': 1, 'skipped': 3})
+        metrics.incr('tasks_done')
+        summary = metrics.summary()
+        self.assertEqual(summary['latency']['store']['trade']['count'], 1)
+        self.assertEqual(summary['counters']['rows_skipped'], 3)
+        self.assertEqual(summary['counters']['tasks_done'], 1)
+
+        # Окно задержек сбрасывается после вывода прогресса
+        self.assertRegex(metrics.progress(), r'store \d')
+        self.assertIn('store -', metrics.progress())
+        self.assertEqual(metrics.summary()['latency']['store']['trade']['count'], 1)
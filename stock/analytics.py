@@ -0,0 +1,168 @@
+"""Модуль аналитики по акциям компании (Stock.get_analytics_by_symbol_and_dates) на массивах NumPy"""
+import numpy as np
+
+# Колонки цен, для которых считается изменение к предыдущему дню (<колонка>_r)
+PRICE_COLUMNS = ('open', 'high', 'low', 'close')
+# Количество дней скользящего окна по умолчанию
+WINDOW = 20
+
+
+def change(values):
+    """Изменение к предыдущему дню в процентах от текущего значения: 100 - 100 * предыдущее / текущее
+
+    Args:
+        values(numpy.ndarray): Значения по возрастанию дат
+
+    Returns:
+        numpy.ndarray: Для первого дня - nan
+    """
+    result = np.full(len(values), np.nan)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        result[1:] = 100 - 100 * values[:-1] / values[1:]
+    return result
+
+
+def returns(values):
+    """Доходность к предыдущему дню в процентах: 100 * текущее / предыдущее - 100
+
+    Args:
+        values(numpy.ndarray): Значения по возрастанию дат
+
+    Returns:
+        numpy.ndarray: Для первого дня - nan
+    """
+    result = np.full(len(values), np.nan)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        result[1:] = 100 * values[1:] / values[:-1] - 100
+    return result
+
+
+def _rolling_sums(values, window):
+    """Суммы окон из window последних значений (по накопленным суммам)"""
+    cumsum = np.concatenate(([0.0], np.cumsum(values)))
+    return cumsum[window:] - cumsum[:-window]
+
+
+def moving_average(values, window):
+    """Скользящее среднее
+
+    Args:
+        values(numpy.ndarray): Значения по возрастанию дат
+        window(int): Количество дней окна
+
+    Returns:
+        numpy.ndarray: Для первых window - 1 дней - nan
+    """
+    result = np.full(len(values), np.nan)
+    if len(values) >= window:
+        result[window - 1:] = _rolling_sums(values, window) / window
+    return result
+
+
+def volatility(values, window):
+    """Скользящее стандартное отклонение доходности (returns) за window дней
+
+    Args:
+        values(numpy.ndarray): Цены по возрастанию дат
+        window(int): Количество дней окна
+
+    Returns:
+        numpy.ndarray: Для первых window дней - nan
+    """
+    result = np.full(len(values), np.nan)
+    if window < 2 or len(values) <= window:
+        return result
+
+    day_returns = returns(values)[1:]
+    sums = _rolling_sums(day_returns, window)
+    squares = _rolling_sums(day_returns ** 2, window)
+    # Дисперсия по суммам значений и квадратов, отрицательные значения - погрешность округления
+    variance = np.maximum((squares - sums ** 2 / window) / (window - 1), 0)
+    result[window:] = np.sqrt(variance)
+    return result
+
+
+def drawdown(values):
+    """Просадка: отклонение от максимума с начала ряда в процентах (0 - на максимуме)
+
+    Args:
+        values(numpy.ndarray): Цены по возрастанию дат
+
+    Returns:
+        numpy.ndarray
+    """
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return 100 * values / np.maximum.accumulate(values) - 100
+
+
+def to_list(values):
+    """Значения массива списком, nan и бесконечность заменяются на None"""
+    result = values.astype(object)
+    result[~np.isfinite(values)] = None
+    return result.tolist()
+
+
+def analyze(rows, skip=0, window=WINDOW):
+    """Аналитика по дням
+
+    Args:
+        rows(list of tuple): (дата, open, high, low, close, volume) по возрастанию дат, после них
+            могут идти сохраненные изменения к предыдущему дню в порядке PRICE_COLUMNS
+            (иначе изменения считаются по ценам)
+        skip(int): Количество первых дней, нужных только для расчета окон (в результат не входят)
+        window(int): Количество дней скользящего окна
+
+    Returns:
+        list of dict: см. analyze_columns
+    """
+    if len(rows) <= skip:
+        return []
+
+    dates, *columns = zip(*rows)
+    count = len(PRICE_COLUMNS)
+    return analyze_columns(dates, columns[:count], columns[count], columns[count + 1:], skip=skip, window=window)
+
+
+def analyze_columns(dates, prices, volume, changes=(), skip=0, window=WINDOW):
+    """Аналитика по дням, данные - колонками (списки или массивы NumPy)
+
+    Args:
+        dates(list of datetime.date): Даты по возрастанию
+        prices(list): Цены в порядке PRICE_COLUMNS
+        volume(list): Объемы
+        changes(list): Сохраненные изменения к предыдущему дню в порядке PRICE_COLUMNS
+            (пустой - посчитать по ценам)
+        skip(int): Количество первых дней, нужных только для расчета окон (в результат не входят)
+        window(int): Количество дней скользящего окна
+
+    Returns:
+        list of dict: Дни по убыванию дат - цены, объем, изменения к предыдущему дню
+            <колонка>_r и по close: скользящее среднее close_ma, волатильность close_volatility,
+            просадка close_drawdown (от максимума за период без дней skip)
+    """
+    if len(dates) <= skip:
+        return []
+
+    prices = dict(zip(PRICE_COLUMNS, (np.asarray(i, dtype=float) for i in prices)))
+    close = prices['close']
+
+    result = {
+        'date': list(dates[skip:]),
+        'volume': _as_list(volume[skip:]),
+        'close_ma': to_list(moving_average(close, window)[skip:]),
+        'close_volatility': to_list(volatility(close, window)[skip:]),
+        'close_drawdown': to_list(drawdown(close[skip:])),
+    }
+    for n, (name, values) in enumerate(prices.items()):
+        result[name] = values[skip:].tolist()
+        if len(changes):
+            result[name + '_r'] = to_list(np.asarray(changes[n][skip:], dtype=float))
+        else:
+            result[name + '_r'] = to_list(change(values)[skip:])
+
+    keys = list(result)
+    return [dict(zip(keys, i)) for i in zip(*result.values())][::-1]
+
+
+def _as_list(values):
+    return values.tolist() if isinstance(values, np.ndarray) else list(values)
@@ -106,8 +106,16 @@ def analytics(request, symbol):
             return HttpResponseBadRequest(
                 'Не верно задана формат даты "date_to" - {}, используется формат 21-01-2018'.format(date_from))
 
+    window = request.GET.get('window') or models.analytics.WINDOW
+    try:
+        window = int(window)
+        if window < 1:
+            raise ValueError(window)
+    except ValueError:
+        return HttpResponseBadRequest('Не верно задано количество дней окна "window" - {}'.format(window))
+
     stocks = models.Stock.get_analytics_by_symbol_and_dates(
-        symbol=symbol, date_from=date_from, date_to=date_to,
+        symbol=symbol, date_from=date_from, date_to=date_to, window=window,
         field_values=[
             'date',
             'open',
@@ -118,6 +126,9 @@ def analytics(request, symbol):
             'low_r',
             'close',
             'close_r',
+            'close_ma',
+            'close_volatility',
+            'close_drawdown',
             'volume',
         ])
     return JsonResponse(
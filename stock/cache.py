@@ -0,0 +1,85 @@
+"""Модуль кэширования в памяти процесса"""
+import collections
+import threading
+
+
+class LRUCache:
+    """Потокобезопасный кэш с ограничением размера и вытеснением давно неиспользуемых записей"""
+
+    def __init__(self, maxsize=10000):
+        """
+        Args:
+            maxsize(int): Максимальное количество записей
+        """
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._data = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        """Получить значение по ключу
+
+        Args:
+            key: Ключ
+            default: Значение при отсутствии ключа
+
+        Returns:
+            object
+        """
+        with self._lock:
+            if key in self._data:
+                self._data.move_to_end(key)
+                self.hits += 1
+                return self._data[key]
+
+            self.misses += 1
+            return default
+
+    def set(self, key, value):
+        """Сохранить значение по ключу
+
+        Args:
+            key: Ключ
+            value: Значение
+        """
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        """Удалить значение по ключу, если оно есть
+
+        Args:
+            key: Ключ
+        """
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        """Очистить кэш и счетчики"""
+        with self._lock:
+            self._data.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self):
+        """Статистика использования кэша
+
+        Returns:
+            dict
+        """
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'size': len(self._data),
+                'maxsize': self.maxsize,
+            }
+
+
+# Кэш id найденных/добавленных записей справочников (BaseModels.get_with_save),
+# общий для всех потоков процесса
+lookup_cache = LRUCache(maxsize=10000)
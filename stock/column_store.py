@@ -0,0 +1,226 @@
+"""Модуль дискового хранилища акций компаний для чтения (кэш Stock в отображаемых в память файлах)"""
+import contextlib
+import datetime
+import os
+import tempfile
+import threading
+import urllib.parse
+import zlib
+
+import numpy as np
+from django.conf import settings
+
+from stock import analytics
+from stock.cache import LRUCache
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover
+    fcntl = None
+
+# Запись файла: порядковый номер даты (datetime.date.toordinal), цены, объем и изменения к предыдущему дню
+DTYPE = np.dtype([
+    ('date', '<i4'),
+    ('open', '<f8'),
+    ('high', '<f8'),
+    ('low', '<f8'),
+    ('close', '<f8'),
+    ('volume', '<i8'),
+    ('open_r', '<f8'),
+    ('high_r', '<f8'),
+    ('low_r', '<f8'),
+    ('close_r', '<f8'),
+])
+# Расширение файла компании, версия - на случай изменения DTYPE
+_EXT = '.v1.bin'
+# Количество файлов блокировок записи
+_LOCKS = 64
+
+
+class ColumnStore:
+    """Акции компаний по файлу на компанию: записи фиксированной длины по возрастанию дат
+
+    Файл отображается в память (numpy.memmap), колонки читаются срезами без копирования,
+    период дат находится двоичным поиском. Несколько процессов (воркеры gunicorn)
+    читают одну копию файла из страничного кэша ОС. Новые дни дописываются в конец
+    файла, остальные изменения записываются новым файлом с атомарной заменой,
+    поэтому читатели видят либо старые, либо новые данные.
+    """
+
+    def __init__(self, path, max_maps=256):
+        """
+        Args:
+            path(str): Каталог хранилища
+            max_maps(int): Количество файлов, одновременно отображаемых в память процесса
+        """
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+        # Отображения файлов процесса по пути и версии файла, ограничены числом
+        # открытых файлов (отображение держит дескриптор файла)
+        self._maps = LRUCache(maxsize=max_maps)
+
+    def _file(self, symbol):
+        return os.path.join(self.path, urllib.parse.quote(symbol, safe='') + _EXT)
+
+    def read(self, symbol):
+        """Все дни компании
+
+        Args:
+            symbol(str): Сокращенное название компании
+
+        Returns:
+            numpy.ndarray: Записи DTYPE (только для чтения), None если файла компании нет
+        """
+        path = self._file(symbol)
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+
+        # Недописанная запись (во время дописывания) не читается
+        count = stat.st_size // DTYPE.itemsize
+        key = (path, stat.st_ino, stat.st_mtime_ns, count)
+        data = self._maps.get(key)
+        if data is None:
+            if count:
+                data = np.memmap(path, dtype=DTYPE, mode='r', shape=(count,))
+            else:
+                data = np.empty(0, dtype=DTYPE)
+            self._maps.set(key, data)
+
+        return data
+
+    def read_range(self, symbol, date_from, date_to, before=0):
+        """Дни компании за период
+
+        Args:
+            symbol(str): Сокращенное название компании
+            date_from(datetime.date): Дата от
+            date_to(datetime.date): Дата по
+            before(int): Количество дней перед периодом, добавляемых в начало
+
+        Returns:
+            tuple: (записи DTYPE - срез файла без копирования, количество добавленных дней перед периодом),
+                None если файла компании нет
+        """
+        data = self.read(symbol)
+        if data is None:
+            return None
+
+        dates = data['date']
+        start = int(np.searchsorted(dates, date_from.toordinal(), side='left'))
+        end = int(np.searchsorted(dates, date_to.toordinal(), side='right'))
+        first = max(0, start - before)
+        return data[first:max(start, end)], start - first
+
+    def last_date(self, symbol):
+        """Порядковый номер последней даты компании
+
+        Returns:
+            int: None если файла компании нет или он пустой
+        """
+        data = self.read(symbol)
+        if data is None or not len(data):
+            return None
+        return int(data['date'][-1])
+
+    def write(self, symbol, rows):
+        """Записать все дни компании
+
+        Args:
+            symbol(str): Сокращенное название компании
+            rows(list of tuple): Записи DTYPE по возрастанию дат
+        """
+        path = self._file(symbol)
+        data = np.array(rows, dtype=DTYPE)
+        file, tmp_path = tempfile.mkstemp(dir=self.path, suffix='.tmp')
+        try:
+            with os.fdopen(file, 'wb') as tmp_file:
+                tmp_file.write(data.tobytes())
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+
+    def append(self, symbol, rows):
+        """Дописать дни после последнего дня компании
+
+        Недописанная запись прерванного дописывания отрезается, иначе все
+        следующие записи были бы сдвинуты.
+
+        Args:
+            symbol(str): Сокращенное название компании
+            rows(list of tuple): Записи DTYPE по возрастанию дат
+        """
+        with open(self._file(symbol), 'ab') as file:
+            size = os.fstat(file.fileno()).st_size
+            if size % DTYPE.itemsize:
+                file.truncate(size - size % DTYPE.itemsize)
+            file.write(np.array(rows, dtype=DTYPE).tobytes())
+
+    def remove(self, symbol):
+        """Удалить файл компании (чтение пойдет в БД)"""
+        try:
+            os.remove(self._file(symbol))
+        except FileNotFoundError:
+            pass
+
+    @contextlib.contextmanager
+    def locked(self, symbol):
+        """Блокировка записи файла компании между процессами (flock, без fcntl - без блокировки)
+
+        Файлы блокировок общие для компаний (_LOCKS штук по хешу названия): их количество
+        не растет с числом компаний, а удалять файл блокировки, который может ждать
+        другой процесс, нельзя.
+
+        Args:
+            symbol(str): Сокращенное название компании
+        """
+        lock_path = os.path.join(self.path, '{}.lock'.format(zlib.crc32(symbol.encode()) % _LOCKS))
+        with open(lock_path, 'a') as file:
+            if fcntl is not None:
+                # Блокировка снимается при закрытии файла
+                fcntl.flock(file, fcntl.LOCK_EX)
+            yield
+
+
+def columns(data, fields):
+    """Колонки записей списками значений Python: даты - datetime.date, nan - None
+
+    Args:
+        data(numpy.ndarray): Записи DTYPE
+        fields(list of str): Колонки DTYPE
+
+    Returns:
+        list of list
+    """
+    result = []
+    for field in fields:
+        if field == 'date':
+            result.append([datetime.date.fromordinal(i) for i in data['date'].tolist()])
+        elif data.dtype[field].kind == 'f':
+            result.append(analytics.to_list(data[field]))
+        else:
+            result.append(data[field].tolist())
+    return result
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_store():
+    """Хранилище из настройки STOCK_COLUMN_STORE_DIR
+
+    Returns:
+        ColumnStore: None, если хранилище не настроено
+    """
+    global _store
+    path = getattr(settings, 'STOCK_COLUMN_STORE_DIR', None)
+    if not path:
+        return None
+
+    with _store_lock:
+        if _store is None or _store.path != path:
+            _store = ColumnStore(path)
+        return _store
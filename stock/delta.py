@@ -0,0 +1,107 @@
+"""Модуль поиска минимальных периодов изменения цены акций (Stock.get_delta) за один проход"""
+import datetime
+
+
+def _first_reached(values, change):
+    """Для каждого дня - первый следующий день, в который цена выросла не меньше чем на change
+
+    Дни обходятся от последнего к первому. Стек хранит кандидатов - дни после текущего,
+    цена которых больше цены всех дней между текущим и ими: от вершины к дну дни
+    идут по возрастанию и цена строго растет. Первый день, в который цена
+    выросла на change, - ближайший к вершине кандидат с достаточной ценой,
+    он находится двоичным поиском. Каждый день попадает в стек и покидает его
+    один раз, поэтому весь проход - O(n log n).
+
+    Args:
+        values(list of float): Цены по возрастанию дат
+        change(float): Изменение цены
+
+    Returns:
+        list of int: Индекс дня или None, если цена так и не выросла на change
+    """
+    result = [None] * len(values)
+    # Индексы и цены кандидатов, вершина стека - конец списков, цены на стеке убывают к вершине
+    stack_index = []
+    stack_value = []
+    for i in range(len(values) - 1, -1, -1):
+        value = values[i]
+        if stack_value:
+            # Цены кандидатов от дна к вершине убывают: ищем последний (ближайший) с достаточной ценой.
+            # Условие записано как в SQL версии (разность не меньше изменения), чтобы округление совпадало
+            lo, hi = 0, len(stack_value)
+            while lo < hi:
+                mid = (lo + hi) // 2
+                if stack_value[mid] - value >= change:
+                    lo = mid + 1
+                else:
+                    hi = mid
+            if lo:
+                result[i] = stack_index[lo - 1]
+
+        # Кандидаты не дороже текущего дня больше не нужны: текущий день раньше и не дешевле
+        while stack_value and stack_value[-1] <= value:
+            stack_value.pop()
+            stack_index.pop()
+        stack_index.append(i)
+        stack_value.append(value)
+
+    return result
+
+
+def _windows(days, reached):
+    """Минимальные периоды: для каждого дня достижения изменения - самый поздний день начала
+
+    Args:
+        days(list of int): Порядковые номера дат (datetime.date.toordinal) по возрастанию
+        reached(list of int): Результат _first_reached
+
+    Returns:
+        list of tuple: (количество дней, дата от, дата до) по возрастанию количества дней
+    """
+    latest_start = {}
+    for i, j in enumerate(reached):
+        if j is not None:
+            # Дни обходятся по возрастанию, поэтому последний записанный - самый поздний
+            latest_start[j] = i
+
+    rows = [(days[j] - days[i], days[i], days[j]) for j, i in latest_start.items()]
+    rows.sort()
+    # Даты создаются только для найденных периодов
+    fromordinal = datetime.date.fromordinal
+    return [(i[0], fromordinal(i[1]), fromordinal(i[2])) for i in rows]
+
+
+def find_deltas(dates, values, change):
+    """Минимальные периоды, за которые цена выросла или упала не меньше чем на change
+
+    Результат совпадает с SQL версией Stock.get_delta_sql: для каждого дня берется
+    первый следующий день с изменением цены не меньше change, из периодов
+    с одинаковым концом остается самый короткий.
+
+    Args:
+        dates(list of datetime.date): Даты по возрастанию
+        values(list of float): Цены по тем же датам
+        change(float): Изменение цены
+
+    Returns:
+        dict: {'up': list of tuple, 'down': list of tuple}, строки - (количество дней, дата от, дата до)
+    """
+    return find_deltas_by_days([i.toordinal() for i in dates], values, change)
+
+
+def find_deltas_by_days(days, values, change):
+    """То же, что find_deltas, даты заданы порядковыми номерами (datetime.date.toordinal)
+
+    Args:
+        days(sequence of int): Порядковые номера дат по возрастанию
+        values(sequence of float): Цены по тем же датам
+        change(float): Изменение цены
+
+    Returns:
+        dict: {'up': list of tuple, 'down': list of tuple}
+    """
+    return {
+        'up': _windows(days, _first_reached(values, change)),
+        # Падение цены - рост противоположной цены, смена знака не вносит погрешности
+        'down': _windows(days, _first_reached([-i for i in values], change)),
+    }
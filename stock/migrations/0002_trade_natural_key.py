@@ -0,0 +1,32 @@
+# Generated by Django 2.1 on 2026-10-17 17:30
+
+from django.db import migrations
+from django.db.models import Count, Max
+
+
+def delete_duplicate_trades(apps, schema_editor):
+    """Удаление дублей сделок по естественному ключу, оставляем последнюю запись"""
+    Trade = apps.get_model('stock', 'Trade')
+    duplicates = Trade.objects.values(
+        'company', 'date', 'type_transaction', 'owner_type', 'insider'
+    ).annotate(max_id=Max('id'), count=Count('id')).filter(count__gt=1)
+
+    for duplicate in duplicates:
+        max_id = duplicate.pop('max_id')
+        duplicate.pop('count')
+        Trade.objects.filter(**duplicate).exclude(id=max_id).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stock', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.RunPython(delete_duplicate_trades, migrations.RunPython.noop),
+        migrations.AlterUniqueTogether(
+            name='trade',
+            unique_together={('company', 'date', 'type_transaction', 'owner_type', 'insider')},
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 2.1 on 2026-10-17 17:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stock', '0002_trade_natural_key'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ScanTask',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('queue', models.CharField(choices=[('journal', 'journal'), ('shared', 'shared')], default='journal', max_length=16)),
+                ('url', models.CharField(max_length=1000)),
+                ('task_type', models.CharField(max_length=16)),
+                ('symbol', models.CharField(max_length=255)),
+                ('fan_out', models.BooleanField(default=False)),
+                ('status', models.CharField(choices=[('pending', 'pending'), ('in_progress', 'in_progress'), ('done', 'done'), ('failed', 'failed')], db_index=True, default='pending', max_length=16)),
+                ('attempts', models.IntegerField(default=0)),
+                ('updated', models.DateTimeField(auto_now=True)),
+                ('worker', models.CharField(default='', max_length=255)),
+                ('claim', models.CharField(db_index=True, default='', max_length=32)),
+                ('lease_until', models.DateTimeField(null=True)),
+            ],
+            options={
+                'unique_together': {('queue', 'url')},
+            },
+        ),
+    ]
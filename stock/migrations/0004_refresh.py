@@ -0,0 +1,27 @@
+# Generated by Django 2.1 on 2026-10-17 18:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stock', '0003_scan_task'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Refresh',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('symbol', models.CharField(max_length=255)),
+                ('task_type', models.CharField(max_length=16)),
+                ('watched', models.BooleanField(default=False)),
+                ('refreshed', models.DateTimeField(db_index=True, null=True)),
+                ('attempted', models.DateTimeField(null=True)),
+            ],
+            options={
+                'unique_together': {('symbol', 'task_type')},
+            },
+        ),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 2.1 on 2026-10-17 19:10
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def fill_series(apps, schema_editor):
+    """Записать ряды цен компаний по уже сохраненным акциям"""
+    # Преобразование строк в массивы - то же, что у модели
+    from stock.models import PriceSeries as CurrentPriceSeries
+
+    Stock = apps.get_model('stock', 'Stock')
+    PriceSeries = apps.get_model('stock', 'PriceSeries')
+    columns = ['open', 'high', 'low', 'close']
+
+    for company_id in Stock.objects.values_list('company_id', flat=True).distinct():
+        rows = list(Stock.objects.filter(company_id=company_id).order_by('date').values_list('date', *columns))
+        PriceSeries.objects.create(company_id=company_id, **CurrentPriceSeries.fields_by_rows(rows))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stock', '0004_refresh'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PriceSeries',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('dates', models.BinaryField()),
+                ('open', models.BinaryField()),
+                ('high', models.BinaryField()),
+                ('low', models.BinaryField()),
+                ('close', models.BinaryField()),
+                ('company', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, to='stock.Company')),
+            ],
+        ),
+        migrations.RunPython(fill_series, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,47 @@
+# Generated by Django 2.1 on 2026-10-17 19:40
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def fill_returns(apps, schema_editor):
+    """Заполнить изменения к предыдущему дню для уже сохраненных акций"""
+    Stock = apps.get_model('stock', 'Stock')
+    StockReturn = apps.get_model('stock', 'StockReturn')
+    columns = ['open', 'high', 'low', 'close']
+
+    for company_id in Stock.objects.values_list('company_id', flat=True).distinct():
+        previous = None
+        returns = []
+        for row in Stock.objects.filter(company_id=company_id).order_by('date').values_list('id', *columns):
+            values = {}
+            for n, column in enumerate(columns, 1):
+                value = None
+                if previous is not None and row[n]:
+                    value = 100 - 100 * previous[n] / row[n]
+                values[column + '_r'] = value
+            returns.append(StockReturn(stock_id=row[0], **values))
+            previous = row
+
+        StockReturn.objects.bulk_create(returns, batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stock', '0005_price_series'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StockReturn',
+            fields=[
+                ('stock', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='returns', serialize=False, to='stock.Stock')),
+                ('open_r', models.FloatField(null=True)),
+                ('high_r', models.FloatField(null=True)),
+                ('low_r', models.FloatField(null=True)),
+                ('close_r', models.FloatField(null=True)),
+            ],
+        ),
+        migrations.RunPython(fill_returns, migrations.RunPython.noop),
+    ]
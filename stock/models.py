@@ -1,8 +1,122 @@
 """Модуль описания сущностей БД и их методов"""
 import collections
+import contextlib
 import datetime
+import uuid
 
-from django.db import models, connection
+from django.db import IntegrityError, models, connection, transaction
+from django.db.models.signals import post_delete, post_migrate
+from django.dispatch import receiver
+from django.utils import timezone
+import numpy as np
+
+from stock import analytics, column_store, delta
+from stock.cache import lookup_cache
+
+# Размер пачки при массовой вставке записей
+_BATCH_SIZE = 500
+
+
+@contextlib.contextmanager
+def _write_transaction():
+    """Транзакция на запись
+
+    SQLite допускает одного писателя. Транзакция, начатая обычным BEGIN (DEFERRED), берет
+    блокировку на запись только при первой записи и, если ее уже держит другое соединение,
+    сразу падает с "database is locked", не дожидаясь timeout. Поэтому внешняя транзакция
+    на SQLite начинается с BEGIN IMMEDIATE: блокировка на запись берется сразу, а
+    конкурент ждет ее освобождения в пределах timeout соединения.
+    """
+    if connection.vendor != 'sqlite' or connection.in_atomic_block:
+        with transaction.atomic():
+            yield
+        return
+
+    # transaction.atomic начинает транзакцию SQLite обычным BEGIN, поэтому внешнюю
+    # транзакцию ведем вручную, а atomic внутри нее работает точкой сохранения
+    with connection.cursor() as cursor:
+        cursor.execute('BEGIN IMMEDIATE')
+    transaction.set_autocommit(False)
+    try:
+        with transaction.atomic():
+            yield
+    except BaseException:
+        transaction.rollback()
+        raise
+    else:
+        transaction.commit()
+    finally:
+        # Возврат автофиксации выполняет функции transaction.on_commit после фиксации
+        transaction.set_autocommit(True)
+
+
+def _supports_upsert():
+    """Поддерживает ли БД INSERT ... ON CONFLICT DO UPDATE
+
+    Returns:
+        bool
+    """
+    if connection.vendor == 'postgresql':
+        return True
+    if connection.vendor == 'sqlite':
+        return connection.Database.sqlite_version_info >= (3, 24, 0)
+
+    return False
+
+
+def _upsert(model, rows, conflict_cols, update_cols, fields=None):
+    """Массовая вставка записей с обновлением при конфликте уникального ключа
+    (INSERT ... ON CONFLICT DO UPDATE)
+
+    Args:
+        model(type): Класс модели
+        rows(list of dict or list of tuple): Записи, ключи - имена полей модели
+            (кортежи - значения в порядке fields)
+        conflict_cols(list of str): Поля уникального ключа
+        update_cols(list of str): Поля обновляемые при конфликте
+        fields(list of str): Поля записей-кортежей
+    """
+    if not rows:
+        return
+
+    qn = connection.ops.quote_name
+    if fields is None:
+        fields = list(rows[0])
+        rows = [[row[i] for i in fields] for row in rows]
+    fields = [model._meta.get_field(i) for i in fields]
+    columns = [qn(i.column) for i in fields]
+    conflict = [qn(model._meta.get_field(i).column) for i in conflict_cols]
+    update = [qn(model._meta.get_field(i).column) for i in update_cols]
+
+    query = 'INSERT INTO {table} ({columns}) VALUES ({values}) ON CONFLICT ({conflict}) DO UPDATE SET {update}'.format(
+        table=qn(model._meta.db_table),
+        columns=', '.join(columns),
+        values=', '.join(['%s'] * len(columns)),
+        conflict=', '.join(conflict),
+        update=', '.join('{0} = EXCLUDED.{0}'.format(i) for i in update),
+    )
+    params = [
+        [field.get_db_prep_save(value, connection) for field, value in zip(fields, row)]
+        for row in rows
+    ]
+    with connection.cursor() as cursor:
+        for i in range(0, len(params), _BATCH_SIZE):
+            cursor.executemany(query, params[i:i + _BATCH_SIZE])
+
+
+def _nan2none(column):
+    """Значения числовой колонки с None вместо NaN (пустые значения колоночного формата парсера)
+
+    Args:
+        column(sequence of float): Значения колонки
+
+    Returns:
+        sequence: Исходная колонка, если в ней нет NaN
+    """
+    if all(i == i for i in column):
+        return column
+
+    return [i if i == i else None for i in column]
 
 
 class BaseModels(models.Model):
@@ -24,6 +138,14 @@ class BaseModels(models.Model):
             if i in kwargs
         }
 
+        cache_key = None
+        if len(filters) == len(cls._COLS_TO_MATCH):
+            key = cls.match_key(**filters)
+            cache_key = cls._cache_key(key)
+            pk = lookup_cache.get(cache_key)
+            if pk is not None:
+                return cls._from_cache(key, pk)
+
         query = cls.objects
         if filters:
             query = query.filter(**filters)
@@ -33,10 +155,149 @@ class BaseModels(models.Model):
             ind = ind[0]
         else:
             ind = cls(**kwargs)
-            ind.save()
+            try:
+                with transaction.atomic():
+                    ind.save()
+            except IntegrityError:
+                # Запись успела добавить другая задача, либо связанная запись из кэша
+                # справочников уже удалена - берем запись из БД
+                if cache_key is not None:
+                    lookup_cache.delete(cache_key)
+                ind = query.get()
+
+        if cache_key is not None:
+            cls._cache_on_commit({cache_key: ind})
 
         return ind
 
+    @classmethod
+    def _cache_key(cls, key):
+        """
+        Ключ записи в кэше справочников
+
+        Args:
+            key(tuple): Ключ match_key
+
+        Returns:
+            tuple
+        """
+        return (cls._meta.label,) + key
+
+    @classmethod
+    def _from_cache(cls, key, pk):
+        """
+        Запись по ключу сопоставления и id из кэша справочников без запроса к БД.
+        Остальные поля записи отложены и загружаются из БД при обращении к ним
+
+        Args:
+            key(tuple): Ключ match_key
+            pk(int): id записи
+
+        Returns:
+            cls
+        """
+        values = dict(zip((cls._meta.get_field(i).attname for i in cls._COLS_TO_MATCH), key))
+        values[cls._meta.pk.attname] = pk
+        names = [i.attname for i in cls._meta.concrete_fields if i.attname in values]
+        return cls.from_db(cls.objects.db, names, [values[i] for i in names])
+
+    @staticmethod
+    def _cache_on_commit(objs):
+        """
+        Сохранить id записей в кэш справочников после фиксации транзакции,
+        чтобы в кэш не попадали записи из откаченных транзакций
+
+        Args:
+            objs(dict): {ключ кэша: запись}
+        """
+        def set_cache():
+            for key, obj in objs.items():
+                lookup_cache.set(key, obj.pk)
+
+        transaction.on_commit(set_cache)
+
+    @classmethod
+    def match_key(cls, **kwargs):
+        """
+        Ключ сопоставления записи по полям _COLS_TO_MATCH
+
+        Returns:
+            tuple
+        """
+        return tuple(
+            kwargs[i].pk if isinstance(kwargs[i], models.Model) else kwargs[i]
+            for i in cls._COLS_TO_MATCH
+        )
+
+    @classmethod
+    def get_many_with_save(cls, values):
+        """
+        Найти в БД набор записей по полям _COLS_TO_MATCH, отсутствующие добавить.
+        Выполняется фиксированное количество запросов независимо от количества записей.
+
+        Args:
+            values(list of dict): Значения полей записей (как для get_with_save)
+
+        Returns:
+            dict: {ключ match_key: cls}
+        """
+        values = collections.OrderedDict((cls.match_key(**i), i) for i in values)
+
+        # Записи из кэша справочников
+        result = {}
+        for key in values:
+            pk = lookup_cache.get(cls._cache_key(key))
+            if pk is not None:
+                result[key] = cls._from_cache(key, pk)
+        cached = set(result)
+
+        result.update(cls._find_many({i: values[i] for i in values if i not in cached}))
+
+        missing = [i for i in values if i not in result]
+        if missing:
+            try:
+                with transaction.atomic():
+                    cls.objects.bulk_create([cls(**values[i]) for i in missing], batch_size=_BATCH_SIZE)
+            except IntegrityError:
+                # Часть записей успела добавить другая задача, добавляем по одной
+                for key in missing:
+                    result[key] = cls.get_with_save(**values[key])
+            else:
+                result.update(cls._find_many({i: values[i] for i in missing}))
+
+        cls._cache_on_commit({
+            cls._cache_key(key): obj for key, obj in result.items()
+            if key not in cached
+        })
+
+        return result
+
+    @classmethod
+    def _find_many(cls, values):
+        """
+        Поиск записей по ключам сопоставления одним запросом
+
+        Args:
+            values(dict): {ключ match_key: значения полей}
+
+        Returns:
+            dict: {ключ match_key: cls}
+        """
+        if not values:
+            return {}
+
+        fields = [cls._meta.get_field(i) for i in cls._COLS_TO_MATCH]
+        first_col = [key[0] for key in values]
+        query = cls.objects.filter(**{'{}__in'.format(fields[0].attname): first_col})
+
+        result = {}
+        for obj in query:
+            key = tuple(getattr(obj, i.attname) for i in fields)
+            if key in values:
+                result[key] = obj
+
+        return result
+
     class Meta:
         abstract = True
 
@@ -89,6 +350,8 @@ class Stock(BaseModels):
 
     # Разрешенные колонки для метода get_delta
     _ACCESS_COL_DELTA = ['open', 'high', 'low', 'close']
+    # Колонки с данными торгового дня
+    _COLS_VALUES = ['open', 'high', 'low', 'close', 'volume']
 
     # Дата проведение акции
     date = models.DateField(null=False)
@@ -126,33 +389,93 @@ class Stock(BaseModels):
                     'company_industry': str
                     'company_symbol': str,
                     'stocks': list,
+                    'columns': dict,  # вместо stocks - колонки parsers.ParserStock.get_columns
                 }
-        """
-        ind = Industry.get_with_save(name=data.get('company_industry').lower())
-        comp = Company.get_with_save(
-            symbol=data.get('company_symbol').lower(),
-            industry=ind
-        )
 
-        for stock_date in data['stocks']:
-            kw = {}
-            stock = Stock(
-                company=comp,
-                **stock_date
+        Returns:
+            dict: Количество добавленных, обновленных и пропущенных (не изменившихся) записей
+                {
+                    'inserted': int,
+                    'updated': int,
+                    'skipped': int,
+                }
+        """
+        # Одна запись на дату, при повторе даты на странице берем последнюю
+        stocks = collections.OrderedDict((i[0], i[1:]) for i in Stock._iter_rows(data))
+
+        with _write_transaction():
+            ind = Industry.get_with_save(name=data.get('company_industry').lower())
+            comp = Company.get_with_save(
+                symbol=data.get('company_symbol').lower(),
+                industry=ind
             )
+            if not stocks:
+                return {'inserted': 0, 'updated': 0, 'skipped': 0}
 
-            # Ищем в БД акции по компании и дате, если получается найти то будем делать обновление
-            st_s = list(
-                Stock.objects.filter(
+            # Все уже сохраненные акции компании за период страницы одним запросом
+            existing = {
+                i[0]: i[1:]
+                for i in Stock.objects.filter(
                     company=comp,
-                    date=stock_date.get('date')
-                ).values_list('id')[0:1]
-            )
-            if st_s:
-                kw['force_update'] = True
-                stock.id = st_s[0][0]
+                    date__gte=min(stocks),
+                    date__lte=max(stocks),
+                ).values_list('date', 'id', *Stock._COLS_VALUES)
+            }
+
+            # Строки - кортежи (дата, значения _COLS_VALUES)
+            new_stocks = []
+            changed_stocks = []
+            for date, values in stocks.items():
+                old = existing.get(date)
+                if old is None:
+                    new_stocks.append((date,) + values)
+                elif old[1:] != values:
+                    changed_stocks.append((old[0], (date,) + values))
+
+            if _supports_upsert():
+                _upsert(
+                    Stock,
+                    [(comp.id,) + i for i in new_stocks] + [(comp.id,) + i for _, i in changed_stocks],
+                    conflict_cols=['company', 'date'],
+                    update_cols=Stock._COLS_VALUES,
+                    fields=['company', 'date'] + Stock._COLS_VALUES,
+                )
+            else:
+                Stock.objects.bulk_create(
+                    [Stock(company=comp, date=i[0], **dict(zip(Stock._COLS_VALUES, i[1:]))) for i in new_stocks],
+                    batch_size=_BATCH_SIZE,
+                )
+                for stock_id, stock_data in changed_stocks:
+                    Stock.objects.filter(id=stock_id).update(**dict(zip(Stock._COLS_VALUES, stock_data[1:])))
+
+            dates = [i[0] for i in new_stocks] + [i[0] for _, i in changed_stocks]
+            StockReturn.refresh(comp, dates)
+            PriceSeries.on_store(comp, new_stocks + [i for _, i in changed_stocks])
+            if dates and column_store.get_store() is not None:
+                # Хранилище для чтения обновляется только после фиксации транзакции
+                transaction.on_commit(lambda: Stock.update_column_store(comp.symbol, dates))
 
-            stock.save(**kw)
+        return {
+            'inserted': len(new_stocks),
+            'updated': len(changed_stocks),
+            'skipped': len(stocks) - len(new_stocks) - len(changed_stocks),
+        }
+
+    @staticmethod
+    def _iter_rows(data):
+        """Строки акций (дата, значения _COLS_VALUES) из построчного или колоночного формата
+
+        Args:
+            data(dict): Данные о акциях (см. store_stocks)
+
+        Returns:
+            iterator of tuple
+        """
+        columns = data.get('columns')
+        if columns is None:
+            return ((i['date'],) + tuple(i.get(c) for c in Stock._COLS_VALUES) for i in data['stocks'])
+
+        return zip(columns['date'], *(_nan2none(columns[i]) for i in Stock._COLS_VALUES))
 
     @classmethod
     def get_by_symbol_and_date(cls, symbol, date_from=None, date_to=None, field_values=None):
@@ -171,6 +494,12 @@ class Stock(BaseModels):
         date_to = date_to or datetime.datetime.now()
         date_from = date_from or date_to - datetime.timedelta(days=30 * 3)
 
+        if field_values and set(field_values) <= set(['date'] + cls._COLS_VALUES):
+            stored = cls._read_column_store(symbol, date_from, date_to)
+            if stored is not None:
+                data = stored[0][::-1]
+                return [dict(zip(field_values, i)) for i in zip(*column_store.columns(data, field_values))]
+
         query = Stock.objects.filter(
             company__symbol=symbol,
             date__gte=date_from,
@@ -183,7 +512,8 @@ class Stock(BaseModels):
         return list(query.all())
 
     @classmethod
-    def get_analytics_by_symbol_and_dates(cls, symbol, date_from=None, date_to=None, field_values=None):
+    def get_analytics_by_symbol_and_dates(cls, symbol, date_from=None, date_to=None, field_values=None,
+                                          window=analytics.WINDOW):
         """Получение списка акций с аналитикой
 
         Args:
@@ -191,34 +521,43 @@ class Stock(BaseModels):
             date_from(datetime.datetime): Дата от (по умолчанию - 3 месяца от текущего дня)
             date_to(datetime.datetime): Дата по (по умолчанию сегодняшний день)
             field_values(list): Поля для формирования результата
+            window(int): Количество дней скользящего среднего и волатильности
 
         Returns:
-            list
+            list of dict: см. analytics.analyze
         """
 
         date_to = date_to or datetime.datetime.now()
         date_from = date_from or date_to - datetime.timedelta(days=90)
 
-        query_raw = """SELECT
-  s.*,
-  100 - 100*lag("open") OVER "w" / "open" AS "open_r",
-  100 - 100*lag("high") OVER "w" / "high" AS "high_r",
-  100 - 100*lag("low") OVER "w" / "low" AS "low_r",
-  100 - 100*lag("close") OVER "w" / "close" AS "close_r"
-FROM "stock_stock" s
-  LEFT JOIN "stock_company" c on s."company_id" = c."id"
-WHERE c."symbol" = %s
-  AND s."date" >= %s
-  AND s."date" <= %s
-  WINDOW "w" AS (ORDER BY "date")
-ORDER BY "date" DESC;"""
-
-        rows = list(Stock.objects.raw(query_raw, (symbol, date_from, date_to)))
-
+        stored = cls._read_column_store(symbol, date_from, date_to, before=window)
+        if stored is not None:
+            data, skip = stored
+            rows = analytics.analyze_columns(
+                column_store.columns(data, ['date'])[0],
+                [data[i] for i in analytics.PRICE_COLUMNS],
+                data['volume'],
+                [data[i] for i in StockReturn.COLS_RETURNS],
+                skip=skip,
+                window=window,
+            )
+            if field_values:
+                rows = [{field_value: i.get(field_value) for field_value in field_values} for i in rows]
+            return rows
+
+        # Изменения к предыдущему дню сохранены в StockReturn при загрузке акций
+        columns = ['date'] + cls._COLS_VALUES + ['returns__' + i for i in StockReturn.COLS_RETURNS]
+        stocks = Stock.objects.filter(company__symbol=symbol)
+        # Дни перед периодом нужны для окон первых дней периода
+        rows = list(stocks.filter(date__lt=date_from).order_by('-date').values_list(*columns)[:window])[::-1]
+        skip = len(rows)
+        rows.extend(stocks.filter(date__gte=date_from, date__lte=date_to).order_by('date').values_list(*columns))
+
+        rows = analytics.analyze(rows, skip=skip, window=window)
         if field_values:
             rows = [
                 {
-                    field_value: getattr(i, field_value, None)
+                    field_value: i.get(field_value)
                     for field_value in field_values
                 }
                 for i in rows
@@ -226,9 +565,99 @@ ORDER BY "date" DESC;"""
 
         return rows
 
+    @staticmethod
+    def _read_column_store(symbol, date_from, date_to, before=0):
+        """Дни компании за период из хранилища для чтения (column_store), если оно настроено
+
+        Чтение файлов не меняет: если файла компании еще нет, запрос идет в БД. Файл
+        строится при сохранении акций компании или командой buildcolumnstore.
+
+        Returns:
+            tuple: см. column_store.ColumnStore.read_range, None - читать из БД
+        """
+        store = column_store.get_store()
+        if store is None:
+            return None
+
+        return store.read_range(symbol, date_from, date_to, before=before)
+
+    @staticmethod
+    def update_column_store(symbol, dates):
+        """Обновить файл компании в хранилище для чтения после сохранения акций
+
+        Дни после последнего дня файла дописываются, при других изменениях
+        и при отсутствии файла он записывается заново. При ошибке файл удаляется,
+        чтение идет из БД.
+
+        Args:
+            symbol(str): Сокращенное название компании
+            dates(list of datetime.date): Добавленные и измененные дни
+
+        Returns:
+            bool: Есть ли файл компании после обновления
+        """
+        store = column_store.get_store()
+        if store is None:
+            return False
+
+        columns = ['date'] + Stock._COLS_VALUES + ['returns__' + i for i in StockReturn.COLS_RETURNS]
+        stocks = Stock.objects.filter(company__symbol=symbol).order_by('date')
+        try:
+            # Акции читаются из БД под блокировкой файла, поэтому параллельные обновления
+            # не могут записать более старые данные поверх более новых
+            with store.locked(symbol):
+                last = store.last_date(symbol)
+                if last is not None and not dates:
+                    return True
+
+                append = last is not None and min(dates).toordinal() > last
+                if append:
+                    stocks = stocks.filter(date__gt=datetime.date.fromordinal(last))
+                rows = [(i[0].toordinal(),) + i[1:] for i in stocks.values_list(*columns)]
+
+                if append:
+                    store.append(symbol, rows)
+                elif rows:
+                    store.write(symbol, rows)
+                else:
+                    store.remove(symbol)
+                    return False
+        except (OSError, ValueError) as ex:
+            print('Ошибка обновления хранилища акций {}: {}'.format(symbol, ex))
+            store.remove(symbol)
+            return False
+
+        return True
+
     @classmethod
     def get_delta(cls, symbol, column_type, max_change_price):
         """
+        Минимальные периоды, за которые цена выросла (up) или упала (down) не меньше чем на max_change_price
+
+        Args:
+            symbol(str): Сокращенное название компании
+            column_type(str): Тип колонки
+            max_change_price(float): Изменение цены акций
+
+        Returns:
+            dict: {'up': list, 'down': list}, строки - (количество дней, дата от, дата до) по возрастанию дней
+        """
+        if column_type not in cls._ACCESS_COL_DELTA:
+            raise Exception(
+                'Указанный тип {} отсутствует в списке разрешенных {}'.format(column_type, cls._ACCESS_COL_DELTA))
+
+        # Один проход по ряду цен компании вместо попарного соединения дней в БД
+        series = PriceSeries.get_by_symbol(symbol)
+        if series is None:
+            return {'up': [], 'down': []}
+        return delta.find_deltas_by_days(
+            series.days.tolist(), series.column(column_type).tolist(), max_change_price)
+
+    @classmethod
+    def get_delta_sql(cls, symbol, column_type, max_change_price):
+        """
+        Прежняя реализация get_delta соединением всех пар дней компании в БД (O(n²)),
+        оставлена для сравнения результата и замера производительности (benchingest)
 
         Args:
             symbol(str): Сокращенное название компании
@@ -279,6 +708,226 @@ SELECT date_to-date_from AS delta, * FROM d ORDER BY delta;"""
         }
 
 
+class StockReturn(models.Model):
+    """Изменения цен акции к предыдущему дню компании (в процентах от цены дня)
+
+    Заполняются при сохранении акций (Stock.store_stocks) для добавленных
+    и измененных дней, а также для следующих за ними дней, у которых
+    поменялся предыдущий день.
+    """
+    # Колонки изменений по колонкам цен analytics.PRICE_COLUMNS
+    COLS_RETURNS = ['{}_r'.format(i) for i in analytics.PRICE_COLUMNS]
+
+    stock = models.OneToOneField(Stock, on_delete=models.CASCADE, primary_key=True, related_name='returns')
+    open_r = models.FloatField(null=True)
+    high_r = models.FloatField(null=True)
+    low_r = models.FloatField(null=True)
+    close_r = models.FloatField(null=True)
+
+    @classmethod
+    def refresh(cls, company, dates):
+        """Пересчитать изменения дней и следующих за ними дней (внутри транзакции сохранения акций)
+
+        Args:
+            company(Company): Компания
+            dates(list of datetime.date): Добавленные и измененные дни
+        """
+        if not dates:
+            return
+
+        stocks = Stock.objects.filter(company=company)
+        # Дни от предыдущего перед первым до следующего после последнего измененного дня
+        date_from = stocks.filter(date__lt=min(dates)).order_by('-date').values_list('date', flat=True).first()
+        date_to = stocks.filter(date__gt=max(dates)).order_by('date').values_list('date', flat=True).first()
+        rows = list(
+            stocks.filter(date__gte=date_from or min(dates), date__lte=date_to or max(dates))
+            .order_by('date').values_list('id', 'date', *analytics.PRICE_COLUMNS)
+        )
+
+        changes = zip(*(
+            analytics.to_list(analytics.change(np.array([i[n] for i in rows], dtype=float)))
+            for n in range(2, 2 + len(analytics.PRICE_COLUMNS))
+        ))
+        dates = set(dates)
+        result = []
+        for n, (row, values) in enumerate(zip(rows, changes)):
+            # Первый день диапазона - предыдущий перед измененными, его изменение не пересчитывается
+            if row[1] in dates or (n and rows[n - 1][1] in dates):
+                result.append((row[0],) + values)
+
+        if _supports_upsert():
+            _upsert(cls, result, conflict_cols=['stock'], update_cols=cls.COLS_RETURNS,
+                    fields=['stock'] + cls.COLS_RETURNS)
+        else:
+            cls.objects.filter(stock_id__in=[i[0] for i in result]).delete()
+            cls.objects.bulk_create(
+                [cls(stock_id=i[0], **dict(zip(cls.COLS_RETURNS, i[1:]))) for i in result],
+                batch_size=_BATCH_SIZE,
+            )
+
+
+class PriceSeries(models.Model):
+    """Ряд цен компании для Stock.get_delta в компактном виде
+
+    Даты (порядковые номера) и цены open/high/low/close по возрастанию дат хранятся
+    массивами в одной записи, поэтому поиск периодов для любого изменения цены
+    не читает акции компании из БД. Сам поиск - один проход по ряду (stock.delta):
+    изменение цены приходит в запросе, заранее посчитать ответ для всех изменений нельзя,
+    а проход по десяткам тысяч дней занимает миллисекунды - дорогими были чтение
+    акций из БД и попарное соединение дней.
+
+    Ряд записывается только при сохранении акций (Stock.store_stocks): добавленные
+    и измененные дни вставляются на свои места, записанная часть ряда до первого
+    из них не пересчитывается. Для компании без записанного ряда (акции сохранены
+    до его появления) запрос строит ряд из акций, ничего не записывая.
+    Акции, удаленные в обход Company, ряд не отслеживает.
+    """
+    # Типы элементов массивов дат и цен
+    _DTYPE_DAYS = '<i4'
+    _DTYPE_VALUES = '<f8'
+
+    company = models.OneToOneField(Company, on_delete=models.CASCADE, null=False)
+    # Порядковые номера дат (datetime.date.toordinal) по возрастанию
+    dates = models.BinaryField()
+    open = models.BinaryField()
+    high = models.BinaryField()
+    low = models.BinaryField()
+    close = models.BinaryField()
+
+    @property
+    def days(self):
+        """Порядковые номера дат
+
+        Returns:
+            numpy.ndarray
+        """
+        return np.frombuffer(bytes(self.dates), dtype=self._DTYPE_DAYS)
+
+    def column(self, column_type):
+        """Цены колонки по датам
+
+        Args:
+            column_type(str): Колонка из Stock._ACCESS_COL_DELTA
+
+        Returns:
+            numpy.ndarray
+        """
+        return np.frombuffer(bytes(getattr(self, column_type)), dtype=self._DTYPE_VALUES)
+
+    def _set_arrays(self, days, columns):
+        self.dates = days.astype(self._DTYPE_DAYS).tobytes()
+        for column_type, values in zip(Stock._ACCESS_COL_DELTA, columns):
+            setattr(self, column_type, values.astype(self._DTYPE_VALUES).tobytes())
+
+    @classmethod
+    def fields_by_rows(cls, rows):
+        """Значения полей ряда по строкам (используется и миграцией заполнения рядов)
+
+        Args:
+            rows(list of tuple): Строки (дата, open, high, low, close, ...) по возрастанию дат
+
+        Returns:
+            dict: Поле -> массив байтами
+        """
+        result = {'dates': np.array([i[0].toordinal() for i in rows], dtype=cls._DTYPE_DAYS).tobytes()}
+        for n, column_type in enumerate(Stock._ACCESS_COL_DELTA, 1):
+            result[column_type] = np.array([i[n] for i in rows], dtype=float).astype(cls._DTYPE_VALUES).tobytes()
+        return result
+
+    def _set_rows(self, rows):
+        """Записать строки (дата, open, high, low, close, ...) по возрастанию дат в массивы"""
+        for name, value in self.fields_by_rows(rows).items():
+            setattr(self, name, value)
+
+    def _merge_rows(self, rows):
+        """Вставить добавленные и заменить измененные дни
+
+        Пересобирается только часть ряда от первого из переданных дней: при обновлении
+        текущего дня или дописывании новых дней это несколько последних элементов.
+
+        Args:
+            rows(list of tuple): Строки (дата, open, high, low, close, ...)
+        """
+        rows = sorted(rows)
+        days = self.days
+        new_days = np.array([i[0].toordinal() for i in rows], dtype=self._DTYPE_DAYS)
+        start = int(np.searchsorted(days, new_days[0]))
+
+        # Переданные дни идут первыми: при совпадении даты np.unique оставляет их значения
+        tail, order = np.unique(np.concatenate((new_days, days[start:])), return_index=True)
+        columns = []
+        for n, column_type in enumerate(Stock._ACCESS_COL_DELTA, 1):
+            values = self.column(column_type)
+            new_values = np.array([i[n] for i in rows], dtype=float)
+            columns.append(np.concatenate((values[:start], np.concatenate((new_values, values[start:]))[order])))
+
+        self._set_arrays(np.concatenate((days[:start], tail)), columns)
+
+    @classmethod
+    def build(cls, company):
+        """Ряд цен компании по сохраненным акциям (не записывается)
+
+        Args:
+            company(Company): Компания
+
+        Returns:
+            PriceSeries
+        """
+        series = cls(company=company)
+        series._set_rows(cls._stock_rows(company))
+        return series
+
+    @staticmethod
+    def _stock_rows(company):
+        return list(
+            Stock.objects.filter(company=company).order_by('date').values_list('date', *Stock._ACCESS_COL_DELTA)
+        )
+
+    @classmethod
+    def get_by_symbol(cls, symbol):
+        """Ряд цен компании (только чтение: не записанный ряд строится по акциям в памяти)
+
+        Args:
+            symbol(str): Сокращенное название компании
+
+        Returns:
+            PriceSeries: None, если компании нет
+        """
+        series = cls.objects.filter(company__symbol=symbol).first()
+        if series is not None:
+            return series
+
+        company = Company.objects.filter(symbol=symbol).first()
+        if company is None:
+            return None
+        return cls.build(company)
+
+    @classmethod
+    def on_store(cls, company, rows):
+        """Обновить ряд компании после сохранения акций (внутри транзакции сохранения)
+
+        Args:
+            company(Company): Компания
+            rows(list of tuple): Добавленные и измененные строки (дата, значения Stock._COLS_VALUES)
+        """
+        if not rows:
+            return
+
+        # Запись ряда блокируется до конца транзакции: параллельное сохранение акций той же
+        # компании ждет и дописывает свои дни к уже обновленному ряду, а не к прочитанному раньше.
+        # Одновременное создание записи get_or_create разрешает через уникальность company
+        series, created = cls.objects.select_for_update().get_or_create(
+            company=company,
+            defaults={i: b'' for i in ['dates'] + Stock._ACCESS_COL_DELTA},
+        )
+        if created:
+            # Акции уже сохранены в этой транзакции, построенный ряд их включает
+            series._set_rows(cls._stock_rows(company))
+        else:
+            series._merge_rows(rows)
+        series.save()
+
+
 class Insider(BaseModels):
     """Совладелец"""
     _COLS_TO_MATCH = ['name', 'url']
@@ -311,6 +960,11 @@ class Insider2Company(BaseModels):
 
 class Trade(BaseModels):
     """Сделки/торги"""
+    # Естественный ключ сделки
+    _COLS_NATURAL_KEY = ['company', 'date', 'type_transaction', 'owner_type', 'insider']
+    _COLS_NATURAL_KEY_ID = ['company_id', 'date', 'type_transaction_id', 'owner_type_id', 'insider_id']
+    # Колонки с данными сделки
+    _COLS_VALUES = ['last_price', 'shares_traded', 'shares_held']
 
     # Дата сделки
     date = models.DateField(null=False)
@@ -330,14 +984,14 @@ class Trade(BaseModels):
     owner_type = models.ForeignKey(TypeOwner, on_delete=models.CASCADE)
 
     class Meta:
-        # Уникальность записей по компании и дате,
-        # unique_together = (('company', 'date'),)
+        # Уникальность сделки по компании, дате, типу транзакции, типу владельца и совладельцу
+        unique_together = (('company', 'date', 'type_transaction', 'owner_type', 'insider'),)
         index_together = (('company', 'date'),)
 
     @staticmethod
     def store_trades(data):
         """
-        Сохранение списка торгов совладельцев компании
+        Сохранение списка торгов совледельцев компании
 
         Args:
             data (dict): данные о акциях
@@ -345,55 +999,141 @@ class Trade(BaseModels):
                     'company_industry': str
                     'company_symbol': str,
                     'trades': list,
+                    'columns': dict,  # вместо trades - колонки parsers.ParserTrade.get_columns
+                }
+
+        Returns:
+            dict: Количество добавленных, обновленных и пропущенных (не изменившихся) записей
+                {
+                    'inserted': int,
+                    'updated': int,
+                    'skipped': int,
                 }
         """
-        ind = Industry.get_with_save(name=data.get('company_industry'))
-        comp = Company.get_with_save(
-            symbol=data.get('company_symbol'),
-            industry=ind
-        )
+        trades_data = Trade._trades_data(data)
 
-        for trade_data in data['trades']:
-            insider_dict = trade_data.pop('insider')
-            insider = Insider.get_with_save(**insider_dict)
+        with _write_transaction():
+            ind = Industry.get_with_save(name=data.get('company_industry'))
+            comp = Company.get_with_save(
+                symbol=data.get('company_symbol'),
+                industry=ind
+            )
+            if not trades_data:
+                return {'inserted': 0, 'updated': 0, 'skipped': 0}
+
+            # Справочники всей страницы разрешаем пачкой
+            insiders = Insider.get_many_with_save([i['insider'] for i in trades_data])
+            relations = Relation.get_many_with_save([{'name': i['relation']} for i in trades_data])
+            owner_types = TypeOwner.get_many_with_save([{'name': i['owner_type']} for i in trades_data])
+            type_transactions = TypeTransaction.get_many_with_save(
+                [{'name': i['type_transaction']} for i in trades_data]
+            )
 
-            relation_str = trade_data.pop('relation')
-            relation = Relation.get_with_save(name=relation_str)
+            # Одна запись на естественный ключ, при повторе на странице берем последнюю
+            trades = collections.OrderedDict()
+            insider2company = []
+            for trade_data in trades_data:
+                insider = insiders[Insider.match_key(**trade_data['insider'])]
+                insider2company.append({
+                    'insider': insider,
+                    'company': comp,
+                    'relation': relations[Relation.match_key(name=trade_data['relation'])],
+                })
+
+                trade = {
+                    'company': comp.id,
+                    'date': trade_data['date'],
+                    'type_transaction': type_transactions[
+                        TypeTransaction.match_key(name=trade_data['type_transaction'])].id,
+                    'owner_type': owner_types[TypeOwner.match_key(name=trade_data['owner_type'])].id,
+                    'insider': insider.id,
+                }
+                trade.update({i: trade_data.get(i) for i in Trade._COLS_VALUES})
+                trades[tuple(trade[i] for i in Trade._COLS_NATURAL_KEY)] = trade
 
-            owner_type_str = trade_data.pop('owner_type')
-            owner_type = TypeOwner.get_with_save(name=owner_type_str)
+            Insider2Company.get_many_with_save(insider2company)
 
-            type_transaction_str = trade_data.pop('type_transaction')
-            type_transaction = TypeTransaction.get_with_save(name=type_transaction_str)
+            # Все уже сохраненные торги компании за период страницы одним запросом
+            dates = [i['date'] for i in trades.values()]
+            existing = {}
+            for row in Trade.objects.filter(
+                    company=comp,
+                    date__gte=min(dates),
+                    date__lte=max(dates),
+            ).values_list('id', *(Trade._COLS_NATURAL_KEY_ID + Trade._COLS_VALUES)):
+                key_size = len(Trade._COLS_NATURAL_KEY)
+                existing[row[1:key_size + 1]] = (row[0], list(row[key_size + 1:]))
+
+            new_trades = []
+            changed_trades = []
+            for key, trade in trades.items():
+                old = existing.get(key)
+                if old is None:
+                    new_trades.append(trade)
+                elif old[1] != [trade[i] for i in Trade._COLS_VALUES]:
+                    changed_trades.append((old[0], trade))
+
+            if _supports_upsert():
+                _upsert(
+                    Trade,
+                    new_trades + [i for _, i in changed_trades],
+                    conflict_cols=Trade._COLS_NATURAL_KEY,
+                    update_cols=Trade._COLS_VALUES,
+                )
+            else:
+                Trade.objects.bulk_create(
+                    [
+                        Trade(**{Trade._meta.get_field(k).attname: v for k, v in i.items()})
+                        for i in new_trades
+                    ],
+                    batch_size=_BATCH_SIZE,
+                )
+                for trade_id, trade in changed_trades:
+                    Trade.objects.filter(id=trade_id).update(
+                        **{i: trade[i] for i in Trade._COLS_VALUES}
+                    )
 
-            Insider2Company.get_with_save(
-                insider=insider,
-                company=comp,
-                relation=relation
-            )
+        return {
+            'inserted': len(new_trades),
+            'updated': len(changed_trades),
+            'skipped': len(trades) - len(new_trades) - len(changed_trades),
+        }
 
-            trade = Trade(
-                company=comp,
-                insider=insider,
-                owner_type=owner_type,
-                type_transaction=type_transaction,
-                **trade_data
-            )
+    @staticmethod
+    def _trades_data(data):
+        """Торги построчно из построчного или колоночного формата
 
-            # Ищем в БД торги
-            kw = {}
-            st_s = list(Trade.objects.filter(
-                company=comp,
-                date=trade_data.get('date'),
-                type_transaction=type_transaction,
-                owner_type=owner_type,
-                insider=insider
-            ).values_list('id')[0:1])
-            if st_s:
-                kw['force_update'] = True
-                trade.id = st_s[0][0]
-
-            trade.save(**kw)
+        Справочники торгов сопоставляются по строкам, поэтому колонки сводятся к строкам здесь,
+        одним проходом без промежуточных преобразований значений.
+
+        Args:
+            data(dict): Данные о торгах (см. store_trades)
+
+        Returns:
+            list of dict
+        """
+        columns = data.get('columns')
+        if columns is None:
+            return data['trades']
+
+        return [
+            {
+                'insider': {'url': url, 'name': name},
+                'relation': relation,
+                'date': date,
+                'type_transaction': type_transaction,
+                'owner_type': owner_type,
+                'shares_traded': shares_traded,
+                'last_price': last_price,
+                'shares_held': shares_held,
+            }
+            for name, url, relation, date, type_transaction, owner_type, shares_traded, last_price, shares_held
+            in zip(*(
+                _nan2none(columns[i]) if i in Trade._COLS_VALUES else columns[i]
+                for i in ('insider_name', 'insider_url', 'relation', 'date', 'type_transaction', 'owner_type',
+                          'shares_traded', 'last_price', 'shares_held')
+            ))
+        ]
 
     @classmethod
     def get_by_symbol_and_date(cls, symbol, insider=None, date_from=None, date_to=None, field_values=None):
@@ -422,3 +1162,362 @@ class Trade(BaseModels):
             query = query.values(*field_values)
 
         return list(query.order_by('-date').all())
+
+
+class ScanTask(models.Model):
+    """Журнал задач загрузки: по нему прерванная загрузка продолжается с незавершенных задач
+
+    Он же общая очередь задач для нескольких процессов загрузки (runscan --worker):
+    задачи захватываются в аренду на lease_timeout секунд, задачи упавшего
+    процесса по истечении аренды захватывает другой процесс. Журнал и общая очередь
+    хранятся в одной таблице, но не пересекаются: все запросы отбирают записи по queue.
+    """
+    # Статусы задачи
+    PENDING = 'pending'
+    IN_PROGRESS = 'in_progress'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUSES = (PENDING, IN_PROGRESS, DONE, FAILED)
+    # Статусы незавершенных задач
+    UNFINISHED = (PENDING, IN_PROGRESS)
+    # Очереди задач: журнал загрузки одного процесса и общая очередь процессов
+    JOURNAL = 'journal'
+    SHARED = 'shared'
+    QUEUES = (JOURNAL, SHARED)
+
+    # Очередь задачи
+    queue = models.CharField(max_length=16, null=False, default=JOURNAL, choices=[(i, i) for i in QUEUES])
+    # Ссылка на страницу (уникальна в пределах очереди)
+    url = models.CharField(max_length=1000, null=False)
+    # Тип задачи (stock, trade)
+    task_type = models.CharField(max_length=16, null=False)
+    # Сокращенное название компании
+    symbol = models.CharField(max_length=255, null=False)
+    # Страница торгов, поставленная в очередь разом с остальными
+    fan_out = models.BooleanField(default=False)
+    # Статус
+    status = models.CharField(max_length=16, null=False, default=PENDING, db_index=True,
+                              choices=[(i, i) for i in STATUSES])
+    # Количество начатых попыток
+    attempts = models.IntegerField(default=0)
+    # Время последнего изменения
+    updated = models.DateTimeField(auto_now=True)
+    # Процесс, захвативший задачу
+    worker = models.CharField(max_length=255, null=False, default='')
+    # Идентификатор захвата (по нему процесс находит захваченные задачи)
+    claim = models.CharField(max_length=32, null=False, default='', db_index=True)
+    # Время окончания аренды задачи процессом
+    lease_until = models.DateTimeField(null=True)
+
+    class Meta:
+        unique_together = (('queue', 'url'),)
+
+    def to_task(self):
+        """Задача загрузки по записи журнала
+
+        Returns:
+            dict
+        """
+        task = {'task_type': self.task_type, 'symbol': self.symbol, 'url': self.url}
+        if self.fan_out:
+            task['fan_out'] = True
+        return task
+
+    @staticmethod
+    def add_tasks(queue, tasks, requeue=False):
+        """Добавление задач в очередь, уже записанные задачи пропускаются
+
+        Args:
+            queue(str): Очередь (JOURNAL, SHARED)
+            tasks(list of dict): Задачи
+            requeue(bool): Вернуть в очередь уже завершенные (done, failed) задачи
+
+        Returns:
+            list of dict: Задачи, которых не было в очереди (и возвращенные в очередь)
+        """
+        if not tasks:
+            return []
+
+        try:
+            return ScanTask._add_tasks(queue, tasks, requeue)
+        except IntegrityError:
+            # Те же задачи одновременно добавил другой процесс
+            return ScanTask._add_tasks(queue, tasks, requeue)
+
+    @staticmethod
+    def _add_tasks(queue, tasks, requeue):
+        with _write_transaction():
+            existing = dict(
+                ScanTask.objects.filter(queue=queue, url__in=[i['url'] for i in tasks]).values_list('url', 'status')
+            )
+            finished = set()
+            if requeue:
+                finished = {url for url, status in existing.items() if status not in ScanTask.UNFINISHED}
+                ScanTask.objects.filter(queue=queue, url__in=finished).update(
+                    status=ScanTask.PENDING, worker='', claim='', lease_until=None, updated=timezone.now())
+
+            new_tasks = []
+            requeued = []
+            for task in tasks:
+                if task['url'] not in existing:
+                    existing[task['url']] = ScanTask.PENDING
+                    new_tasks.append(task)
+                elif task['url'] in finished:
+                    finished.discard(task['url'])
+                    requeued.append(task)
+
+            ScanTask.objects.bulk_create(
+                [
+                    ScanTask(
+                        queue=queue,
+                        url=i['url'],
+                        task_type=i['task_type'],
+                        symbol=i['symbol'],
+                        fan_out=bool(i.get('fan_out')),
+                    )
+                    for i in new_tasks
+                ],
+                batch_size=_BATCH_SIZE,
+            )
+
+        return new_tasks + requeued
+
+    @staticmethod
+    def start(queue, url, worker, lease_timeout):
+        """Отметить начало выполнения задачи процессом, задача берется в аренду
+
+        Args:
+            queue(str): Очередь
+            url(str): Ссылка задачи
+            worker(str): Название процесса
+            lease_timeout(float): Длительность аренды в секундах
+        """
+        now = timezone.now()
+        with _write_transaction():
+            ScanTask.objects.filter(queue=queue, url=url).update(
+                status=ScanTask.IN_PROGRESS,
+                attempts=models.F('attempts') + 1,
+                worker=worker,
+                lease_until=now + datetime.timedelta(seconds=lease_timeout),
+                updated=now,
+            )
+
+    @staticmethod
+    def finish(queue, url, status, worker, new_tasks=None, requeue=False):
+        """Завершение задачи процессом, который ее выполняет
+
+        Если аренда истекла и задачу захватил другой процесс, задача не меняется
+        и найденные задачи не добавляются: их добавит новый владелец.
+
+        Args:
+            queue(str): Очередь
+            url(str): Ссылка задачи
+            status(str): Новый статус (DONE, FAILED)
+            worker(str): Название процесса
+            new_tasks(list of dict): Найденные на странице задачи (следующие страницы торгов)
+            requeue(bool): Вернуть в очередь уже завершенные найденные задачи
+
+        Returns:
+            list of dict: Найденные задачи, которых не было в очереди (см. add_tasks),
+                None - задача выполняется другим процессом
+        """
+        with _write_transaction():
+            count = ScanTask.objects.filter(
+                queue=queue, url=url, status=ScanTask.IN_PROGRESS, worker=worker
+            ).update(status=status, lease_until=None, updated=timezone.now())
+            if not count:
+                return None
+            # Найденные задачи записываются в той же транзакции, что и завершение задачи,
+            # поэтому после аварийного завершения ни одна найденная страница не теряется
+            return ScanTask.add_tasks(queue, new_tasks or [], requeue=requeue)
+
+    @staticmethod
+    def renew(queue, worker, lease_timeout):
+        """Продление аренды всех выполняемых процессом задач
+
+        Args:
+            queue(str): Очередь
+            worker(str): Название процесса
+            lease_timeout(float): Длительность аренды в секундах
+
+        Returns:
+            int: Количество задач с продленной арендой
+        """
+        now = timezone.now()
+        with _write_transaction():
+            return ScanTask.objects.filter(queue=queue, status=ScanTask.IN_PROGRESS, worker=worker).update(
+                lease_until=now + datetime.timedelta(seconds=lease_timeout), updated=now)
+
+    @staticmethod
+    def iter_unfinished(queue, chunk_size=1000):
+        """Незавершенные задачи очереди, записанные до вызова
+
+        Задачи читаются порциями по id. Задачи, добавленные в очередь во время обхода
+        (следующие страницы торгов), не возвращаются: их ставит в очередь исполнитель.
+
+        Args:
+            queue(str): Очередь
+            chunk_size(int): Количество задач в одном запросе
+
+        Returns:
+            generator of dict
+        """
+        max_id = ScanTask.objects.filter(queue=queue).aggregate(max_id=models.Max('id'))['max_id'] or 0
+        last_id = 0
+        while True:
+            rows = list(
+                ScanTask.objects.filter(queue=queue, id__gt=last_id, id__lte=max_id, status__in=ScanTask.UNFINISHED)
+                .order_by('id')[:chunk_size]
+            )
+            if not rows:
+                return
+            for row in rows:
+                yield row.to_task()
+            last_id = rows[-1].id
+
+    @staticmethod
+    def claim_tasks(queue, worker, limit, lease_timeout):
+        """Захват задач очереди в аренду
+
+        Захватываются ожидающие задачи и задачи с истекшей арендой (или без аренды -
+        выполнение прервано до ее записи). Захват выполняется одним UPDATE: в Postgres
+        строки выбираются через SELECT ... FOR UPDATE SKIP LOCKED (процессы не ждут
+        друг друга и не захватывают одни и те же строки), в SQLite запрос на запись
+        и так выполняется под блокировкой всей базы.
+
+        Args:
+            queue(str): Очередь
+            worker(str): Название процесса
+            limit(int): Максимальное количество задач
+            lease_timeout(float): Длительность аренды в секундах
+
+        Returns:
+            list of dict: Захваченные задачи
+        """
+        qn = connection.ops.quote_name
+        lock = ' FOR UPDATE SKIP LOCKED' if connection.features.has_select_for_update_skip_locked else ''
+        query = (
+            'UPDATE {table} SET {status} = %s, {worker} = %s, {claim} = %s, {lease_until} = %s, '
+            '{attempts} = {attempts} + 1, {updated} = %s '
+            'WHERE {id} IN ('
+            'SELECT {id} FROM {table} WHERE {queue} = %s AND ('
+            '{status} = %s OR ({status} = %s AND ({lease_until} IS NULL OR {lease_until} < %s))) '
+            'ORDER BY {id} LIMIT %s{lock})'
+        ).format(
+            table=qn(ScanTask._meta.db_table),
+            lock=lock,
+            **{i: qn(ScanTask._meta.get_field(i).column)
+               for i in ['id', 'queue', 'status', 'worker', 'claim', 'lease_until', 'attempts', 'updated']}
+        )
+
+        now = timezone.now()
+        claim = uuid.uuid4().hex
+        adapt = connection.ops.adapt_datetimefield_value
+        params = [
+            ScanTask.IN_PROGRESS, worker, claim, adapt(now + datetime.timedelta(seconds=lease_timeout)), adapt(now),
+            queue, ScanTask.PENDING, ScanTask.IN_PROGRESS, adapt(now), limit,
+        ]
+        with _write_transaction():
+            with connection.cursor() as cursor:
+                cursor.execute(query, params)
+            rows = list(ScanTask.objects.filter(claim=claim).order_by('id'))
+
+        return [i.to_task() for i in rows]
+
+    @staticmethod
+    def has_unfinished(queue):
+        """Есть ли в очереди ожидающие задачи или задачи, выполняемые процессами
+
+        Args:
+            queue(str): Очередь
+
+        Returns:
+            bool
+        """
+        return ScanTask.objects.filter(queue=queue, status__in=ScanTask.UNFINISHED).exists()
+
+
+class Refresh(models.Model):
+    """Время последнего обновления данных компании по типу задачи (для непрерывного обновления)"""
+
+    # Сокращенное название компании
+    symbol = models.CharField(max_length=255, null=False)
+    # Тип задачи (stock, trade)
+    task_type = models.CharField(max_length=16, null=False)
+    # Отслеживаемая компания (обновляется чаще)
+    watched = models.BooleanField(default=False)
+    # Время последнего успешного обновления
+    refreshed = models.DateTimeField(null=True, db_index=True)
+    # Время последней неуспешной попытки (после успешного обновления сбрасывается)
+    attempted = models.DateTimeField(null=True)
+
+    class Meta:
+        unique_together = (('symbol', 'task_type'),)
+
+    @staticmethod
+    def add_symbols(symbols, task_types):
+        """Добавление компаний в расписание обновления, уже добавленные пропускаются
+
+        Args:
+            symbols(list of str): Сокращенные названия компаний
+            task_types(list of str): Типы задач
+
+        Returns:
+            int: Количество добавленных записей
+        """
+        if not symbols:
+            return 0
+
+        with _write_transaction():
+            existing = set(Refresh.objects.filter(symbol__in=symbols).values_list('symbol', 'task_type'))
+            new_rows = []
+            for symbol in symbols:
+                for task_type in task_types:
+                    if (symbol, task_type) not in existing:
+                        existing.add((symbol, task_type))
+                        new_rows.append(Refresh(symbol=symbol, task_type=task_type))
+
+            Refresh.objects.bulk_create(new_rows, batch_size=_BATCH_SIZE)
+
+        return len(new_rows)
+
+    @staticmethod
+    def set_watched(symbols):
+        """Отметить отслеживаемые компании (остальные перестают быть отслеживаемыми)
+
+        Args:
+            symbols(list of str): Сокращенные названия компаний
+        """
+        with _write_transaction():
+            Refresh.objects.exclude(symbol__in=symbols).filter(watched=True).update(watched=False)
+            Refresh.objects.filter(symbol__in=symbols).update(watched=True)
+
+    @staticmethod
+    def mark(symbol, task_type, success):
+        """Учесть результат обновления
+
+        Args:
+            symbol(str): Сокращенное название компании
+            task_type(str): Тип задачи
+            success(bool): Обновление успешно
+        """
+        fields = {'refreshed': timezone.now(), 'attempted': None} if success else {'attempted': timezone.now()}
+        with _write_transaction():
+            Refresh.objects.filter(symbol=symbol, task_type=task_type).update(**fields)
+
+
+@receiver(post_delete, sender=TypeTransaction)
+@receiver(post_delete, sender=Industry)
+@receiver(post_delete, sender=TypeOwner)
+@receiver(post_delete, sender=Relation)
+@receiver(post_delete, sender=Company)
+@receiver(post_delete, sender=Insider)
+@receiver(post_delete, sender=Insider2Company)
+@receiver(post_migrate)
+def _clear_lookup_cache(**kwargs):
+    """Очистить кэш справочников после удаления записей справочника или очистки таблиц (migrate, flush)
+
+    Вместе с записью каскадно удаляются зависимые записи, id которых тоже могут быть
+    в кэше, поэтому кэш очищается целиком.
+    """
+    lookup_cache.clear()
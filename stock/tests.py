@@ -0,0 +1,228 @@
+"""Модуль тестирования хранения и обработки акций"""
+import io
+import os
+import tempfile
+from unittest import mock
+
+from django.core.management import call_command
+from django.test import TestCase, TransactionTestCase
+
+from parser import parsers
+from stock import column_store, delta, models
+from stock.cache import LRUCache
+
+# Сохраненные страницы источника (общие с тестами парсера)
+_FILES_EXAMPLE = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'parser', 'tests', 'files_example')
+
+
+class TestDelta(TestCase):
+
+    def test_find_deltas(self):
+        """Проверка поиска периодов за один проход: те же периоды, что перебором всех пар дней"""
+        with open(os.path.join(_FILES_EXAMPLE, 'stock.html'), 'r') as file:
+            d = parsers.ParserStock(file.read()).get_data()
+        d.update({'company_symbol': 'goog'})
+        models.Stock.store_stocks(d)
+
+        rows = sorted((i['date'], i['close']) for i in d['stocks'])
+        dates = [i[0] for i in rows]
+        for change in (0.5, 5, 50):
+            for sign in (1, -1):
+                # Для каждого дня конца - самый поздний день начала из пар с изменением не меньше change
+                expected = {}
+                for i in range(len(rows)):
+                    for j in range(i + 1, len(rows)):
+                        if sign * (rows[j][1] - rows[i][1]) >= change:
+                            expected[j] = i
+                            break
+                expected = sorted(((dates[j] - dates[i]).days, dates[i], dates[j]) for j, i in expected.items())
+
+                with self.subTest(change=change, sign=sign):
+                    result = models.Stock.get_delta('goog', 'close', change)
+                    self.assertEqual(result['up' if sign > 0 else 'down'], expected)
+
+    def test_series(self):
+        """Проверка ряда цен: новые, пропущенные и измененные дни вставляются на место, запрос ничего не записывает"""
+        with open(os.path.join(_FILES_EXAMPLE, 'stock.html'), 'r') as file:
+            d = parsers.ParserStock(file.read()).get_data()
+        d['stocks'].sort(key=lambda i: i['date'])
+        stocks = d['stocks']
+
+        def expected():
+            rows = sorted((i['date'], i['open']) for i in stocks)
+            return delta.find_deltas([i[0] for i in rows], [i[1] for i in rows], 2)
+
+        # Третий день пропущен: он будет добавлен позже в середину ряда
+        d.update({'company_symbol': 'goog', 'stocks': stocks[:2] + stocks[3:len(stocks) // 2]})
+        models.Stock.store_stocks(d)
+        series_id = models.PriceSeries.objects.get().id
+
+        for rows in (stocks[len(stocks) // 2:], stocks[2:3]):
+            d['stocks'] = rows
+            models.Stock.store_stocks(d)
+        # Изменение первого и последнего (текущего) дня
+        stocks[0]['open'] += 100
+        stocks[-1]['open'] -= 100
+        d['stocks'] = [stocks[0], stocks[-1]]
+        models.Stock.store_stocks(d)
+
+        series = models.PriceSeries.objects.get()
+        self.assertEqual(series.id, series_id)
+        self.assertEqual(series.days.tolist(), [i['date'].toordinal() for i in stocks])
+        self.assertEqual(series.column('open').tolist(), [i['open'] for i in stocks])
+        self.assertEqual(models.Stock.get_delta('goog', 'open', 2), expected())
+
+        # Без записанного ряда запрос строит его по акциям и ничего не записывает
+        models.PriceSeries.objects.all().delete()
+        self.assertEqual(models.Stock.get_delta('goog', 'open', 2), expected())
+        self.assertFalse(models.PriceSeries.objects.exists())
+        self.assertEqual(models.Stock.get_delta('none', 'open', 2), {'up': [], 'down': []})
+
+
+class TestAnalytics(TestCase):
+
+    def test_analytics(self):
+        """Проверка аналитики: изменения к предыдущему дню с учетом дней перед периодом, окна и просадка"""
+        with open(os.path.join(_FILES_EXAMPLE, 'stock.html'), 'r') as file:
+            d = parsers.ParserStock(file.read()).get_data()
+        d.update({'company_symbol': 'goog'})
+        models.Stock.store_stocks(d)
+
+        stocks = sorted(d['stocks'], key=lambda i: i['date'])
+        window = 5
+        date_from = stocks[10]['date']
+        rows = models.Stock.get_analytics_by_symbol_and_dates(
+            'goog', date_from=date_from, date_to=stocks[-1]['date'], window=window)
+
+        self.assertEqual([i['date'] for i in rows], [i['date'] for i in stocks[10:]][::-1])
+        closes = [i['close'] for i in stocks]
+        for row in rows:
+            n = [i['date'] for i in stocks].index(row['date'])
+            with self.subTest(date=row['date']):
+                self.assertAlmostEqual(row['open_r'], 100 - 100 * stocks[n - 1]['open'] / stocks[n]['open'])
+                self.assertAlmostEqual(row['close_ma'], sum(closes[n - window + 1:n + 1]) / window)
+                day_returns = [100 * closes[i] / closes[i - 1] - 100 for i in range(n - window + 1, n + 1)]
+                mean = sum(day_returns) / window
+                self.assertAlmostEqual(
+                    row['close_volatility'], (sum((i - mean) ** 2 for i in day_returns) / (window - 1)) ** 0.5)
+                self.assertAlmostEqual(row['close_drawdown'], 100 * closes[n] / max(closes[10:n + 1]) - 100)
+
+        rows = models.Stock.get_analytics_by_symbol_and_dates(
+            'goog', date_from=stocks[0]['date'], date_to=stocks[-1]['date'], field_values=['date', 'close_r'])
+        self.assertEqual(rows[-1], {'date': stocks[0]['date'], 'close_r': None})
+
+    def test_stored_returns(self):
+        """Проверка изменений к предыдущему дню, сохраняемых при загрузке: вставка дня в середину и исправление"""
+        with open(os.path.join(_FILES_EXAMPLE, 'stock.html'), 'r') as file:
+            d = parsers.ParserStock(file.read()).get_data()
+        stocks = sorted(d['stocks'], key=lambda i: i['date'])
+        d.update({'company_symbol': 'goog'})
+
+        def check():
+            rows = list(models.Stock.objects.order_by('date').values_list('open', 'returns__open_r'))
+            self.assertIsNone(rows[0][1])
+            for previous, row in zip(rows, rows[1:]):
+                self.assertAlmostEqual(row[1], 100 - 100 * previous[0] / row[0])
+
+        d['stocks'] = stocks[:5] + stocks[6:]
+        models.Stock.store_stocks(d)
+        check()
+        d['stocks'] = [stocks[5]]
+        models.Stock.store_stocks(d)
+        check()
+        stocks[5]['open'] += 10
+        stocks[0]['open'] += 10
+        d['stocks'] = [stocks[0], stocks[5]]
+        models.Stock.store_stocks(d)
+        check()
+        self.assertEqual(models.StockReturn.objects.count(), len(stocks))
+
+
+class TestColumnStore(TransactionTestCase):
+
+    def test_store(self):
+        """Проверка хранилища для чтения: дописывание новых дней, перезапись при исправлении, те же ответы, что из БД"""
+        with open(os.path.join(_FILES_EXAMPLE, 'stock.html'), 'r') as file:
+            d = parsers.ParserStock(file.read()).get_data()
+        stocks = sorted(d['stocks'], key=lambda i: i['date'])
+        d.update({'company_symbol': 'goog'})
+        fields = ['date', 'open', 'close', 'volume']
+
+        def read():
+            args = {'date_from': stocks[3]['date'], 'date_to': stocks[-1]['date']}
+            return (
+                models.Stock.get_by_symbol_and_date('goog', field_values=fields, **args),
+                models.Stock.get_analytics_by_symbol_and_dates('goog', window=5, **args),
+            )
+
+        with tempfile.TemporaryDirectory() as tmp_dir, self.settings(STOCK_COLUMN_STORE_DIR=tmp_dir):
+            store = column_store.get_store()
+            d['stocks'] = stocks[:-3]
+            models.Stock.store_stocks(d)
+            self.assertEqual(len(store.read('goog')), len(stocks) - 3)
+
+            data = store.read('goog')
+            # Недописанная запись прерванного дописывания
+            with open(store._file('goog'), 'ab') as file:
+                file.write(b'\0' * 10)
+            d['stocks'] = stocks[-3:]
+            models.Stock.store_stocks(d)
+            self.assertEqual(store.read('goog')['date'].tolist(), [i['date'].toordinal() for i in stocks])
+            # Новые дни дописаны в тот же файл
+            self.assertEqual(store.read('goog')[:len(data)].tobytes(), data.tobytes())
+
+            stocks[5]['close'] += 1
+            d['stocks'] = [stocks[5]]
+            models.Stock.store_stocks(d)
+            self.assertEqual(store.read('goog')['close'][5], stocks[5]['close'])
+
+            stored = read()
+            self.assertIsNone(store.read('none'))
+            self.assertEqual(models.Stock.get_by_symbol_and_date('none', field_values=fields), [])
+            # Запросы несуществующих компаний не создают файлов
+            self.assertEqual(len(os.listdir(tmp_dir)), 2)
+
+        self.assertEqual(stored, read())
+
+    def test_build(self):
+        """Проверка хранилища для чтения: чтение не создает файлов, файлы строит команда"""
+        with open(os.path.join(_FILES_EXAMPLE, 'stock.html'), 'r') as file:
+            d = parsers.ParserStock(file.read()).get_data()
+        d.update({'company_symbol': 'goog'})
+        models.Stock.store_stocks(d)
+        expected = models.Stock.get_by_symbol_and_date('goog', field_values=['date', 'close'])
+
+        with tempfile.TemporaryDirectory() as tmp_dir, self.settings(STOCK_COLUMN_STORE_DIR=tmp_dir):
+            store = column_store.get_store()
+            self.assertEqual(models.Stock.get_by_symbol_and_date('goog', field_values=['date', 'close']), expected)
+            self.assertIsNone(store.read('goog'))
+
+            call_command('buildcolumnstore', stdout=io.StringIO())
+            self.assertEqual(len(store.read('goog')), len(d['stocks']))
+            self.assertEqual(models.Stock.get_by_symbol_and_date('goog', field_values=['date', 'close']), expected)
+
+            # Ошибка записи файла: файл удаляется, чтение идет из БД
+            with mock.patch.object(store, 'write', side_effect=OSError('disk full')):
+                self.assertFalse(models.Stock.update_column_store('goog', [d['stocks'][0]['date']]))
+            self.assertIsNone(store.read('goog'))
+
+
+class TestLRUCache(TestCase):
+
+    def test_eviction_and_stats(self):
+        """Проверка вытеснения давно неиспользуемых записей, удаления и счетчиков попаданий"""
+        cache = LRUCache(maxsize=2)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        self.assertEqual(cache.get('a'), 1)
+        cache.set('c', 3)
+
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.get('c'), 3)
+        self.assertEqual(cache.stats(), {'hits': 2, 'misses': 1, 'size': 2, 'maxsize': 2})
+
+        cache.delete('c')
+        cache.delete('missing')
+        self.assertIsNone(cache.get('c'))
+        self.assertEqual(cache.get('a'), 1)